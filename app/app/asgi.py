@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Django's ASGIHandler, able to send the async views' event streams as
+# they are produced (see vision.asgi)
+from vision.asgi import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
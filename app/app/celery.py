@@ -0,0 +1,19 @@
+"""
+Celery config for app project.
+
+Workers are started with ``celery -A app worker``. Tasks are discovered from
+the ``tasks.py`` module of every installed app.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+app = Celery('app')
+
+# Read every CELERY_* setting from Django settings
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+app.autodiscover_tasks()
@@ -144,6 +144,11 @@ STATIC_ROOT = '/vol/web/static'  # This matches the volume mounted in your docke
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Wireframe uploads are streamed to temporary files here (see
+# vision.uploads); on the same filesystem as MEDIA_ROOT, saving an upload is
+# a rename
+FILE_UPLOAD_TEMP_DIR = os.environ.get('FILE_UPLOAD_TEMP_DIR') or None
+
 
 STATICFILES_DIRS = [
     
@@ -189,3 +194,153 @@ GOOGLE_APPLICATION_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'
 # Google Gemini API settings
 GOOGLE_GEMINI_API_KEY = os.environ.get('GOOGLE_GEMINI_API_KEY')
 
+
+# Wireframe processing pipeline
+# 'sync' runs Vision + Gemini inside the upload request, 'job' queues it for a
+# Celery worker and the upload returns 202 straight away
+VISION_PIPELINE_MODE = os.environ.get('VISION_PIPELINE_MODE', 'sync')
+
+# Celery
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'memory://')
+# Run tasks in-process, without a broker or worker (local development/tests)
+CELERY_TASK_ALWAYS_EAGER = bool(
+    int(os.environ.get('CELERY_TASK_ALWAYS_EAGER', 0))
+)
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Reuse results of an earlier upload with the same image hash and theme:
+# 'user' (same uploader only), 'global' (any user) or 'off'
+WIREFRAME_DEDUPE_SCOPE = os.environ.get('WIREFRAME_DEDUPE_SCOPE', 'user')
+
+# Cache of parsed Gemini responses keyed on (model, prompt, theme)
+# BACKEND: 'lru' (in-process), 'django' (CACHES[CACHE_ALIAS]), 'file'
+# (JSON files under LOCATION), 'none', or a dotted path to a
+# vision.cache.BaseResponseCache subclass
+GEMINI_RESPONSE_CACHE = {
+    'BACKEND': os.environ.get('GEMINI_CACHE_BACKEND', 'lru'),
+    'TTL': int(os.environ.get('GEMINI_CACHE_TTL', 24 * 60 * 60)),
+    'MAX_ENTRIES': int(os.environ.get('GEMINI_CACHE_MAX_ENTRIES', 256)),
+    'LOCATION': os.environ.get(
+        'GEMINI_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'gemini')
+    ),
+    'CACHE_ALIAS': 'default',
+}
+
+# Batch uploads: images accepted per request and Gemini calls run in parallel
+WIREFRAME_BATCH_MAX_IMAGES = int(
+    os.environ.get('WIREFRAME_BATCH_MAX_IMAGES', 50)
+)
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 4))
+
+# Image preprocessing before OCR (see vision.preprocess)
+# MODE: 'grayscale', 'binarize' (black and white) or 'color'
+VISION_PREPROCESS = {
+    'ENABLED': bool(int(os.environ.get('VISION_PREPROCESS', 1))),
+    'MAX_DIMENSION': int(os.environ.get('VISION_MAX_DIMENSION', 2048)),
+    'MODE': os.environ.get('VISION_PREPROCESS_MODE', 'grayscale'),
+    'BINARIZE_THRESHOLD': 160,
+    'FORMAT': os.environ.get('VISION_PREPROCESS_FORMAT', 'JPEG'),
+    'JPEG_QUALITY': 85,
+}
+
+# Element detection: 'vision' (Google Vision), 'local' (offline Pillow/NumPy
+# detector) or 'auto' (Vision with the local detector as fallback)
+VISION_DETECTION_ENGINE = os.environ.get('VISION_DETECTION_ENGINE', 'auto')
+# Longest side, in pixels, images are reduced to before local detection
+LOCAL_DETECTOR_MAX_DIMENSION = int(
+    os.environ.get('LOCAL_DETECTOR_MAX_DIMENSION', 1024)
+)
+
+# Rules used to classify OCR words into UI element types. Leave unset to use
+# vision.classification.DEFAULT_CLASSIFICATION_RULES
+VISION_CLASSIFICATION_RULES = None
+
+# Group OCR words into lines/blocks/rows before classification and prompting
+VISION_LAYOUT_ANALYSIS = bool(int(os.environ.get('VISION_LAYOUT_ANALYSIS', 1)))
+
+# Maximum prompt size sent to Gemini, in tokens. Over this, the
+# lowest-priority elements are left out of the prompt. 0 disables the limit
+GEMINI_PROMPT_TOKEN_BUDGET = int(
+    os.environ.get('GEMINI_PROMPT_TOKEN_BUDGET', 6000)
+)
+
+# Seconds between checks of the Gemini credential files for changes; the
+# key and model are reloaded when one changes. 0 disables the watcher
+GEMINI_CREDENTIALS_WATCH_INTERVAL = int(
+    os.environ.get('GEMINI_CREDENTIALS_WATCH_INTERVAL', 30)
+)
+
+# Wireframe listing: default and maximum number of wireframes per page
+WIREFRAME_LIST_PAGE_SIZE = int(os.environ.get('WIREFRAME_LIST_PAGE_SIZE', 20))
+WIREFRAME_LIST_MAX_PAGE_SIZE = int(
+    os.environ.get('WIREFRAME_LIST_MAX_PAGE_SIZE', 100)
+)
+
+# Generated code larger than this (in characters), or taking longer than
+# CODE_FORMAT_TIMEOUT seconds to format, is stored unformatted
+CODE_FORMAT_MAX_CHARS = int(
+    os.environ.get('CODE_FORMAT_MAX_CHARS', 512 * 1024)
+)
+CODE_FORMAT_TIMEOUT = float(os.environ.get('CODE_FORMAT_TIMEOUT', 1.0))
+
+# 'wsgi' (uWSGI) or 'asgi' (uvicorn). Over ASGI the upload, code, code
+# stream and Gemini test endpoints are served by the async views in
+# vision.async_views (the code stream arrives in one piece there); the
+# other endpoints keep running as sync views in a thread pool
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+
+# Lease, in seconds, on the claim to generate code for a wireframe. Other
+# requests for the same wireframe get a 202 "pending" meanwhile. The claim
+# is renewed while its request runs (however long Gemini takes), so this is
+# how long a claim left behind by a crashed worker blocks generation
+GEMINI_GENERATION_LEASE = int(os.environ.get('GEMINI_GENERATION_LEASE', 180))
+
+# Outbound limits for the Google APIs, shared by every process on the host
+# through state files in OUTBOUND_RATE_LIMIT_DIR (see vision.ratelimit).
+# Containers that call Google (app and worker) must share that directory.
+# Set the per-minute rates to the project's quota. MAX_CONCURRENCY caps the
+# adaptive number of calls in flight per process
+OUTBOUND_RATE_LIMITS = {
+    'gemini': {
+        'REQUESTS_PER_MINUTE': int(
+            os.environ.get('GEMINI_REQUESTS_PER_MINUTE', 60)
+        ),
+        'TOKENS_PER_MINUTE': int(
+            os.environ.get('GEMINI_TOKENS_PER_MINUTE', 1000000)
+        ),
+        'MAX_CONCURRENCY': int(os.environ.get('GEMINI_MAX_INFLIGHT', 8)),
+    },
+    'vision': {
+        # Vision counts every image of a batch request
+        'REQUESTS_PER_MINUTE': int(
+            os.environ.get('VISION_REQUESTS_PER_MINUTE', 1800)
+        ),
+        'TOKENS_PER_MINUTE': 0,
+        'MAX_CONCURRENCY': int(os.environ.get('VISION_MAX_INFLIGHT', 8)),
+    },
+}
+OUTBOUND_RATE_LIMIT_DIR = os.environ.get(
+    'OUTBOUND_RATE_LIMIT_DIR', os.path.join(BASE_DIR, 'cache', 'ratelimit')
+)
+# Seconds a call may wait for capacity (including retries) before failing,
+# and how many times throttled/unavailable calls are retried
+OUTBOUND_MAX_WAIT = float(os.environ.get('OUTBOUND_MAX_WAIT', 120))
+OUTBOUND_MAX_RETRIES = int(os.environ.get('OUTBOUND_MAX_RETRIES', 4))
+
+# Consecutive failed calls (5xx or timeouts, counted once the retries are
+# spent; 429s only slow calls down) after which calls to a Google API fail
+# fast, and seconds before a trial call is let through
+CIRCUIT_BREAKER = {
+    'FAILURE_THRESHOLD': int(
+        os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5)
+    ),
+    'RESET_TIMEOUT': int(os.environ.get('CIRCUIT_BREAKER_RESET_TIMEOUT', 30)),
+}
+# Seconds the health endpoint reuses the last upstream probe result
+HEALTH_PROBE_TTL = int(os.environ.get('HEALTH_PROBE_TTL', 60))
+
+# Compression of the stored Vision/Gemini results: 'zstd' (needs the
+# zstandard package, falls back to gzip without it) or 'gzip'
+ARTIFACT_COMPRESSION = os.environ.get('ARTIFACT_COMPRESSION', 'zstd')
@@ -0,0 +1,62 @@
+"""
+Compression of the JSON results stored in WireframeArtifact rows.
+
+Payloads are compact JSON compressed with zstd when the zstandard package
+is installed (and ARTIFACT_COMPRESSION allows it), gzip otherwise. Each row
+records its encoding, so rows written either way can always be read.
+"""
+import gzip
+import json
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def compression():
+    """The encoding new artifacts are written with"""
+    wanted = getattr(settings, 'ARTIFACT_COMPRESSION', 'zstd')
+    if wanted == 'zstd' and zstandard is not None:
+        return 'zstd'
+    return 'gzip'
+
+
+def encode_artifact(value, encoding=None):
+    """
+    Serializes and compresses a JSON value.
+
+    Returns:
+        tuple: (encoding, compressed bytes)
+    """
+    encoding = encoding or compression()
+    raw = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return encoding, compressor.compress(raw)
+    return 'gzip', gzip.compress(raw, compresslevel=GZIP_LEVEL)
+
+
+def decode_artifact(encoding, data):
+    """
+    Decompresses and parses a payload written by encode_artifact.
+
+    Raises:
+        RuntimeError: If the payload is zstd and zstandard isn't installed
+    """
+    data = bytes(data)
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError(
+                "zstd artifact found but the zstandard package isn't "
+                "installed"
+            )
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raw = gzip.decompress(data)
+    return json.loads(raw)
@@ -0,0 +1,80 @@
+"""
+Streaming responses for the async views.
+
+Django 4.0 iterates a StreamingHttpResponse on the event loop, where the
+blocking Gemini stream and the ORM can't run, and only accepts async
+iterators as streaming content from 4.2 on. AsyncStreamingHttpResponse
+produces each part of a blocking iterator with sync_to_async(next) and
+StreamingASGIHandler, installed in app/asgi.py, sends the parts as they
+arrive.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """
+    Streaming response over a blocking iterator, read from the event loop
+    one item at a time. Its streaming_content is an async iterator, so it
+    can only be sent by StreamingASGIHandler.
+    """
+
+    is_async = True
+
+    @property
+    def streaming_content(self):
+        return self._async_content()
+
+    @streaming_content.setter
+    def streaming_content(self, value):
+        self._set_streaming_content(value)
+
+    async def _async_content(self):
+        done = object()
+        # next() runs in the request's sync thread, like the view's
+        # other sync_to_async calls; StopIteration can't cross into the
+        # coroutine, hence the default
+        next_part = sync_to_async(next)
+        while True:
+            part = await next_part(self._iterator, done)
+            if part is done:
+                return
+            yield self.make_bytes(part)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGIHandler that also sends responses whose streaming content is an
+    async iterator (is_async), body part by body part.
+    """
+
+    async def send_response(self, response, send):
+        if not getattr(response, 'is_async', False):
+            return await super().send_response(response, send)
+
+        headers = []
+        for header, value in response.items():
+            headers.append((header.encode('ascii'), value.encode('latin1')))
+        for cookie in response.cookies.values():
+            headers.append((
+                b'Set-Cookie',
+                cookie.output(header='').encode('ascii').strip(),
+            ))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+        try:
+            async for part in response.streaming_content:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body'})
+        finally:
+            # Releases what the content holds, such as a generation claim
+            await sync_to_async(response.close, thread_sensitive=True)()
@@ -0,0 +1,252 @@
+"""
+Async versions of the upload, code generation, code stream and Gemini test
+endpoints.
+
+They replace the DRF views in urls.py when the app is served over ASGI
+(SERVER_MODE=asgi), so a worker process can keep many Vision/Gemini calls
+in flight instead of one per thread. DRF 3.13 has no async views, so these
+are plain Django async views that authenticate with the same JWT backend
+and return the same payloads. ORM access goes through sync_to_async.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .asgi import AsyncStreamingHttpResponse
+from .gemini_api import test_gemini_connection_async
+from .models import WireframeUpload
+from .pipeline import (
+    claim_missing_code, generate_missing_code_async, process_wireframe_async,
+)
+from .serializers import WireframeUploadSerializer
+from .tasks import process_wireframe_task
+from .uploads import HashingUploadHandler
+from .views import (
+    GENERATION_RETRY_AFTER, ClaimedCodeEvents, _make_etag, _make_last_modified,
+    stored_code_events,
+)
+
+jwt_authentication = JWTAuthentication()
+
+
+async def authenticate(request):
+    """
+    Authenticates the request with the JWT backend.
+
+    Returns:
+        tuple: (user, None) on success, (None, error message) otherwise
+    """
+    try:
+        result = await sync_to_async(jwt_authentication.authenticate)(request)
+    except APIException as e:
+        return None, e.detail
+    if result is None:
+        return None, "Authentication credentials were not provided."
+    return result[0], None
+
+
+def async_api_view(methods, authenticated=True):
+    """
+    Restricts an async view to the given methods and, optionally, to
+    authenticated users, answering like DRF's api_view would.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapped(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse(
+                    {"detail": f'Method "{request.method}" not allowed.'},
+                    status=status.HTTP_405_METHOD_NOT_ALLOWED,
+                )
+            if authenticated:
+                user, error = await authenticate(request)
+                if user is None:
+                    response = JsonResponse(
+                        {"detail": error},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                    )
+                    response['WWW-Authenticate'] = (
+                        jwt_authentication.authenticate_header(request)
+                    )
+                    return response
+                request.user = user
+            return await view(request, *args, **kwargs)
+
+        # Token authentication, no cookies: same as DRF's views
+        wrapped.csrf_exempt = True
+        return wrapped
+    return decorator
+
+
+def _validate_upload(request):
+    data = request.POST.copy()
+    data.update(request.FILES)
+    serializer = WireframeUploadSerializer(data=data,
+                                           context={'request': request})
+    serializer.is_valid()
+    return serializer
+
+
+def _create_job(serializer, request, engine):
+    # Hand the wireframe to a worker once the row is committed
+    with transaction.atomic():
+        wireframe = serializer.save(user=request.user, status='uploaded')
+        transaction.on_commit(
+            lambda: process_wireframe_task.delay(wireframe.pk, engine=engine)
+        )
+    return _upload_data(wireframe, request)
+
+
+def _upload_data(wireframe, request):
+    return WireframeUploadSerializer(
+        wireframe, context={'request': request}
+    ).data
+
+
+@async_api_view(['POST'])
+async def wireframe_upload_api(request):
+    """Async API endpoint for wireframe uploads"""
+    request.upload_handlers = [HashingUploadHandler(request)]
+    # Multipart parsing, image validation and hashing touch the disk
+    serializer = await sync_to_async(
+        _validate_upload, thread_sensitive=False
+    )(request)
+    if serializer.errors:
+        return JsonResponse(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+    engine = serializer.validated_data.pop('engine', None)
+
+    if settings.VISION_PIPELINE_MODE == 'job':
+        data = await sync_to_async(_create_job)(serializer, request, engine)
+        return JsonResponse(data, status=status.HTTP_202_ACCEPTED)
+
+    wireframe = await sync_to_async(serializer.save)(
+        user=request.user, status='processing'
+    )
+    await process_wireframe_async(wireframe, engine=engine)
+    data = await sync_to_async(_upload_data)(wireframe, request)
+    return JsonResponse(data, status=status.HTTP_201_CREATED)
+
+
+def _pending_response():
+    response = JsonResponse(
+        {"status": "pending",
+         "message": "Code is being generated for this wireframe"},
+        status=status.HTTP_202_ACCEPTED
+    )
+    response['Retry-After'] = str(GENERATION_RETRY_AFTER)
+    return response
+
+
+def _code_validators(request, pk):
+    etag = _make_etag('code')(request, pk)
+    last_modified = _make_last_modified('code')(request, pk)
+    return (
+        quote_etag(etag) if etag is not None else None,
+        int(last_modified.timestamp()) if last_modified is not None else None,
+    )
+
+
+@async_api_view(['GET'])
+async def generate_code_api(request, pk):
+    """
+    Async API endpoint for generating/retrieving code for a specific
+    wireframe
+    """
+    # Conditional GET, as the condition() decorator does for the sync view
+    etag, last_modified = await sync_to_async(_code_validators)(request, pk)
+    not_modified = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        wireframe = await sync_to_async(WireframeUpload.objects.get)(
+            pk=pk, user=request.user
+        )
+    except WireframeUpload.DoesNotExist:
+        return JsonResponse({"error": "Wireframe not found"},
+                            status=status.HTTP_404_NOT_FOUND)
+
+    if wireframe.needs_code():
+        await sync_to_async(wireframe.load_artifacts)('detected_elements')
+        if not wireframe.detected_elements:
+            return JsonResponse(
+                {"error": "No detected elements available for this wireframe"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Only one request per wireframe calls Gemini, see the sync view
+        if not await generate_missing_code_async(wireframe):
+            return _pending_response()
+
+    formatted = await sync_to_async(wireframe.get_formatted_code)()
+    response = JsonResponse({
+        "status": "success",
+        "html": formatted["html"],
+        "css": formatted["css"],
+        "javascript": formatted["javascript"],
+    })
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+@async_api_view(['GET'])
+async def generate_code_stream_api(request, pk):
+    """
+    Async API endpoint for the code event stream. The events come from the
+    same blocking generators as the WSGI view, read one by one in a thread
+    and sent as they are produced (see vision.asgi).
+    """
+    try:
+        wireframe = await sync_to_async(WireframeUpload.objects.get)(
+            pk=pk, user=request.user
+        )
+    except WireframeUpload.DoesNotExist:
+        return JsonResponse({"error": "Wireframe not found"},
+                            status=status.HTTP_404_NOT_FOUND)
+
+    claimed = False
+    if wireframe.needs_code():
+        await sync_to_async(wireframe.load_artifacts)('detected_elements')
+        if not wireframe.detected_elements:
+            return JsonResponse(
+                {"error": "No detected elements available for this wireframe"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        claim = await sync_to_async(claim_missing_code)(wireframe)
+        if claim == 'pending':
+            return _pending_response()
+        claimed = claim == 'claimed'
+
+    events = ClaimedCodeEvents if claimed else stored_code_events
+    response = AsyncStreamingHttpResponse(events(wireframe),
+                                          content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@async_api_view(['GET'])
+async def test_gemini_connection_api(request):
+    """
+    Async API endpoint for testing Gemini API connection (staff only, see
+    the sync view)
+    """
+    if not request.user.is_staff:
+        return JsonResponse(
+            {"detail": "You do not have permission to perform this action."},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    return JsonResponse(await test_gemini_connection_async())
@@ -0,0 +1,302 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Short names accepted for GEMINI_RESPONSE_CACHE['BACKEND']
+BACKEND_ALIASES = {
+    'lru': 'vision.cache.LRUResponseCache',
+    'django': 'vision.cache.DjangoResponseCache',
+    'file': 'vision.cache.FileResponseCache',
+    'none': 'vision.cache.DummyResponseCache',
+}
+
+DEFAULT_CACHE_SETTINGS = {
+    'BACKEND': 'lru',
+    'TTL': 24 * 60 * 60,
+    'MAX_ENTRIES': 256,
+    'LOCATION': None,
+    'CACHE_ALIAS': 'default',
+}
+
+
+def make_cache_key(model_name, prompt, theme):
+    """
+    Builds the cache key for a Gemini generation.
+
+    Args:
+        model_name (str): Gemini model the prompt is sent to
+        prompt (str): The full prompt text
+        theme (str): The requested theme
+
+    Returns:
+        str: Hex SHA-256 of the three inputs
+    """
+    digest = hashlib.sha256()
+    for part in (model_name, theme, prompt):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class BaseResponseCache:
+    """
+    Base class for Gemini response caches.
+
+    Subclasses implement _get/_set/_clear; this class keeps the hit, miss and
+    eviction counters so every backend reports the same stats.
+    """
+
+    def __init__(self, ttl=None, max_entries=None, **options):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0}
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        value = self._get(key)
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, key, value):
+        """Store a JSON-serializable value under key"""
+        self._set(key, value)
+        self._count('sets')
+
+    def clear(self):
+        self._clear()
+
+    def stats(self):
+        """Return a snapshot of the hit/miss/set/eviction counters"""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+
+class DummyResponseCache(BaseResponseCache):
+    """Cache that never stores anything (caching disabled)"""
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value):
+        pass
+
+    def _clear(self):
+        pass
+
+
+class LRUResponseCache(BaseResponseCache):
+    """In-process cache with TTL and least-recently-used eviction"""
+
+    def __init__(self, ttl=None, max_entries=None, **options):
+        super().__init__(ttl=ttl, max_entries=max_entries, **options)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoResponseCache(BaseResponseCache):
+    """
+    Cache stored in one of Django's CACHES.
+
+    Size-bounded eviction is left to the cache backend (its MAX_ENTRIES/
+    CULL_FREQUENCY options, or the server's own policy for memcached/redis).
+
+    The cache alias may be shared with the rest of the site, so keys carry a
+    generation token and clear() starts a new generation instead of
+    clearing the whole alias; older entries expire with their TTL.
+    """
+
+    key_prefix = 'gemini-response:'
+    generation_key = 'gemini-response:generation'
+
+    def __init__(self, ttl=None, max_entries=None, cache_alias='default',
+                 **options):
+        super().__init__(ttl=ttl, max_entries=max_entries, **options)
+        self.cache_alias = cache_alias
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def _generation(self):
+        generation = self._cache.get(self.generation_key)
+        if generation is None:
+            # First use, or the token was evicted: entries of the lost
+            # generation are unreachable, which is safe
+            self._cache.add(
+                self.generation_key, uuid.uuid4().hex, timeout=None
+            )
+            generation = self._cache.get(self.generation_key)
+        return generation
+
+    def _key(self, key):
+        return f"{self.key_prefix}{self._generation()}:{key}"
+
+    def _get(self, key):
+        return self._cache.get(self._key(key))
+
+    def _set(self, key, value):
+        self._cache.set(self._key(key), value, timeout=self.ttl or None)
+
+    def _clear(self):
+        self._cache.set(self.generation_key, uuid.uuid4().hex, timeout=None)
+
+
+class FileResponseCache(BaseResponseCache):
+    """
+    On-disk cache, one JSON file per key.
+
+    Entries expire by file mtime. When the directory grows past max_entries
+    the least recently used files (oldest mtime, refreshed on every hit) are
+    removed.
+    """
+
+    suffix = '.json'
+
+    def __init__(self, ttl=None, max_entries=None, location=None, **options):
+        super().__init__(ttl=ttl, max_entries=max_entries, **options)
+        self.location = location or os.path.join(
+            tempfile.gettempdir(), 'gemini_cache'
+        )
+        os.makedirs(self.location, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.location, key + self.suffix)
+
+    def _get(self, key):
+        path = self._path(key)
+        try:
+            mtime = os.path.getmtime(path)
+            if self.ttl and mtime + self.ttl <= time.time():
+                os.remove(path)
+                return None
+            with open(path, 'r') as f:
+                value = json.load(f)
+            # Touch the file so eviction sees it as recently used
+            os.utime(path, None)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _set(self, key, value):
+        # Write to a temp file and rename so readers never see partial JSON
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            logger.warning(f"Could not write Gemini cache entry {key}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._cull()
+
+    def _entries(self):
+        with os.scandir(self.location) as it:
+            return [e for e in it if e.name.endswith(self.suffix)]
+
+    def _cull(self):
+        if not self.max_entries:
+            return
+        entries = self._entries()
+        overflow = len(entries) - self.max_entries
+        if overflow <= 0:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        evicted = 0
+        for entry in entries[:overflow]:
+            try:
+                os.remove(entry.path)
+                evicted += 1
+            except OSError:
+                pass
+        self._count('evictions', evicted)
+
+    def _clear(self):
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Returns the process-wide Gemini response cache configured by the
+    GEMINI_RESPONSE_CACHE setting.
+    """
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                config = dict(DEFAULT_CACHE_SETTINGS)
+                config.update(getattr(settings, 'GEMINI_RESPONSE_CACHE', {}))
+                backend = BACKEND_ALIASES.get(
+                    config['BACKEND'], config['BACKEND']
+                )
+                _response_cache = import_string(backend)(
+                    ttl=config['TTL'],
+                    max_entries=config['MAX_ENTRIES'],
+                    location=config['LOCATION'],
+                    cache_alias=config['CACHE_ALIAS'],
+                )
+    return _response_cache
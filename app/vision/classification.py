@@ -0,0 +1,162 @@
+"""
+Batch classification of OCR word annotations into UI element types.
+
+The rules are plain data (DEFAULT_CLASSIFICATION_RULES, overridable with the
+VISION_CLASSIFICATION_RULES setting). They are compiled once into a single
+keyword regex, and the size rules are evaluated on NumPy arrays, so
+thousands of annotations are classified in one pass.
+"""
+import re
+import threading
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_CLASSIFICATION_RULES = {
+    # Checked in order; the first rule with a keyword contained in the
+    # (lower-cased) text wins. 'wide_label' is used instead of 'label' when
+    # width > height * wide_aspect.
+    'keywords': [
+        {
+            'label': 'menu',
+            'wide_label': 'navbar',
+            'wide_aspect': 3,
+            'keywords': ['nav', 'menu', 'home', 'about', 'contact'],
+        },
+        {
+            'label': 'button',
+            'keywords': [
+                'submit', 'send', 'login', 'sign', 'create', 'delete',
+                'update',
+            ],
+        },
+        {
+            'label': 'input_field',
+            'keywords': ['name', 'email', 'password', 'username', 'address'],
+        },
+    ],
+    # Short, low text (length < max_length and height < max_height)
+    'heading': {'max_length': 50, 'max_height': 40},
+    # Long text (length > min_length)
+    'paragraph': {'min_length': 50},
+    'default': 'text',
+}
+
+
+class ElementClassifier:
+    """Compiled form of a classification rule set"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.keyword_rules = rules['keywords']
+
+        # One zero-width lookahead alternative per rule, so a match is found
+        # at every position where any keyword starts, with the earliest rule
+        # winning when several keywords start at the same position
+        alternatives = [
+            '(%s)' % '|'.join(
+                re.escape(keyword.lower()) for keyword in rule['keywords']
+            )
+            for rule in self.keyword_rules
+            if rule['keywords']
+        ]
+        self._rule_index = [
+            index for index, rule in enumerate(self.keyword_rules)
+            if rule['keywords']
+        ]
+        self.pattern = None
+        if alternatives:
+            self.pattern = re.compile('(?=%s)' % '|'.join(alternatives))
+
+    def _keyword_matches(self, texts):
+        """
+        Index of the first matching keyword rule per text, len(rules) if
+        none
+        """
+        no_match = len(self.keyword_rules)
+        best = np.full(len(texts), no_match, dtype=np.int64)
+        if self.pattern is None or not texts:
+            return best
+
+        # Lower-case and scan everything at once; NUL never appears in a
+        # keyword, so no match can span two texts
+        joined = '\0'.join(texts).lower()
+        separators = np.array(
+            [m.start() for m in re.finditer('\0', joined)], dtype=np.int64
+        )
+
+        positions = []
+        rules = []
+        for match in self.pattern.finditer(joined):
+            positions.append(match.start())
+            rules.append(self._rule_index[match.lastindex - 1])
+        if positions:
+            text_index = np.searchsorted(separators, positions)
+            np.minimum.at(best, text_index, np.array(rules, dtype=np.int64))
+        return best
+
+    def classify(self, texts, widths, heights):
+        """
+        Classifies many annotations at once.
+
+        Args:
+            texts (list): Annotation texts
+            widths (list): Bounding box widths
+            heights (list): Bounding box heights
+
+        Returns:
+            list: One element type per annotation
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        widths = np.asarray(widths, dtype=np.float64)
+        heights = np.asarray(heights, dtype=np.float64)
+        lengths = np.fromiter((len(text) for text in texts),
+                              dtype=np.int64, count=len(texts))
+        best = self._keyword_matches(texts)
+
+        conditions = []
+        choices = []
+        for index, rule in enumerate(self.keyword_rules):
+            matched = best == index
+            if 'wide_label' in rule:
+                wide = widths > heights * rule['wide_aspect']
+                conditions.append(matched & wide)
+                choices.append(rule['wide_label'])
+            conditions.append(matched)
+            choices.append(rule['label'])
+
+        heading = self.rules['heading']
+        conditions.append((lengths < heading['max_length'])
+                          & (heights < heading['max_height']))
+        choices.append('heading')
+
+        conditions.append(lengths > self.rules['paragraph']['min_length'])
+        choices.append('paragraph')
+
+        return np.select(
+            conditions, choices, default=self.rules['default']
+        ).tolist()
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+    """Returns the classifier compiled from the configured rules"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                rules = getattr(settings, 'VISION_CLASSIFICATION_RULES', None)
+                _classifier = ElementClassifier(
+                    rules or DEFAULT_CLASSIFICATION_RULES
+                )
+    return _classifier
+
+
+def classify_ui_elements(texts, widths, heights):
+    """Classifies many annotations at once, see ElementClassifier.classify"""
+    return get_classifier().classify(texts, widths, heights)
@@ -0,0 +1,204 @@
+"""
+Process-wide Gemini credentials and model objects.
+
+The API key is resolved once per process and the configured
+GenerativeModel objects are reused by every request, so the hot path does
+no file I/O. A background thread polls the credential files' modification
+times and drops the cached key and models when one changes; sending
+credentials_changed (or overriding GOOGLE_GEMINI_API_KEY in tests) does the
+same.
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import Signal, receiver
+import google.generativeai as genai
+from dotenv import dotenv_values
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+APP_DIR = Path(__file__).parent
+CREDENTIALS_FILE = APP_DIR / 'google_credentials.json'
+# The project root .env is only read when the app has none
+ENV_FILES = (
+    APP_DIR / '.env',
+    Path(__file__).resolve().parent.parent.parent / '.env',
+)
+
+# Send after rotating the API key to make every process pick up the new one
+credentials_changed = Signal()
+
+
+def load_api_key():
+    """Load Gemini API key from multiple possible sources"""
+    # Try to load from environment directly first
+    api_key = os.environ.get('GOOGLE_GEMINI_API_KEY')
+
+    # If not found, check if we have credentials JSON file
+    if not api_key:
+        try:
+            # Look for credentials file in the vision app directory
+            if CREDENTIALS_FILE.exists():
+                with open(CREDENTIALS_FILE, 'r') as f:
+                    credentials = json.load(f)
+                    api_key = credentials.get('api_key')
+                    if api_key:
+                        print("API key loaded from google_credentials.json")
+        except Exception as e:
+            print(f"Error loading credentials file: {str(e)}")
+
+    # If still not found, try loading from .env file
+    if not api_key:
+        try:
+            # First, try loading from app directory, then the project root
+            env_path = next(
+                (path for path in ENV_FILES if path.exists()), None
+            )
+            if env_path is not None:
+                # Read the file without exporting it, so a changed key is
+                # picked up when the credentials are reloaded
+                api_key = dotenv_values(env_path).get('GOOGLE_GEMINI_API_KEY')
+                if api_key:
+                    print(f"API key loaded from .env file at {env_path}")
+        except Exception as e:
+            print(f"Error loading .env file: {str(e)}")
+
+    # If still not found, check Django settings
+    if not api_key and hasattr(settings, 'GOOGLE_GEMINI_API_KEY'):
+        api_key = settings.GOOGLE_GEMINI_API_KEY
+        if api_key:
+            print("API key loaded from Django settings")
+
+    if not api_key:
+        print("API key not found in any configuration")
+
+    return api_key
+
+
+def _mtime(path):
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+class GeminiModelProvider:
+    """
+    Resolves the API key once and hands out configured models.
+
+    Models are cached per model name. Everything is rebuilt after invalidate()
+    and after a fork, since the underlying gRPC channels can't be shared
+    between processes.
+    """
+
+    def __init__(self, watch_paths=(CREDENTIALS_FILE,) + ENV_FILES,
+                 watch_interval=30):
+        self.watch_paths = tuple(watch_paths)
+        self.watch_interval = watch_interval
+        self._models = {}
+        self._pid = None
+        self._mtimes = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def get_model(self, model_name):
+        """
+        Returns the configured GenerativeModel for model_name.
+
+        Raises:
+            ValueError: If no API key is configured
+        """
+        model = self._models.get(model_name)
+        if model is not None and self._pid == os.getpid():
+            return model
+        with self._lock:
+            if self._pid != os.getpid():
+                self._models = {}
+            if not self._models:
+                self._configure()
+            if model_name not in self._models:
+                self._models[model_name] = genai.GenerativeModel(
+                    model_name=model_name
+                )
+            return self._models[model_name]
+
+    def _configure(self):
+        # Snapshot before reading, so a change made while loading still
+        # triggers a reload
+        self._mtimes = self._stat()
+        api_key = load_api_key()
+        if not api_key:
+            raise ValueError(
+                "GOOGLE_GEMINI_API_KEY environment variable not set and not "
+                "found in Django settings"
+            )
+        genai.configure(api_key=api_key)
+        self._pid = os.getpid()
+        self._start_watcher()
+
+    def invalidate(self):
+        """
+        Drops the cached key and models; the next get_model() reloads them
+        """
+        with self._lock:
+            self._models = {}
+
+    def _stat(self):
+        return {path: _mtime(path) for path in self.watch_paths}
+
+    def _start_watcher(self):
+        # Threads don't survive a fork, so this also restarts the watcher
+        # in worker processes
+        if self.watch_interval <= 0:
+            return
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._watcher = threading.Thread(
+            target=self._watch, name='gemini-credentials-watcher', daemon=True
+        )
+        self._watcher.start()
+
+    def _watch(self):
+        pid = os.getpid()
+        stop = threading.Event()
+        while not stop.wait(self.watch_interval) and os.getpid() == pid:
+            mtimes = self._stat()
+            if mtimes != self._mtimes:
+                logger.info(
+                    "Gemini credentials changed, reloading on next use"
+                )
+                self._mtimes = mtimes
+                self.invalidate()
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_model_provider():
+    """Returns the process-wide GeminiModelProvider"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                interval = getattr(
+                    settings, 'GEMINI_CREDENTIALS_WATCH_INTERVAL', 30
+                )
+                _provider = GeminiModelProvider(watch_interval=interval)
+    return _provider
+
+
+@receiver(credentials_changed)
+def _reload_on_signal(sender, **kwargs):
+    get_model_provider().invalidate()
+
+
+@receiver(setting_changed)
+def _reload_on_setting_changed(sender, setting, **kwargs):
+    if setting == 'GOOGLE_GEMINI_API_KEY':
+        get_model_provider().invalidate()
@@ -0,0 +1,58 @@
+import hashlib
+import logging
+
+from django.conf import settings
+
+from .models import WireframeUpload
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+def hash_image_file(image_file):
+    """
+    Computes the SHA-256 digest of an uploaded image without loading it whole.
+
+    Args:
+        image_file (File): Django uploaded file (in-memory or temporary)
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    for chunk in image_file.chunks():
+        digest.update(chunk)
+    # Leave the file ready for the storage backend to read again
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+def find_reusable_upload(wireframe):
+    """
+    Looks for an earlier completed upload of the same image and theme.
+
+    The search scope is controlled by the WIREFRAME_DEDUPE_SCOPE setting:
+    'user' only reuses the uploader's own results, 'global' reuses results
+    from any user and 'off' disables reuse.
+
+    Args:
+        wireframe (WireframeUpload): The upload about to be processed
+
+    Returns:
+        WireframeUpload or None: A completed upload whose results can be copied
+    """
+    scope = getattr(settings, 'WIREFRAME_DEDUPE_SCOPE', 'user')
+    if scope == 'off' or not wireframe.image_sha256:
+        return None
+
+    candidates = WireframeUpload.objects.filter(
+        image_sha256=wireframe.image_sha256,
+        theme=wireframe.theme,
+        status='completed',
+        code_status='success',
+    ).exclude(pk=wireframe.pk)
+
+    if scope == 'user':
+        candidates = candidates.filter(user_id=wireframe.user_id)
+
+    return candidates.order_by('-upload_date').first()
@@ -1,10 +1,541 @@
 # utils/formatter.py
-import jsbeautifier
+"""
+Formatters for the generated HTML, CSS and JavaScript.
 
-def beautify_code(html: str, css: str):
-    opts = jsbeautifier.default_options()
-    opts.indent_size = 2
+Each formatter is a generator that makes a single left-to-right pass over
+its input and yields output lines as it goes, so the work is linear in the
+input size. format_code() wraps them with a size limit and a deadline: code
+over CODE_FORMAT_MAX_CHARS, or that takes longer than CODE_FORMAT_TIMEOUT
+seconds to format, is returned unchanged.
+"""
+import logging
+import re
+import time
+from django.conf import settings
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Bump when the formatting output changes; stored code formatted with an
+# older version is re-formatted the next time it's read
+FORMAT_VERSION = 3
+
+INDENT = '  '
+# Tokens processed between two deadline checks
+CHECK_EVERY = 256
+# Longest line a block element and its inline content are joined into
+MAX_INLINE_LINE = 120
+# Deeper nesting isn't indented further, which keeps the output linear in
+# the input size
+MAX_INDENT_DEPTH = 40
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _indent(depth):
+    return INDENT * min(depth, MAX_INDENT_DEPTH)
+
+
+class FormatTimeout(Exception):
+    """Raised when formatting runs past its deadline"""
+
+
+class Deadline:
+    """Cheap cooperative timeout, checked every CHECK_EVERY ticks"""
+
+    def __init__(self, timeout=None):
+        self.at = time.monotonic() + timeout if timeout else None
+        self.ticks = 0
+
+    def tick(self):
+        self.ticks += 1
+        if (self.at is not None and self.ticks % CHECK_EVERY == 0
+                and time.monotonic() > self.at):
+            raise FormatTimeout()
+
+
+# ---------------------------------------------------------------- CSS
+
+CSS_TOKEN_RE = re.compile(
+    r'/\*.*?(?:\*/|\Z)'                     # comment
+    r'|"(?:[^"\\\n]|\\.)*"?'                # double quoted string
+    r"|'(?:[^'\\\n]|\\.)*'?"                # single quoted string
+    r'|[{};()]'
+    r'|[^{};()"\'/]+'
+    r'|/',
+    re.S,
+)
+
+
+def _css_declaration(text):
+    """'color:red' -> 'color: red'; at-rules are left alone"""
+    if text.startswith('@'):
+        return text
+    name, colon, value = text.partition(':')
+    if not colon:
+        return text
+    return f"{name.strip()}: {value.strip()}"
+
+
+def iter_css_lines(css, depth=0, deadline=None):
+    """
+    Formats CSS one rule/declaration per line.
+
+    Args:
+        css (str): The stylesheet
+        depth (int): Indent level of the first line
+        deadline (Deadline): Optional timeout
+
+    Yields:
+        str: Output lines
+    """
+    deadline = deadline or Deadline()
+    buffer = []
+    parens = 0
+
+    def take():
+        text = ''.join(buffer).strip()
+        buffer.clear()
+        return text
+
+    for match in CSS_TOKEN_RE.finditer(css):
+        deadline.tick()
+        token = match.group()
+        if token.startswith('/*'):
+            if not ''.join(buffer).strip():
+                buffer.clear()
+                yield _indent(depth) + token
+            else:
+                buffer.append(token)
+        elif token[0] in '"\'':
+            buffer.append(token)
+        elif token == '(':
+            parens += 1
+            buffer.append(token)
+        elif token == ')':
+            parens = max(parens - 1, 0)
+            buffer.append(token)
+        elif parens:
+            # ; and braces inside url(...) etc. don't end anything
+            buffer.append(WHITESPACE_RE.sub(' ', token))
+        elif token == '{':
+            prelude = take()
+            yield _indent(depth) + (f"{prelude} {{" if prelude else '{')
+            depth += 1
+        elif token == ';':
+            declaration = take()
+            if declaration:
+                yield _indent(depth) + _css_declaration(declaration) + ';'
+        elif token == '}':
+            declaration = take()
+            if declaration:
+                yield _indent(depth) + _css_declaration(declaration) + ';'
+            depth = max(depth - 1, 0)
+            yield _indent(depth) + '}'
+            if depth == 0:
+                yield ''
+        else:
+            buffer.append(WHITESPACE_RE.sub(' ', token))
+
+    rest = take()
+    if rest:
+        yield _indent(depth) + rest
+
+
+# --------------------------------------------------------- JavaScript
+
+JS_SPECIAL_RE = re.compile(r'[\n"\'`/{}\[\]()]')
+JS_STRING_RE = {
+    '"': re.compile(r'"(?:[^"\\\n]|\\.)*"?'),
+    "'": re.compile(r"'(?:[^'\\\n]|\\.)*'?"),
+}
+# Template literal text up to the closing backtick or the next ${
+JS_TEMPLATE_RE = re.compile(r'(?:[^`\\$]|\\.|\$(?!\{))*', re.S)
+# Regex literal body after the opening /
+JS_REGEX_RE = re.compile(r'(?:[^\\/\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\]?)*/?')
+JS_WORD_BEFORE_RE = re.compile(r'[\w$]+$')
+# A / after one of these starts a regex literal rather than a division
+JS_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+JS_REGEX_KEYWORDS = {
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new',
+    'delete', 'void', 'throw', 'yield', 'await',
+}
+CLOSERS = '}])'
+
+
+def _starts_regex(js, pos):
+    """Whether the / at pos starts a regex literal"""
+    j = pos - 1
+    while j >= 0 and js[j] in ' \t\r':
+        j -= 1
+    if j < 0 or js[j] in JS_REGEX_PRECEDERS or js[j] == '\n':
+        return True
+    word = JS_WORD_BEFORE_RE.search(js, max(j - 10, 0), j + 1)
+    return bool(word) and word.group() in JS_REGEX_KEYWORDS
+
+
+def iter_javascript_lines(js, depth=0, deadline=None):
+    """
+    Re-indents JavaScript by bracket nesting.
+
+    Lines are kept as written and only their leading whitespace changes, so
+    the formatter can't change what the code does. Brackets opened on the
+    same line count as one level, so `foo(function () {` indents once.
+    Lines inside template literals and block comments are left untouched.
+
+    Args:
+        js (str): The script
+        depth (int): Indent level of the outermost code
+        deadline (Deadline): Optional timeout
+
+    Yields:
+        str: Output lines
+    """
+    deadline = deadline or Deadline()
+    n = len(js)
+    # Open brackets as (level, line number, closes a template ${ })
+    stack = []
+    line_no = 0
+    # Indent level of each line, None for lines kept verbatim
+    levels = []
+
+    def line_level(start):
+        # Closers at the start of the line belong to the outer level
+        closers = 0
+        while start < n and js[start] in ' \t':
+            start += 1
+        while start + closers < n and js[start + closers] in CLOSERS:
+            closers += 1
+        remaining = len(stack) - closers
+        return stack[remaining - 1][0] if remaining > 0 else 0
+
+    def push(template=False):
+        if stack and stack[-1][1] == line_no:
+            level = stack[-1][0]
+        else:
+            level = (stack[-1][0] if stack else 0) + 1
+        stack.append((level, line_no, template))
+
+    def verbatim_newlines(start, end):
+        nonlocal line_no
+        count = js.count('\n', start, end)
+        levels.extend([None] * count)
+        line_no += count
+
+    def scan_template(pos):
+        # pos is just after a backtick or the } closing a ${ }
+        end = JS_TEMPLATE_RE.match(js, pos).end()
+        verbatim_newlines(pos, end)
+        if js.startswith('${', end):
+            push(template=True)
+            return end + 2
+        return end + 1
+
+    levels.append(line_level(0))
+    pos = 0
+    while pos < n:
+        deadline.tick()
+        match = JS_SPECIAL_RE.search(js, pos)
+        if match is None:
+            break
+        pos = match.start()
+        char = js[pos]
+        if char == '\n':
+            line_no += 1
+            levels.append(line_level(pos + 1))
+            pos += 1
+        elif char in JS_STRING_RE:
+            pos = JS_STRING_RE[char].match(js, pos).end()
+        elif char == '`':
+            pos = scan_template(pos + 1)
+        elif char == '/':
+            if js.startswith('//', pos):
+                end = js.find('\n', pos)
+                pos = n if end == -1 else end
+            elif js.startswith('/*', pos):
+                end = js.find('*/', pos + 2)
+                end = n if end == -1 else end + 2
+                verbatim_newlines(pos, end)
+                pos = end
+            elif _starts_regex(js, pos):
+                pos = JS_REGEX_RE.match(js, pos + 1).end()
+            else:
+                pos += 1
+        elif char in '{[(':
+            push()
+            pos += 1
+        else:
+            closes_template = bool(stack) and stack[-1][2] and char == '}'
+            if stack:
+                stack.pop()
+            pos = scan_template(pos + 1) if closes_template else pos + 1
+
+    for line, level in zip(js.split('\n'), levels):
+        if level is None:
+            yield line
+        else:
+            line = line.strip()
+            yield _indent(depth + level) + line if line else ''
+
+
+# --------------------------------------------------------------- HTML
+
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+}
+# Kept on the same line as the surrounding text
+INLINE_ELEMENTS = {
+    'a', 'abbr', 'b', 'bdi', 'bdo', 'br', 'button', 'cite', 'code', 'data',
+    'dfn', 'em', 'i', 'img', 'input', 'kbd', 'label', 'mark', 'q', 's',
+    'samp', 'select', 'small', 'span', 'strong', 'sub', 'sup', 'textarea',
+    'time', 'u', 'var', 'wbr',
+}
+# Elements whose content isn't markup
+RAW_TEXT_ELEMENTS = {'script', 'style', 'pre', 'textarea'}
+
+HTML_TAG_START_RE = re.compile(r'<(/?)([A-Za-z][\w:.-]*)')
+HTML_TAG_SCAN_RE = re.compile(r'[>"\']')
+HTML_ATTR_PART_RE = re.compile(r'"[^"]*"|\'[^\']*\'|[^"\']+')
+HTML_RAW_END_RE = {
+    name: re.compile(rf'</{name}\s*>', re.I) for name in RAW_TEXT_ELEMENTS
+}
+
+
+def _find_tag_end(html, pos):
+    """
+    Index just past the '>' closing the tag that starts at pos, skipping
+    quoted attribute values, or -1 if the tag never closes.
+    """
+    while True:
+        match = HTML_TAG_SCAN_RE.search(html, pos)
+        if match is None:
+            return -1
+        if match.group() == '>':
+            return match.end()
+        pos = html.find(match.group(), match.end())
+        if pos == -1:
+            return -1
+        pos += 1
+
+
+def _clean_tag(slash, name, attrs):
+    """Collapses whitespace between attributes, leaving quoted values alone"""
+    attrs = ''.join(
+        part if part[0] in '"\'' else WHITESPACE_RE.sub(' ', part)
+        for part in HTML_ATTR_PART_RE.findall(attrs)
+    ).strip()
+    self_closing = attrs.endswith('/')
+    if self_closing:
+        attrs = attrs[:-1].rstrip()
+    tag = (
+        f"<{slash}{name}{' ' + attrs if attrs else ''}"
+        f"{' /' if self_closing else ''}>"
+    )
+    return tag, self_closing
+
+
+def iter_html_lines(html, depth=0, deadline=None):
+    """
+    Formats HTML with one block element per line.
+
+    Inline elements and text stay together on one line (whitespace between
+    them is significant), and a block element holding only a short run of
+    inline content is kept on a single line. <style> and <script> bodies
+    are formatted as CSS and JavaScript; <pre> and <textarea> are copied
+    as is.
+
+    Args:
+        html (str): The document or fragment
+        depth (int): Indent level of the first line
+        deadline (Deadline): Optional timeout
+
+    Yields:
+        str: Output lines
+    """
+    deadline = deadline or Deadline()
+    n = len(html)
+    run = []            # inline content of the current line
+    pending = None      # (name, tag) of a block opened but not yet written
+
+    def run_text():
+        text = ''.join(run).strip()
+        run.clear()
+        return text
+
+    def flush():
+        nonlocal depth, pending
+        if pending is not None:
+            yield _indent(depth) + pending[1]
+            depth += 1
+            pending = None
+        text = run_text()
+        if text:
+            yield _indent(depth) + text
+
+    pos = 0
+    while pos < n:
+        deadline.tick()
+        lt = html.find('<', pos)
+        if lt == -1:
+            lt = n
+        if lt > pos:
+            text = WHITESPACE_RE.sub(' ', html[pos:lt])
+            if text.strip() or run:
+                run.append(text)
+            pos = lt
+            continue
+
+        if html.startswith('<!--', pos):
+            end = html.find('-->', pos + 4)
+            end = n if end == -1 else end + 3
+            yield from flush()
+            yield _indent(depth) + html[pos:end]
+            pos = end
+            continue
+        if html.startswith('<!', pos) or html.startswith('<?', pos):
+            end = html.find('>', pos)
+            end = n if end == -1 else end + 1
+            yield from flush()
+            yield _indent(depth) + WHITESPACE_RE.sub(' ', html[pos:end])
+            pos = end
+            continue
+
+        match = HTML_TAG_START_RE.match(html, pos)
+        if match is None:
+            # A stray '<' is just text
+            run.append('<')
+            pos += 1
+            continue
+        end = _find_tag_end(html, match.end())
+        if end == -1:
+            # Like a browser, an unclosed tag swallows the rest of the input;
+            # copy it as is rather than rescanning it for every '<'
+            yield from flush()
+            yield _indent(depth) + html[pos:]
+            break
+        slash, name = match.groups()
+        tag, self_closing = _clean_tag(slash, name, html[match.end():end - 1])
+        pos = end
+        name = name.lower()
+
+        if not slash and name in RAW_TEXT_ELEMENTS and not self_closing:
+            end_match = HTML_RAW_END_RE[name].search(html, pos)
+            content_end = end_match.start() if end_match else n
+            content = html[pos:content_end]
+            close = f"</{name}>"
+            pos = end_match.end() if end_match else n
+            if name == 'textarea':
+                run.append(tag + content + close)
+            elif name == 'pre':
+                yield from flush()
+                yield _indent(depth) + tag + content + close
+            elif not content.strip():
+                yield from flush()
+                yield _indent(depth) + tag + close
+            else:
+                yield from flush()
+                yield _indent(depth) + tag
+                formatter = (
+                    iter_css_lines if name == 'style'
+                    else iter_javascript_lines
+                )
+                # Drop the blank lines and the closing tag's indentation
+                # around the body
+                body = content.lstrip('\n').rstrip()
+                yield from formatter(body, depth + 1, deadline)
+                yield _indent(depth) + close
+            continue
+
+        if name in INLINE_ELEMENTS:
+            run.append(tag)
+        elif slash:
+            if pending is not None and pending[0] == name:
+                text = run_text()
+                line = pending[1] + text + tag
+                if len(line) <= MAX_INLINE_LINE:
+                    yield _indent(depth) + line
+                    pending = None
+                    continue
+                run.append(text)
+            yield from flush()
+            depth = max(depth - 1, 0)
+            yield _indent(depth) + tag
+        elif name in VOID_ELEMENTS or self_closing:
+            yield from flush()
+            yield _indent(depth) + tag
+        else:
+            yield from flush()
+            pending = (name, tag)
+
+    yield from flush()
+
+
+# ---------------------------------------------------------------------
+
+FORMATTERS = {
+    'html': iter_html_lines,
+    'css': iter_css_lines,
+    'javascript': iter_javascript_lines,
+}
+
+
+def format_code(language, code, max_chars=None, timeout=None):
+    """
+    Formats code, falling back to the input when it's too big or slow.
+
+    Args:
+        language (str): 'html', 'css' or 'javascript'
+        code (str): The code to format
+        max_chars (int): Size limit, defaults to CODE_FORMAT_MAX_CHARS
+        timeout (float): Seconds allowed, defaults to CODE_FORMAT_TIMEOUT
+
+    Returns:
+        str: The formatted code, or the input unchanged
+    """
+    if not code:
+        return code or ''
+    if max_chars is None:
+        max_chars = getattr(settings, 'CODE_FORMAT_MAX_CHARS', 512 * 1024)
+    if timeout is None:
+        timeout = getattr(settings, 'CODE_FORMAT_TIMEOUT', 1.0)
+
+    if max_chars and len(code) > max_chars:
+        logger.warning(
+            f"Not formatting {len(code)} characters of {language}, "
+            f"over the {max_chars} limit"
+        )
+        return code
+    try:
+        lines = list(FORMATTERS[language](code, deadline=Deadline(timeout)))
+    except FormatTimeout:
+        logger.warning(
+            f"Formatting {len(code)} characters of {language} "
+            f"timed out after {timeout}s"
+        )
+        return code
+
+    return '\n'.join(lines).strip('\n')
+
+
+def beautify_code(html: str, css: str, javascript: str = ''):
     return {
-        "html": jsbeautifier.beautify(html, opts),
-        "css": jsbeautifier.beautify(css, opts)
+        "html": format_code('html', html),
+        "css": format_code('css', css),
+        "javascript": format_code('javascript', javascript),
     }
+
+
+def format_generated_code(generated_code):
+    """
+    Formats the sections of a generate_code_from_wireframe result.
+
+    Returns:
+        dict: Formatted 'html', 'css' and 'javascript'
+    """
+    generated_code = generated_code or {}
+    return beautify_code(
+        generated_code.get('html', ''),
+        generated_code.get('css', ''),
+        generated_code.get('javascript', ''),
+    )
@@ -1,142 +1,218 @@
-import os
-import json
-import re
+import itertools
 import logging
-import time
-from pathlib import Path
+from asgiref.sync import sync_to_async
 from django.conf import settings
-import google.generativeai as genai
-from dotenv import load_dotenv
+from .cache import get_response_cache, make_cache_key
+from .credentials import get_model_provider
+from .prompt_encoding import CHARS_PER_TOKEN, EncodedElements, estimate_tokens
+from .prompt_templates import get_prompt_template
+from .ratelimit import get_limiter
+from .response_parser import FenceParser, parse_response_text
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
-def load_api_key():
-    """Load Gemini API key from multiple possible sources"""
-    # Try to load from environment directly first
-    api_key = os.environ.get('GOOGLE_GEMINI_API_KEY')
-    
-    # If not found, check if we have credentials JSON file
-    if not api_key:
-        try:
-            # Look for credentials file in the vision app directory
-            credentials_path = Path(__file__).parent / 'google_credentials.json'
-            if credentials_path.exists():
-                with open(credentials_path, 'r') as f:
-                    credentials = json.load(f)
-                    api_key = credentials.get('api_key')
-                    if api_key:
-                        print("API key loaded from google_credentials.json")
-        except Exception as e:
-            print(f"Error loading credentials file: {str(e)}")
-    
-    # If still not found, try loading from .env file
-    if not api_key:
-        try:
-            # First, try loading from app directory
-            app_dir = Path(__file__).parent
-            env_path = app_dir / '.env'
-            
-            # If not there, try project root
-            if not env_path.exists():
-                project_root = Path(__file__).resolve().parent.parent.parent
-                env_path = project_root / '.env'
-            
-            if env_path.exists():
-                load_dotenv(env_path)
-                api_key = os.environ.get('GOOGLE_GEMINI_API_KEY')
-                if api_key:
-                    print(f"API key loaded from .env file at {env_path}")
-        except Exception as e:
-            print(f"Error loading .env file: {str(e)}")
-    
-    # If still not found, check Django settings
-    if not api_key and hasattr(settings, 'GOOGLE_GEMINI_API_KEY'):
-        api_key = settings.GOOGLE_GEMINI_API_KEY
-        if api_key:
-            print("API key loaded from Django settings")
-    
-    if not api_key:
-        print("API key not found in any configuration")
-        
-    return api_key
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+
+# Prompt of the connection test, and the tokens charged for it
+TEST_PROMPT = "Hello, please respond with 'API connection successful'"
+TEST_PROMPT_TOKENS = 20
 
 def test_gemini_connection():
-    """Test the connection to Gemini API with retries"""
-    max_retries = 3
-    retry_delay = 2
+    """Test the connection to Gemini API (retried by the outbound limiter)"""
+    try:
+        model = get_configured_model()
+    except ValueError:
+        return {"status": "error",
+                "message": "API key not found in configuration"}
     
-    for attempt in range(max_retries):
-        try:
-            api_key = load_api_key()
-            if not api_key:
-                return {"status": "error", "message": "API key not found in configuration"}
-            
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(model_name="gemini-2.0-flash")
-
-            
-            # Removed timeout parameter which was causing the error
-            response = model.generate_content(
-                "Hello, please respond with 'API connection successful'"
-            )
-            
-            return {"status": "success", "message": response.text}
-            
-        except Exception as e:
-            logger.warning(f"Connection attempt {attempt+1}/{max_retries} failed: {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                logger.error(f"Failed to connect to Gemini API after {max_retries} attempts")
-                return {"status": "error", "message": f"Connection failed: {str(e)}"}
-
-def generate_code_from_wireframe(detected_elements, theme="dark"):
+    try:
+        response = get_limiter('gemini').call(
+            lambda: model.generate_content(TEST_PROMPT),
+            tokens=TEST_PROMPT_TOKENS,
+        )
+        return {"status": "success", "message": response.text}
+    except Exception as e:
+        logger.error(f"Failed to connect to Gemini API: {str(e)}")
+        return {"status": "error", "message": f"Connection failed: {str(e)}"}
+
+
+async def test_gemini_connection_async():
+    """Async variant of test_gemini_connection"""
+    try:
+        model = await sync_to_async(
+            get_configured_model, thread_sensitive=False
+        )()
+    except ValueError:
+        return {"status": "error",
+                "message": "API key not found in configuration"}
+
+    try:
+        response = await get_limiter('gemini').call_async(
+            lambda: model.generate_content_async(TEST_PROMPT),
+            tokens=TEST_PROMPT_TOKENS,
+        )
+        return {"status": "success", "message": response.text}
+    except Exception as e:
+        logger.error(f"Failed to connect to Gemini API: {str(e)}")
+        return {"status": "error", "message": f"Connection failed: {str(e)}"}
+
+
+def get_configured_model():
+    """
+    Returns the code generation model.
+
+    The API key is resolved and the model created once per process (see
+    vision.credentials), so this does no I/O after the first call.
+    """
+    return get_model_provider().get_model(GEMINI_MODEL_NAME)
+
+
+def prepare_prompt(detected_elements, theme="dark"):
+    """Builds the prompt within the configured GEMINI_PROMPT_TOKEN_BUDGET"""
+    return build_gemini_prompt(
+        detected_elements,
+        theme,
+        token_budget=get_prompt_token_budget(),
+    )
+
+
+def get_usage(response, prompt_stats):
+    """
+    Collects token usage for one generation.
+
+    Args:
+        response: The Gemini response (after iteration, when streaming)
+        prompt_stats (dict): The stats returned by build_gemini_prompt
+
+    Returns:
+        dict: Element counts plus the prompt/response token counts reported
+            by Gemini (falling back to the prompt estimate)
+    """
+    usage = {
+        'elements': prompt_stats['elements'],
+        'elements_sent': prompt_stats['elements_sent'],
+        'prompt_tokens': prompt_stats['prompt_tokens'],
+    }
+    metadata = getattr(response, 'usage_metadata', None)
+    if metadata is not None:
+        usage['prompt_tokens'] = (
+            getattr(metadata, 'prompt_token_count', None)
+            or usage['prompt_tokens']
+        )
+        usage['response_tokens'] = (
+            getattr(metadata, 'candidates_token_count', None) or 0
+        )
+        usage['total_tokens'] = (
+            getattr(metadata, 'total_token_count', None) or 0
+        )
+    logger.info(f"Gemini usage: {usage}")
+    return usage
+
+
+def generate_code_from_wireframe(detected_elements, theme="dark",
+                                 use_cache=True):
     """
     Uses Google's Gemini API to generate HTML/CSS code from detected wireframe elements.
     
+    Identical prompts are answered from the response cache (see
+    GEMINI_RESPONSE_CACHE) without calling Gemini.
+
     Args:
         detected_elements (dict): The structured data from Vision API containing UI elements
-        theme (str): The theme to use for the generated code ('dark' or 'light', default is 'dark')
+        theme (str): The theme to use for the generated code, a registered
+            theme name (default is 'dark')
+        use_cache (bool): Look up and store the parsed result in the
+            response cache
         
     Returns:
-        dict: Contains the generated HTML and CSS code, or error information
+        dict: Contains the generated HTML and CSS code and token 'usage'
+            (not present for cached results), or error information
     """
     try:
-        # Get API key using our enhanced function
-        api_key = load_api_key()
-        if not api_key:
-            raise ValueError("GOOGLE_GEMINI_API_KEY environment variable not set and not found in Django settings")
-        
-        # Configure the Gemini API
-        genai.configure(api_key=api_key)
-        
-        # Create the model
-        model = genai.GenerativeModel(model_name="gemini-2.0-flash")
-
-        
         # Prepare the prompt with the detected elements and specified theme
-        prompt = construct_gemini_prompt(detected_elements, theme)
+        prompt, prompt_stats = prepare_prompt(detected_elements, theme)
+
+        cache = get_response_cache() if use_cache else None
+        cache_key = make_cache_key(GEMINI_MODEL_NAME, prompt, theme)
+        if cache is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return {'status': 'success', **cached}
+
+        model = get_configured_model()
         
-        # Generate response from Gemini
-        response = model.generate_content(prompt)
+        # Generate response from Gemini, waiting for rate limit capacity
+        # and retrying throttled calls
+        limiter = get_limiter('gemini')
+        response = limiter.call(
+            lambda: model.generate_content(prompt),
+            tokens=prompt_stats['prompt_tokens'],
+        )
         
         # Extract HTML and CSS from the response
-        if hasattr(response, 'text'):
-            response_text = response.text
-        else:
-            # Handle different response format for newer API versions
-            response_text = response.parts[0].text if hasattr(response, 'parts') else str(response)
-        
-        generated_code = parse_gemini_response(response_text)
-        
+        result = code_from_response(response)
+
+        # Don't cache responses we couldn't extract any markup from
+        if cache is not None and result['html']:
+            cache.set(cache_key, result)
+
+        usage = get_usage(response, prompt_stats)
+        limiter.charge(usage.get('response_tokens', 0))
+        return {'status': 'success', **result, 'usage': usage}
+    
+    except Exception as e:
+        print(f"Error in Gemini code generation: {str(e)}")
         return {
-            'status': 'success',
-            'html': generated_code.get('html', ''),
-            'css': generated_code.get('css', ''),
-            'javascript': generated_code.get('javascript', ''),
+            'status': 'error',
+            'message': str(e)
         }
-    
+
+
+async def generate_code_from_wireframe_async(detected_elements, theme="dark",
+                                             use_cache=True):
+    """
+    Async variant of generate_code_from_wireframe for the ASGI views.
+
+    Gemini is awaited with generate_content_async. Prompt building and
+    cache access run in worker threads so the event loop is never blocked.
+
+    Returns:
+        dict: Same as generate_code_from_wireframe
+    """
+    try:
+        prompt, prompt_stats = await sync_to_async(
+            prepare_prompt, thread_sensitive=False
+        )(detected_elements, theme)
+
+        cache = get_response_cache() if use_cache else None
+        cache_key = make_cache_key(GEMINI_MODEL_NAME, prompt, theme)
+        if cache is not None:
+            cached = await sync_to_async(
+                cache.get, thread_sensitive=False
+            )(cache_key)
+            if cached is not None:
+                return {'status': 'success', **cached}
+
+        model = await sync_to_async(
+            get_configured_model, thread_sensitive=False
+        )()
+        limiter = get_limiter('gemini')
+        response = await limiter.call_async(
+            lambda: model.generate_content_async(prompt),
+            tokens=prompt_stats['prompt_tokens'],
+        )
+        result = code_from_response(response)
+
+        if cache is not None and result['html']:
+            await sync_to_async(
+                cache.set, thread_sensitive=False
+            )(cache_key, result)
+
+        usage = get_usage(response, prompt_stats)
+        await limiter.charge_async(usage.get('response_tokens', 0))
+        return {'status': 'success', **result, 'usage': usage}
+
     except Exception as e:
         print(f"Error in Gemini code generation: {str(e)}")
         return {
@@ -144,227 +220,202 @@ def generate_code_from_wireframe(detected_elements, theme="dark"):
             'message': str(e)
         }
 
+
+def code_from_response(response):
+    """Extracts the html/css/javascript sections from a Gemini response"""
+    if hasattr(response, 'text'):
+        response_text = response.text
+    else:
+        # Handle different response format for newer API versions
+        if hasattr(response, 'parts'):
+            response_text = response.parts[0].text
+        else:
+            response_text = str(response)
+
+    generated_code = parse_gemini_response(response_text)
+    return {
+        'html': generated_code.get('html', ''),
+        'css': generated_code.get('css', ''),
+        'javascript': generated_code.get('javascript', ''),
+    }
+
+
+def _open_stream(model, prompt):
+    """
+    Starts a streamed generation; returns the response and an iterator over
+    all its chunks
+    """
+    response = model.generate_content(prompt, stream=True)
+    chunks = iter(response)
+    first = next(chunks, None)
+    head = [first] if first is not None else []
+    return response, itertools.chain(head, chunks)
+
+
+def stream_code_from_wireframe(detected_elements, theme="dark"):
+    """
+    Streaming variant of generate_code_from_wireframe.
+
+    Calls Gemini with streaming enabled and yields events as the response
+    arrives, so the client can render each section as soon as it closes.
+
+    Args:
+        detected_elements (dict): The structured data from Vision API
+            containing UI elements
+        theme (str): The theme to use for the generated code, a registered
+            theme name (default is 'dark')
+
+    Yields:
+        tuple: (event, data) pairs where event is one of
+            'chunk'   - {'text': str}, raw text as it arrives
+            'section' - {'section': str, 'code': str}, a completed code block
+            'done'    - the same dict generate_code_from_wireframe returns
+            'error'   - {'status': 'error', 'message': str}
+    """
+    try:
+        prompt, prompt_stats = prepare_prompt(detected_elements, theme)
+
+        cache = get_response_cache()
+        cache_key = make_cache_key(GEMINI_MODEL_NAME, prompt, theme)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            for section in ('html', 'css', 'javascript'):
+                if cached.get(section):
+                    yield 'section', {
+                        'section': section, 'code': cached[section]
+                    }
+            yield 'done', {'status': 'success', **cached}
+            return
+
+        model = get_configured_model()
+        limiter = get_limiter('gemini')
+        # Quota errors surface with the first chunk, so that is what the
+        # limiter waits for and retries
+        response, chunks = limiter.call(
+            lambda: _open_stream(model, prompt),
+            tokens=prompt_stats['prompt_tokens'],
+        )
+
+        parser = FenceParser()
+        for chunk in chunks:
+            text = chunk.text
+            if not text:
+                continue
+            yield 'chunk', {'text': text}
+            for section, code in parser.feed(text):
+                yield 'section', {'section': section, 'code': code}
+
+        generated_code = parser.close()
+        result = {
+            'html': generated_code.get('html', ''),
+            'css': generated_code.get('css', ''),
+            'javascript': generated_code.get('javascript', ''),
+        }
+        if result['html']:
+            cache.set(cache_key, result)
+
+        usage = get_usage(response, prompt_stats)
+        limiter.charge(usage.get('response_tokens', 0))
+        yield 'done', {'status': 'success', **result, 'usage': usage}
+
+    except Exception as e:
+        print(f"Error in Gemini streaming code generation: {str(e)}")
+        yield 'error', {'status': 'error', 'message': str(e)}
+
+
 def construct_gemini_prompt(detected_elements, theme="dark"):
     """
-    Constructs an effective prompt for Gemini to generate code from wireframe elements.
-    
+    Constructs an effective prompt for Gemini to generate code from
+    wireframe elements.
+
     Args:
         detected_elements (dict): The structured data from Vision API
-        theme (str): The theme to use for the generated code ('dark' or 'light')
-        
+        theme (str): The theme to use for the generated code, a registered
+            theme name
+
     Returns:
         str: A well-structured prompt for the Gemini API
     """
- 
-    elements = detected_elements.get('elements', [])
-    full_text = detected_elements.get('full_text', '')
-    
-   
-    nav_elements = [e for e in elements if e.get('type') == 'navbar']
-    buttons = [e for e in elements if e.get('type') == 'button']
-    input_fields = [e for e in elements if e.get('type') == 'input_field']
-    headings = [e for e in elements if e.get('type') == 'heading']
-    paragraphs = [e for e in elements if e.get('type') == 'paragraph']
-    other_elements = [e for e in elements if e.get('type') not in ['navbar', 'button', 'input_field', 'heading', 'paragraph']]
-    
-    # Dark theme color palette
-    dark_theme_css = """
-    /* Dark Theme Variables */
-    :root {
-      --bg-primary: #121212;
-      --bg-secondary: #1e1e1e;
-      --bg-tertiary: #2c2c2c;
-      --text-primary: #e0e0e0;
-      --text-secondary: #a0a9b1;
-      --accent-color: #4da3ff;
-      --border-color: #444;
-      --success-color: #4caf50;
-      --warning-color: #ff9800;
-      --error-color: #f44336;
-      --shadow-color: rgba(0, 0, 0, 0.3);
-    }
-    
-    /* Base dark theme styles */
-    body {
-      background-color: var(--bg-primary);
-      color: var(--text-primary);
-    }
-    
-    /* Dark theme component styling examples */
-    .card, .panel, .container-dark {
-      background-color: var(--bg-secondary);
-      border: 1px solid var(--border-color);
-      box-shadow: 0 4px 6px var(--shadow-color);
-    }
-    
-    button, .btn {
-      background-color: var(--bg-tertiary);
-      color: var(--text-primary);
-      border: 1px solid var(--border-color);
-    }
-    
-    button:hover, .btn:hover {
-      background-color: var(--accent-color);
-    }
-    
-    input, select, textarea {
-      background-color: var(--bg-tertiary);
-      border: 1px solid var(--border-color);
-      color: var(--text-primary);
-    }
+    return build_gemini_prompt(detected_elements, theme)[0]
+
+
+def get_prompt_token_budget():
+    return getattr(settings, 'GEMINI_PROMPT_TOKEN_BUDGET', 0) or None
+
+
+def build_gemini_prompt(detected_elements, theme="dark", token_budget=None):
     """
+    Builds the prompt and trims the element list to fit a token budget.
+
+    Elements are encoded as compact rows (see prompt_encoding). The token
+    count is estimated locally from the prompt length, so building a prompt
+    makes no Gemini call. If the prompt is over budget, the lowest-priority
+    elements are dropped and replaced by a one-line summary.
     
-    # Light theme color palette (for reference if needed)
-    light_theme_css = """
-    /* Light Theme Variables */
-    :root {
-      --bg-primary: #ffffff;
-      --bg-secondary: #f8f9fa;
-      --bg-tertiary: #e9ecef;
-      --text-primary: #212529;
-      --text-secondary: #6c757d;
-      --accent-color: #007bff;
-      --border-color: #dee2e6;
-      --success-color: #28a745;
-      --warning-color: #ffc107;
-      --error-color: #dc3545;
-      --shadow-color: rgba(0, 0, 0, 0.1);
+    Args:
+        detected_elements (dict): The structured data from Vision API
+        theme (str): The theme to use for the generated code, a registered
+            theme name
+        token_budget (int): Maximum prompt tokens, None for no limit
+        
+    Returns:
+        tuple: (prompt, stats) where stats holds the element and token counts
+    """
+    encoded = EncodedElements(detected_elements)
+    section, included = encoded.render()
+    prompt = render_gemini_prompt(section, theme)
+    stats = {
+        'elements': len(encoded.rows),
+        'elements_sent': included,
+        'prompt_tokens': estimate_tokens(prompt),
     }
+    if not token_budget or stats['prompt_tokens'] <= token_budget:
+        return prompt, stats
+
+    # Shrink the element section by what the rest of the prompt leaves over
+    max_chars = (
+        token_budget * CHARS_PER_TOKEN - 1 - (len(prompt) - len(section))
+    )
+    section, included = encoded.render(max_chars=max(max_chars, 0))
+    prompt = render_gemini_prompt(section, theme)
+    stats.update({
+        'elements_sent': included,
+        'prompt_tokens': estimate_tokens(prompt),
+    })
+    logger.info(
+        f"Prompt trimmed to {token_budget} tokens: sent {included} of "
+        f"{stats['elements']} elements"
+    )
+    return prompt, stats
+
+
+def render_gemini_prompt(elements_section, theme="dark"):
     """
+    Fills the theme's prebuilt prompt with an already encoded element section.
+
+    Args:
+        elements_section (str): Output of EncodedElements.render()
+        theme (str): A registered theme name (see prompt_templates)
+
+    Returns:
+        str: The prompt for the Gemini API
     
-    # Choose theme based on parameter
-    theme_css = dark_theme_css if theme == "dark" else light_theme_css
-    theme_name = "dark" if theme == "dark" else "light"
-    
-    prompt = f"""
-    As an expert web developer, generate responsive HTML, CSS, and JavaScript code based on these wireframe elements detected from an image. 
-    
-    IMPORTANT: Create a {theme_name} themed website with sleek, modern aesthetics.
-    
-    Here's the full text detected in the wireframe:
-    ```
-    {full_text}
-    ```
-    
-    Here are the UI elements detected, organized by type:
-    
-    Navigation Elements:
-    ```
-    {json.dumps(nav_elements, indent=2)}
-    ```
-    
-    Buttons:
-    ```
-    {json.dumps(buttons, indent=2)}
-    ```
-    
-    Input Fields:
-    ```
-    {json.dumps(input_fields, indent=2)}
-    ```
-    
-    Headings:
-    ```
-    {json.dumps(headings, indent=2)}
-    ```
-    
-    Paragraphs:
-    ```
-    {json.dumps(paragraphs, indent=2)}
-    ```
-    
-    Other Elements:
-    ```
-    {json.dumps(other_elements, indent=2)}
-    ```
-    
-    # REQUIREMENTS
-    1. Create a fully functional, modern website implementation of the wireframe.
-    2. Generate pixel-perfect, professional code with excellent design sensibility.
-    3. Use the latest front-end best practices.
-    4. IMPORTANT: Implement a {theme_name} theme with appropriate colors and contrast.
-    
-    # CODE SPECIFICATIONS
-    
-    ## HTML
-    - Use semantic HTML5 tags appropriately (header, nav, main, section, article, footer, etc.)
-    - Follow WCAG accessibility guidelines (proper ARIA attributes, alt text, etc.)
-    - Structure the document logically based on the wireframe layout
-    - Use commented sections to organize the code
-    - Create properly labeled form elements with proper validation attributes
-    
-    ## CSS
-    - Use the following {theme_name} theme color scheme as a starting point:
-    
-    {theme_css}
-    
-    - Implement responsive design with mobile-first approach
-    - Use CSS Grid and Flexbox for layouts
-    - Include media queries for different screen sizes
-    - Add subtle animations and transitions where appropriate
-    - Implement appropriate spacing using consistent padding/margin system
-    - Add hover states and focus states for interactive elements
-    - Ensure good contrast ratios for accessibility
-    - Add subtle depth with box-shadows and subtle gradients when appropriate
-    
-    ## JavaScript
-    - Implement form validation
-    - Add interactivity for dropdowns, modals, or toggles if present
-    - Use event listeners for user interactions
-    - Include any necessary animations or transitions
-    - Implement responsive menu functionality
-    - Use modern ES6+ syntax
-    - Write clean, commented code
-    
-    Return your response in the following format:
-    
-    HTML:
-    ```html
-    (your HTML code here)
-    ```
-    
-    CSS:
-    ```css
-    (your CSS code here)
-    ```
-    
-    JavaScript (if needed):
-    ```javascript
-    (your JavaScript code here)
-    ```
+    Raises:
+        UnknownThemeError: If the theme isn't registered
     """
-    
-    return prompt
+    return get_prompt_template(theme).render(elements_section)
 
 def parse_gemini_response(response_text):
     """
     Parses the Gemini response to extract HTML, CSS, and JavaScript code.
     
+    Uses the single-pass FenceParser, which also accepts language aliases
+    (```js, ```HTML, ...), longer fences and unclosed (truncated) blocks.
+
     Args:
         response_text (str): The text response from Gemini
     
     Returns:
         dict: Contains separated HTML, CSS, and JavaScript code
     """
-    result = {
-        'html': '',
-        'css': '',
-        'javascript': ''
-    }
-    
-    # Extract HTML
-    html_match = re.search(r'```html\s+(.*?)\s+```', response_text, re.DOTALL)
-    if html_match:
-        result['html'] = html_match.group(1).strip()
-    
-    # Extract CSS
-    css_match = re.search(r'```css\s+(.*?)\s+```', response_text, re.DOTALL)
-    if css_match:
-        result['css'] = css_match.group(1).strip()
-    
-    # Extract JavaScript
-    js_match = re.search(r'```javascript\s+(.*?)\s+```', response_text, re.DOTALL)
-    if js_match:
-        result['javascript'] = js_match.group(1).strip()
-    
-    return result
\ No newline at end of file
+    return parse_response_text(response_text)
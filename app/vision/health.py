@@ -0,0 +1,127 @@
+"""
+Health of the upstream AI services, for load balancers and monitoring.
+
+get_health() never calls Google itself. It reports the circuit breakers
+(which follow the real Vision and Gemini calls) and the last result of a
+probe shared by every process on the host. When that result is older than
+HEALTH_PROBE_TTL seconds, the first request to notice starts a new probe
+in a background thread and answers with the previous result.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .gemini_api import get_configured_model
+from .ratelimit import SharedState, get_limiter, state_dir
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+SERVICES = ('gemini', 'vision')
+
+# A probe that hasn't reported after this many seconds is assumed dead and
+# another one may start
+PROBE_TIMEOUT = 60
+
+
+def probe_gemini():
+    # count_tokens checks the key and reachability without using the
+    # generation quota
+    get_configured_model().count_tokens("ping")
+
+
+# Vision has no free call to probe with; its health comes from the breaker
+PROBES = {
+    'gemini': probe_gemini,
+}
+
+
+def _health_state():
+    return SharedState(os.path.join(state_dir(), 'health.json'))
+
+
+def _isoformat(timestamp):
+    if not timestamp:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def run_probes():
+    """Runs every probe and stores the results for get_health()"""
+    results = {}
+    for name, probe in PROBES.items():
+        started = time.monotonic()
+        try:
+            probe()
+            result = {'status': 'ok'}
+        except Exception as e:
+            logger.warning(f"Health probe for {name} failed: {e}")
+            result = {'status': 'error', 'message': str(e)[:200]}
+        result['latency_ms'] = round((time.monotonic() - started) * 1000)
+        results[name] = result
+
+    with _health_state().locked() as state:
+        state.update(probes=results, checked_at=time.time(),
+                     probing_since=None)
+    return results
+
+
+def _refresh_if_stale():
+    """
+    Starts a background probe unless the last one is recent or still
+    running
+    """
+    now = time.time()
+    with _health_state().locked() as state:
+        checked_at = state.get('checked_at') or 0
+        fresh = now - checked_at < settings.HEALTH_PROBE_TTL
+        running = now - (state.get('probing_since') or 0) < PROBE_TIMEOUT
+        if fresh or running:
+            return
+        state['probing_since'] = now
+    threading.Thread(target=run_probes, name='health-probe',
+                     daemon=True).start()
+
+
+def get_health(details=False):
+    """
+    Args:
+        details (bool): Include the upstream error messages (the breaker's
+            'last_error' and a failed probe's 'message'), which can reveal
+            configuration, so only staff get them
+
+    Returns:
+        dict: 'status' ('ok' or 'degraded'), 'checked_at' of the last probe
+        and, per service, its 'breaker' state and last 'probe' result (None
+        for services that aren't probed, or before the first probe finishes)
+    """
+    _refresh_if_stale()
+    state = _health_state().read()
+    probes = state.get('probes') or {}
+
+    services = {}
+    for name in SERVICES:
+        breaker = get_limiter(name).breaker.snapshot()
+        for key in ('last_success_at', 'last_failure_at'):
+            breaker[key] = _isoformat(breaker[key])
+        probe = probes.get(name)
+        if not details:
+            breaker.pop('last_error')
+            if probe:
+                probe = {k: v for k, v in probe.items() if k != 'message'}
+        services[name] = {'breaker': breaker, 'probe': probe}
+
+    degraded = any(
+        service['breaker']['state'] != 'closed'
+        or (service['probe'] and service['probe']['status'] != 'ok')
+        for service in services.values()
+    )
+    return {
+        'status': 'degraded' if degraded else 'ok',
+        'checked_at': _isoformat(state.get('checked_at')),
+        'services': services,
+    }
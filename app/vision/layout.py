@@ -0,0 +1,170 @@
+"""
+Layout analysis for word-level OCR boxes.
+
+Groups words into lines, lines into blocks and blocks into rows/columns, so
+the rest of the pipeline sees "Sign up for our newsletter" as one element
+with a merged bounding box instead of five separate words. Words are swept
+left to right through a grid index keyed on their vertical position, and
+lines top to bottom, so grouping stays around O(n log n).
+"""
+from collections import defaultdict
+from statistics import median
+
+# Words join a line when they overlap vertically by at least this fraction
+# of the smaller height...
+LINE_MIN_OVERLAP = 0.5
+# ...and the horizontal gap is at most this many line heights
+LINE_MAX_GAP = 1.2
+# Lines join a block when the vertical gap is at most this many line heights
+BLOCK_MAX_GAP = 0.8
+
+
+class _Box:
+    __slots__ = ('x0', 'y0', 'x1', 'y1', 'children')
+
+    def __init__(self, x0, y0, x1, y1, children):
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        self.children = children
+
+    @property
+    def height(self):
+        return self.y1 - self.y0
+
+    def add(self, other):
+        self.x0 = min(self.x0, other.x0)
+        self.y0 = min(self.y0, other.y0)
+        self.x1 = max(self.x1, other.x1)
+        self.y1 = max(self.y1, other.y1)
+        self.children.append(other)
+
+
+def _word_box(word):
+    x, y = word['position']['x'], word['position']['y']
+    x1 = x + max(word['width'], 1)
+    y1 = y + max(word['height'], 1)
+    return _Box(x, y, x1, y1, [word])
+
+
+def _group_lines(words):
+    boxes = sorted((_word_box(w) for w in words), key=lambda b: (b.x0, b.y0))
+    cell = max(1, median(b.height for b in boxes))
+
+    # Active lines by the grid row of their first word's vertical centre
+    grid = defaultdict(list)
+    lines = []
+    for box in boxes:
+        row = int((box.y0 + box.y1) / 2 // cell)
+        best, best_gap = None, None
+        for key in (row - 1, row, row + 1):
+            active = grid.get(key)
+            if not active:
+                continue
+            # Words come in x order, so lines that ended too far to the left
+            # can't take any more words
+            active[:] = [
+                line for line in active
+                if (box.x0 - line.x1
+                    <= LINE_MAX_GAP * max(line.height, box.height))
+            ]
+            for line in active:
+                overlap = min(box.y1, line.y1) - max(box.y0, line.y0)
+                if overlap < LINE_MIN_OVERLAP * min(box.height, line.height):
+                    continue
+                gap = box.x0 - line.x1
+                if best is None or gap < best_gap:
+                    best, best_gap = line, gap
+        if best is not None:
+            best.add(box)
+        else:
+            line = _Box(box.x0, box.y0, box.x1, box.y1, [box])
+            grid[row].append(line)
+            lines.append(line)
+    return lines
+
+
+def _group_blocks(lines):
+    blocks = []
+    active = []
+    for line in sorted(lines, key=lambda l: (l.y0, l.x0)):
+        max_gap = BLOCK_MAX_GAP * line.height
+        active = [block for block in active if line.y0 - block.y1 <= max_gap]
+        target = None
+        for block in active:
+            if line.x0 < block.x1 and block.x0 < line.x1:
+                target = block
+                break
+        if target is not None:
+            target.add(line)
+        else:
+            block = _Box(line.x0, line.y0, line.x1, line.y1, [line])
+            active.append(block)
+            blocks.append(block)
+    return blocks
+
+
+def _group_rows(blocks):
+    rows = []
+    for block in sorted(blocks, key=lambda b: b.y0):
+        if rows and block.y0 < rows[-1].y1:
+            rows[-1].add(block)
+        else:
+            rows.append(_Box(block.x0, block.y0, block.x1, block.y1, [block]))
+    for row in rows:
+        row.children.sort(key=lambda b: b.x0)
+    return rows
+
+
+def _line_text(line):
+    return ' '.join(word.children[0]['text'] for word in line.children)
+
+
+def _geometry(box):
+    return {
+        'position': {'x': box.x0, 'y': box.y0},
+        'width': box.x1 - box.x0,
+        'height': box.y1 - box.y0,
+    }
+
+
+def group_words(words):
+    """
+    Groups word-level elements into block-level elements.
+
+    Args:
+        words (list): Elements with 'text', 'position', 'width' and 'height'
+
+    Returns:
+        list: One element per block in reading order (rows top to bottom,
+        blocks left to right), each with the merged 'text' (lines joined by
+        newlines), the merged bounding box, its 'row' and 'column', the word
+        count and, for multi-line blocks, a 'lines' list with each line's
+        text and bounding box. 'type' is left for the caller to classify.
+    """
+    if not words:
+        return []
+
+    lines = _group_lines(words)
+    for line in lines:
+        line.children.sort(key=lambda w: w.x0)
+    blocks = _group_blocks(lines)
+    for block in blocks:
+        block.children.sort(key=lambda l: (l.y0, l.x0))
+
+    elements = []
+    for row_index, row in enumerate(_group_rows(blocks)):
+        for column_index, block in enumerate(row.children):
+            element = {
+                'type': None,
+                'text': '\n'.join(_line_text(line) for line in block.children),
+                **_geometry(block),
+                'row': row_index,
+                'column': column_index,
+                'words': sum(len(line.children) for line in block.children),
+            }
+            if len(block.children) > 1:
+                element['lines'] = [
+                    {'text': _line_text(line), **_geometry(line)}
+                    for line in block.children
+                ]
+            elements.append(element)
+    return elements
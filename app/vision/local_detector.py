@@ -0,0 +1,299 @@
+"""
+Offline wireframe detector built on Pillow and NumPy.
+
+Finds the boxes, lines and text-like marks of a hand-drawn wireframe without
+any network call, and returns them in the same {'elements', 'full_text'}
+structure as the Google Vision path. It has no OCR, so text regions carry an
+empty 'text' and full_text is always ''.
+"""
+import logging
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .preprocess import EXIF_ORIENTATION_TAG, TRANSPOSED_ORIENTATIONS
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Longest side the image is reduced to before analysis
+DEFAULT_MAX_DIMENSION = 1024
+
+# Components smaller than this fraction of the image area are noise
+MIN_COMPONENT_AREA = 0.00001
+# Boxes are at least this big on both sides, so that letters such as 'o'
+# aren't mistaken for boxes (fraction of the longer image side)
+MIN_BOX_SIZE = 0.025
+# Width of the band (as a fraction of the shorter side) checked for box edges
+EDGE_BAND = 0.08
+# Fraction of each box edge that must be drawn for a component to be a box
+MIN_EDGE_COVERAGE = 0.75
+# Boxes whose interior is more than this fraction ink are filled blobs
+MAX_BOX_FILL = 0.35
+# Lines are at most this thick and at least this long (fractions of the image)
+MAX_LINE_THICKNESS = 0.012
+MIN_LINE_LENGTH = 0.08
+# Text marks are at most this tall (fraction of the image height)
+MAX_TEXT_HEIGHT = 0.06
+
+
+def detect_wireframe_elements_local(image_path):
+    """
+    Detects UI elements from a wireframe on the CPU, without Google Vision.
+
+    Args:
+        image_path (str): Path of the wireframe image
+
+    Returns:
+        dict: {'elements': [...], 'full_text': '', 'engine': 'local'}, or the
+        same with an 'error' key if the image couldn't be analysed
+    """
+    try:
+        gray, scale = _load_grayscale(image_path)
+        ink = _binarize(gray)
+        labels, boxes, areas = _label_components(ink)
+        elements = _classify_components(labels, boxes, areas, ink.shape, scale)
+        return {'elements': elements, 'full_text': '', 'engine': 'local'}
+    except Exception as e:
+        logger.exception(
+            f"Error in local wireframe detection for {image_path}"
+        )
+        return {
+            'elements': [], 'full_text': '', 'engine': 'local',
+            'error': str(e),
+        }
+
+
+def _load_grayscale(image_path):
+    """Loads the upright image as a downscaled uint8 array"""
+    max_dimension = getattr(settings, 'LOCAL_DETECTOR_MAX_DIMENSION',
+                            DEFAULT_MAX_DIMENSION)
+    with Image.open(image_path) as original:
+        full_width, full_height = original.size
+        orientation = original.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            full_width, full_height = full_height, full_width
+        if original.format == 'JPEG':
+            original.draft('L', (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(original).convert('L')
+    if max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    # Factor that maps working coordinates back to the original image
+    scale = (full_width / image.width, full_height / image.height)
+    return np.asarray(image), scale
+
+
+def _binarize(gray):
+    """Otsu threshold; returns a boolean array that is True on ink"""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = gray.size
+    levels = np.arange(256)
+    weight_dark = np.cumsum(histogram)
+    weight_light = total - weight_dark
+    sum_dark = np.cumsum(histogram * levels)
+    mean_dark = sum_dark / np.maximum(weight_dark, 1)
+    mean_light = (sum_dark[-1] - sum_dark) / np.maximum(weight_light, 1)
+    variance = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    threshold = int(np.argmax(variance))
+
+    ink = gray <= threshold
+    if ink.mean() > 0.5:
+        # Light strokes on a dark board
+        ink = ~ink
+    return ink
+
+
+def _label_components(ink):
+    """
+    8-connected component labelling over horizontal runs of ink.
+
+    Returns:
+        tuple: (labels, boxes, areas) where labels is an int32 image (0 for
+        background, n + 1 for component n), boxes an (n, 4) array of
+        x0, y0, x1, y1 (inclusive) and areas the pixel count per component
+    """
+    height, width = ink.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = ink
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)  # exclusive
+    run_count = len(run_rows)
+
+    labels = np.zeros((height, width), dtype=np.int32)
+    if run_count == 0:
+        return (labels, np.zeros((0, 4), dtype=np.int64),
+                np.zeros(0, dtype=np.int64))
+
+    parent = list(range(run_count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Union runs that touch a run on the previous row (diagonals included)
+    bounds = np.searchsorted(run_rows, np.arange(height + 1))
+    starts = run_starts.tolist()
+    ends = run_ends.tolist()
+    for row in range(1, height):
+        i, i_end = bounds[row], bounds[row + 1]
+        j, j_end = bounds[row - 1], bounds[row]
+        while i < i_end and j < j_end:
+            if starts[i] <= ends[j] and starts[j] <= ends[i]:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[root_i] = root_j
+            if ends[i] < ends[j]:
+                i += 1
+            else:
+                j += 1
+
+    roots = np.array([find(i) for i in range(run_count)])
+    _, component = np.unique(roots, return_inverse=True)
+    count = component.max() + 1
+
+    boxes = np.empty((count, 4), dtype=np.int64)
+    boxes[:, 0] = width
+    boxes[:, 1] = height
+    boxes[:, 2] = -1
+    boxes[:, 3] = -1
+    np.minimum.at(boxes[:, 0], component, run_starts)
+    np.minimum.at(boxes[:, 1], component, run_rows)
+    np.maximum.at(boxes[:, 2], component, run_ends - 1)
+    np.maximum.at(boxes[:, 3], component, run_rows)
+    areas = np.bincount(
+        component, weights=run_ends - run_starts, minlength=count
+    ).astype(np.int64)
+
+    run_labels = (component + 1).tolist()
+    for row, start, end, label in zip(run_rows.tolist(), starts, ends,
+                                      run_labels):
+        labels[row, start:end] = label
+
+    return labels, boxes, areas
+
+
+def _box_kind(mask):
+    """Returns 'box' if the component mask is a drawn rectangle outline"""
+    height, width = mask.shape
+    band = max(2, int(round(min(width, height) * EDGE_BAND)))
+    if height <= 2 * band or width <= 2 * band:
+        return None
+    coverage = (
+        mask[:band].any(axis=0).mean(),
+        mask[-band:].any(axis=0).mean(),
+        mask[:, :band].any(axis=1).mean(),
+        mask[:, -band:].any(axis=1).mean(),
+    )
+    if min(coverage) < MIN_EDGE_COVERAGE:
+        return None
+    if mask[band:-band, band:-band].mean() > MAX_BOX_FILL:
+        return None
+    return 'box'
+
+
+def _box_type(x0, y0, width, height, image_width, image_height):
+    """Guesses the UI role of a drawn box from its size and position"""
+    aspect = width / max(height, 1)
+    if (width >= 0.8 * image_width and height <= 0.15 * image_height
+            and y0 <= 0.25 * image_height):
+        return 'navbar'
+    if height <= 0.12 * image_height:
+        if aspect >= 4:
+            return 'input_field'
+        if aspect >= 1.5:
+            return 'button'
+    return 'container'
+
+
+def _element(element_type, x0, y0, x1, y1, scale, **extra):
+    scale_x, scale_y = scale
+    element = {
+        'type': element_type,
+        'text': '',
+        'position': {
+            'x': int(round(x0 * scale_x)),
+            'y': int(round(y0 * scale_y))
+        },
+        'width': int(round((x1 - x0 + 1) * scale_x)),
+        'height': int(round((y1 - y0 + 1) * scale_y)),
+    }
+    element.update(extra)
+    return element
+
+
+def _classify_components(labels, boxes, areas, shape, scale):
+    image_height, image_width = shape
+    min_area = max(4, MIN_COMPONENT_AREA * image_width * image_height)
+    max_thickness = max(2, MAX_LINE_THICKNESS * max(image_width, image_height))
+    max_text_height = MAX_TEXT_HEIGHT * image_height
+    min_box_size = MIN_BOX_SIZE * max(image_width, image_height)
+
+    elements = []
+    marks = []
+    components = zip(boxes.tolist(), areas.tolist())
+    for index, ((x0, y0, x1, y1), area) in enumerate(components):
+        if area < min_area:
+            continue
+        width, height = x1 - x0 + 1, y1 - y0 + 1
+
+        if height <= max_thickness and width >= MIN_LINE_LENGTH * image_width:
+            elements.append(_element('divider', x0, y0, x1, y1, scale,
+                                     orientation='horizontal'))
+            continue
+        if width <= max_thickness and height >= MIN_LINE_LENGTH * image_height:
+            elements.append(_element('divider', x0, y0, x1, y1, scale,
+                                     orientation='vertical'))
+            continue
+
+        mask = labels[y0:y1 + 1, x0:x1 + 1] == index + 1
+        if min(width, height) >= min_box_size and _box_kind(mask):
+            element_type = _box_type(x0, y0, width, height,
+                                     image_width, image_height)
+            elements.append(_element(element_type, x0, y0, x1, y1, scale))
+            continue
+
+        if height <= max_text_height:
+            marks.append((x0, y0, x1, y1))
+
+    elements.extend(
+        _element('text', x0, y0, x1, y1, scale)
+        for x0, y0, x1, y1 in _group_text_marks(marks)
+    )
+    elements.sort(key=lambda e: (e['position']['y'], e['position']['x']))
+    return elements
+
+
+def _group_text_marks(marks):
+    """
+    Merges small marks (letters, scribbled words) into text lines: marks
+    that overlap vertically and sit within about one letter height of each
+    other horizontally end up in the same region.
+    """
+    done = []
+    active = []
+    for x0, y0, x1, y1 in sorted(marks):
+        height = y1 - y0 + 1
+        # Lines that ended too far to the left can't grow any more
+        still_active = []
+        for line in active:
+            if x0 - line[2] > 1.5 * max(height, line[3] - line[1] + 1):
+                done.append(line)
+            else:
+                still_active.append(line)
+        active = still_active
+
+        for line in active:
+            lx0, ly0, lx1, ly1 = line
+            line_height = ly1 - ly0 + 1
+            overlap = min(y1, ly1) - max(y0, ly0) + 1
+            if overlap >= 0.5 * min(height, line_height):
+                line[0], line[1] = min(lx0, x0), min(ly0, y0)
+                line[2], line[3] = max(lx1, x1), max(ly1, y1)
+                break
+        else:
+            active.append([x0, y0, x1, y1])
+    return done + active
@@ -0,0 +1,108 @@
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vision.formatter import format_code
+
+
+def build_code(target_kb):
+    """Builds Gemini-style html/css/javascript of roughly target_kb KB each"""
+    html_block = (
+        '<section class="card"><h2>Title</h2>'
+        '<p>Some <strong>body</strong> text here.</p>'
+        '<form><label for="q">Search</label><input id="q" type="text">'
+        '<button>Go</button></form>'
+        '</section>\n'
+    )
+    css_block = (
+        '.card{background-color:var(--bg-secondary);padding:1rem;'
+        'border:1px solid var(--border-color)}\n'
+        '@media (max-width: 600px)'
+        '{.card h2{font-size:1.2rem;margin:0 0 .5rem}}\n'
+    )
+    js_block = (
+        "document.querySelectorAll('.card').forEach(function (card) {\n"
+        "card.addEventListener('click', () => {\n"
+        "card.classList.toggle('open');\n"
+        "});\n"
+        "});\n"
+    )
+    size = target_kb * 1024
+    return {
+        'html': (
+            '<main>\n' + html_block * (size // len(html_block)) + '</main>\n'
+        ),
+        'css': css_block * (size // len(css_block)),
+        'javascript': js_block * (size // len(js_block)),
+    }
+
+
+def pathological_code(target_kb):
+    """Inputs that make naive backtracking formatters go quadratic"""
+    size = target_kb * 1024
+    return {
+        'html': '<div class="' * (size // 12),
+        'css': '{' * size,
+        'javascript': '`${' * (size // 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the code formatters against jsbeautifier (the formatter "
+        "they replaced)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            default=[10, 100, 300],
+                            help='Size of each section in KB')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--no-jsbeautifier', action='store_true',
+                            help="Only time the new formatters")
+
+    def handle(self, *args, **options):
+        beautify = None
+        if not options['no_jsbeautifier']:
+            try:
+                import jsbeautifier
+            except ImportError:
+                raise CommandError(
+                    "jsbeautifier isn't installed "
+                    "(pip install -r requirements.dev.txt), "
+                    "or pass --no-jsbeautifier"
+                )
+            opts = jsbeautifier.default_options()
+            opts.indent_size = 2
+
+            def beautify(code):
+                return jsbeautifier.beautify(code, opts)
+
+        repeat = options['repeat']
+        self.stdout.write(
+            f"{'input':<14} {'section':<11} {'jsbeautifier':>13} "
+            f"{'formatter':>11}"
+        )
+        cases = [(f"{size}KB", build_code(size)) for size in options['sizes']]
+        cases.append(('1MB hostile', pathological_code(1024)))
+
+        for label, code in cases:
+            for language, text in code.items():
+                # No size limit or timeout, to time the formatter itself;
+                # the hostile inputs show what the limits guard against
+                new = min(timeit.repeat(
+                    lambda: format_code(language, text, max_chars=0,
+                                        timeout=0),
+                    number=1, repeat=repeat,
+                ))
+                old = '-'
+                # jsbeautifier takes minutes on the hostile inputs
+                if beautify is not None and 'hostile' not in label:
+                    seconds = min(timeit.repeat(
+                        lambda: beautify(text), number=1, repeat=repeat
+                    ))
+                    old = '%.1fms' % (seconds * 1000)
+                self.stdout.write(
+                    f"{label:<14} {language:<11} {old:>13} "
+                    f"{new * 1000:>9.1f}ms"
+                )
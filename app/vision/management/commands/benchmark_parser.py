@@ -0,0 +1,94 @@
+import re
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from vision.response_parser import FenceParser, parse_response_text
+
+
+def legacy_parse(response_text):
+    """The three-regex parser parse_gemini_response used before FenceParser"""
+    result = {'html': '', 'css': '', 'javascript': ''}
+    for section in result:
+        match = re.search(
+            rf'```{section}\s+(.*?)\s+```', response_text, re.DOTALL
+        )
+        if match:
+            result[section] = match.group(1).strip()
+    return result
+
+
+def build_response(target_kb):
+    """Builds a well-formed Gemini-style response of roughly target_kb KB"""
+    html_line = (
+        '    <div class="card"><h2>Title</h2>'
+        '<p>Some body text here.</p></div>\n'
+    )
+    css_line = (
+        '.card { background-color: var(--bg-secondary); padding: 1rem; }\n'
+    )
+    js_line = (
+        "document.querySelectorAll('.card')"
+        ".forEach(c => c.classList.add('on'));\n"
+    )
+    per_section = target_kb * 1024 // 3
+    return (
+        "Here is the implementation.\n\nHTML:\n```html\n"
+        + html_line * (per_section // len(html_line))
+        + "```\n\nCSS:\n```css\n"
+        + css_line * (per_section // len(css_line))
+        + "```\n\nJavaScript (if needed):\n```javascript\n"
+        + js_line * (per_section // len(js_line))
+        + "```\n"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the Gemini response parser against the legacy regex "
+        "parser"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            default=[100, 300, 600],
+                            help='Response sizes in KB')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--chunk-size', type=int, default=512,
+                            help='Chunk size for the streaming run')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        chunk_size = options['chunk_size']
+        self.stdout.write(
+            f"{'size':>8} {'legacy':>12} {'one-pass':>12} {'streamed':>12}"
+        )
+
+        for size in options['sizes']:
+            text = build_response(size)
+            if legacy_parse(text) != parse_response_text(text):
+                self.stderr.write(
+                    f"Parsers disagree on the {size} KB response"
+                )
+
+            chunks = [
+                text[i:i + chunk_size]
+                for i in range(0, len(text), chunk_size)
+            ]
+
+            def streamed():
+                parser = FenceParser()
+                for chunk in chunks:
+                    parser.feed(chunk)
+                return parser.close()
+
+            def best(func):
+                return min(timeit.repeat(func, number=1, repeat=repeat))
+
+            legacy = best(lambda: legacy_parse(text))
+            one_pass = best(lambda: parse_response_text(text))
+            stream = best(streamed)
+            self.stdout.write(
+                f"{len(text) // 1024:>6}KB {legacy * 1000:>10.2f}ms "
+                f"{one_pass * 1000:>10.2f}ms {stream * 1000:>10.2f}ms"
+            )
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from vision.models import WireframeUpload
+from vision.pagination import WireframeCursorPagination
+from vision.views import user_wireframes_queryset
+
+
+def hot_queries(user):
+    """The queries the vision views run on every request, by name"""
+    page_size = settings.WIREFRAME_LIST_PAGE_SIZE
+    ordering = WireframeCursorPagination.ordering
+    some_wireframe = WireframeUpload.objects.filter(
+        user=user
+    ).values_list('pk', flat=True).first() or 0
+
+    def page(queryset):
+        return queryset.order_by(*ordering)[:page_size + 1]
+
+    return {
+        'detail (wireframe_detail_api, generate_code_api)':
+            WireframeUpload.objects.filter(pk=some_wireframe, user=user),
+        'list page (user_wireframes_api)':
+            page(user_wireframes_queryset(user)),
+        'list page, ?status=completed':
+            page(user_wireframes_queryset(user, ['completed'])),
+        'list page, ?fields=id,title,status':
+            page(user_wireframes_queryset(
+                user, fields=['id', 'title', 'status']
+            )),
+        'uploads stuck in processing':
+            WireframeUpload.objects.filter(
+                status='processing'
+            ).order_by('upload_date')[:100],
+    }
+
+
+class Command(BaseCommand):
+    help = "Prints the EXPLAIN plan of the hot queries in vision/views.py"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user',
+                            help="Username or id to run the queries for "
+                                 "(default: first user)")
+        parser.add_argument('--format',
+                            help="EXPLAIN output format passed to the "
+                                 "database, e.g. JSON or TREE on MySQL")
+        parser.add_argument('--analyze', action='store_true',
+                            help="Run the queries and show actual row "
+                                 "counts (EXPLAIN ANALYZE)")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = User.objects.order_by('pk')
+        if options['user']:
+            lookup = options['user']
+            user = None
+            if lookup.isdigit():
+                user = users.filter(pk=lookup).first()
+            if user is None:
+                user = users.filter(**{User.USERNAME_FIELD: lookup}).first()
+            if user is None:
+                raise CommandError(f"User '{lookup}' not found")
+        else:
+            user = users.first()
+            if user is None:
+                raise CommandError("No users in the database")
+
+        explain_options = {}
+        if options['analyze']:
+            explain_options['analyze'] = True
+
+        for name, queryset in hot_queries(user).items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            try:
+                self.stdout.write(queryset.explain(
+                    format=options['format'], **explain_options
+                ))
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"EXPLAIN failed: {e}"))
+            self.stdout.write('')
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.10 on 2026-10-17 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0002_alter_wireframeupload_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wireframeupload',
+            name='image_sha256',
+            field=models.CharField(
+                blank=True, db_index=True, default='', max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name='wireframeupload',
+            name='theme',
+            field=models.CharField(
+                choices=[('dark', 'Dark'), ('light', 'Light')],
+                default='dark',
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-17 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0003_wireframeupload_image_sha256_theme'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='wireframeupload',
+            name='theme',
+            field=models.CharField(default='dark', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-17 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0004_wireframeupload_theme_registry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='wireframeupload',
+            index=models.Index(fields=['user', '-upload_date', '-id'],
+                               name='vision_wf_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wireframeupload',
+            index=models.Index(fields=['status', 'upload_date'],
+                               name='vision_wf_status_date_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.10 on 2026-10-17 03:45
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0005_wireframeupload_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wireframeupload',
+            name='updated_at',
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
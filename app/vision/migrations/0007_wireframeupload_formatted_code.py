@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-17 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0006_wireframeupload_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wireframeupload',
+            name='format_version',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wireframeupload',
+            name='formatted_code',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
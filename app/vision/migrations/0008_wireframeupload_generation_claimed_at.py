@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-17 03:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0007_wireframeupload_formatted_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wireframeupload',
+            name='generation_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.0.10 on 2026-10-17 04:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0008_wireframeupload_generation_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wireframeupload',
+            name='code_status',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='WireframeArtifact',
+            fields=[
+                ('id', models.BigAutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID',
+                )),
+                ('kind', models.CharField(
+                    choices=[
+                        ('detected_elements', 'Detected elements'),
+                        ('generated_code', 'Generated code'),
+                        ('formatted_code', 'Formatted code'),
+                    ],
+                    max_length=20,
+                )),
+                ('encoding', models.CharField(
+                    choices=[('gzip', 'gzip'), ('zstd', 'zstd')],
+                    max_length=8,
+                )),
+                ('data', models.BinaryField()),
+                ('wireframe', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='artifacts',
+                    to='vision.wireframeupload',
+                )),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='wireframeartifact',
+            constraint=models.UniqueConstraint(
+                fields=('wireframe', 'kind'),
+                name='vision_artifact_wireframe_kind',
+            ),
+        ),
+    ]
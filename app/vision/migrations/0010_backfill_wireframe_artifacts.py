@@ -0,0 +1,111 @@
+"""
+Copies detected_elements, generated_code and formatted_code into
+WireframeArtifact rows and fills in code_status.
+
+Rows are walked in primary key order, BATCH_SIZE at a time, each batch in
+its own short transaction, so the table is never locked as a whole and
+the migration can be interrupted and run again (existing artifacts are
+left alone).
+"""
+import gzip
+import json
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 500
+KINDS = ('detected_elements', 'generated_code', 'formatted_code')
+
+
+def encode(value):
+    # Always gzip here: the stdlib is all a migration can rely on
+    raw = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    return gzip.compress(raw, compresslevel=6)
+
+
+def decode(encoding, data):
+    data = bytes(data)
+    if encoding == 'zstd':
+        import zstandard
+        return json.loads(zstandard.ZstdDecompressor().decompress(data))
+    return json.loads(gzip.decompress(data))
+
+
+def code_status(generated_code):
+    if not generated_code:
+        return ''
+    return generated_code.get('status', 'success')
+
+
+def batches(queryset, fields):
+    last_pk = 0
+    while True:
+        batch = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk')
+            .values('pk', *fields)[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1]['pk']
+
+
+def backfill_artifacts(apps, schema_editor):
+    WireframeUpload = apps.get_model('vision', 'WireframeUpload')
+    WireframeArtifact = apps.get_model('vision', 'WireframeArtifact')
+
+    for batch in batches(WireframeUpload.objects.all(), KINDS):
+        artifacts = []
+        by_status = {}
+        for row in batch:
+            for kind in KINDS:
+                if row[kind] is not None:
+                    artifacts.append(WireframeArtifact(
+                        wireframe_id=row['pk'], kind=kind, encoding='gzip',
+                        data=encode(row[kind]),
+                    ))
+            status = code_status(row['generated_code'])
+            by_status.setdefault(status, []).append(row['pk'])
+
+        with transaction.atomic():
+            WireframeArtifact.objects.bulk_create(artifacts,
+                                                  ignore_conflicts=True)
+            for status, pks in by_status.items():
+                if status:
+                    WireframeUpload.objects.filter(pk__in=pks).update(
+                        code_status=status
+                    )
+
+
+def restore_json_columns(apps, schema_editor):
+    WireframeUpload = apps.get_model('vision', 'WireframeUpload')
+    WireframeArtifact = apps.get_model('vision', 'WireframeArtifact')
+
+    with_artifacts = WireframeUpload.objects.filter(
+        artifacts__isnull=False
+    ).distinct()
+    for batch in batches(with_artifacts, ()):
+        pks = [row['pk'] for row in batch]
+        values = {}
+        rows = WireframeArtifact.objects.filter(
+            wireframe_id__in=pks
+        ).values_list('wireframe_id', 'kind', 'encoding', 'data')
+        for wireframe_id, kind, encoding, data in rows:
+            values.setdefault(wireframe_id, {})[kind] = decode(encoding, data)
+
+        with transaction.atomic():
+            for pk, fields in values.items():
+                WireframeUpload.objects.filter(pk=pk).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    # One transaction per batch instead of one for the whole table
+    atomic = False
+
+    dependencies = [
+        ('vision', '0009_wireframeartifact'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_artifacts, restore_json_columns),
+    ]
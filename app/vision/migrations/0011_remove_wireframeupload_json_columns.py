@@ -0,0 +1,25 @@
+# Generated by Django 4.0.10 on 2026-10-17 04:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision', '0010_backfill_wireframe_artifacts'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='wireframeupload',
+            name='detected_elements',
+        ),
+        migrations.RemoveField(
+            model_name='wireframeupload',
+            name='formatted_code',
+        ),
+        migrations.RemoveField(
+            model_name='wireframeupload',
+            name='generated_code',
+        ),
+    ]
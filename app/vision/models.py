@@ -1,9 +1,23 @@
 # app/app/models.py
 # (Update this path if your models are in a different location)
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings  # ✅ Use settings.AUTH_USER_MODEL instead of importing User
 from django.utils import timezone
+from .artifacts import decode_artifact, encode_artifact
+from .formatter import FORMAT_VERSION, format_generated_code
+
+# Results stored as WireframeArtifact rows but read and assigned like fields
+ARTIFACT_FIELDS = ('detected_elements', 'generated_code', 'formatted_code')
+
+
+def artifact_property(kind, doc):
+    return property(
+        lambda self: self._get_artifact(kind),
+        lambda self, value: self._set_artifact(kind, value),
+        doc=doc,
+    )
+
 
 class WireframeUpload(models.Model):
     """Model for storing wireframe uploads and processing results"""
@@ -14,7 +28,7 @@ class WireframeUpload(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     )
-    
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,  # ✅ This ensures compatibility with custom user models
         on_delete=models.CASCADE,
@@ -24,16 +38,215 @@ class WireframeUpload(models.Model):
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='wireframes/')
     upload_date = models.DateTimeField(default=timezone.now)
+    # Bumped on every save; drives the ETag/Last-Modified of the API.
+    # queryset.update() and bulk_update() must set it explicitly
+    updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploaded')
+    # Name of a theme registered in vision.prompt_templates, validated by
+    # the serializers
+    theme = models.CharField(max_length=20, default='dark')
+
+    # SHA-256 of the uploaded image bytes, used to reuse results for re-uploads
+    image_sha256 = models.CharField(
+        max_length=64, blank=True, default='', db_index=True
+    )
     
-    # Store Vision API detection results as JSON
-    detected_elements = models.JSONField(blank=True, null=True)
-    
-    # Store Gemini generated code as JSON
-    generated_code = models.JSONField(blank=True, null=True)
+    # The JSON results live in WireframeArtifact rows, loaded on first
+    # access and written by save(), so listing and filtering never read them
+    detected_elements = artifact_property('detected_elements',
+                                          "Vision API detection results")
+    generated_code = artifact_property('generated_code',
+                                       "Gemini generated code")
+    # generated_code run through vision.formatter
+    formatted_code = artifact_property('formatted_code',
+                                       "Formatted generated code")
     
+    # FORMAT_VERSION formatted_code was formatted with (0 = not formatted yet)
+    format_version = models.PositiveSmallIntegerField(default=0)
+
+    # 'status' of generated_code ('' until code is generated), kept on the
+    # row so deciding whether to generate needs no artifact. Set when
+    # generated_code is assigned
+    code_status = models.CharField(max_length=10, blank=True, default='')
+
+    # Set while a request generates code for this wireframe, see
+    # pipeline.claim_generation
+    generation_claimed_at = models.DateTimeField(blank=True, null=True)
+
     class Meta:
         ordering = ['-upload_date']
+        indexes = [
+            # Per-user history, newest first (matches the list pagination
+            # order)
+            models.Index(fields=['user', '-upload_date', '-id'],
+                         name='vision_wf_user_date_idx'),
+            # Status filtering and finding uploads stuck in a status
+            models.Index(fields=['status', 'upload_date'],
+                         name='vision_wf_status_date_idx'),
+        ]
     
+    def _artifact_cache(self):
+        cache = self.__dict__.get('_artifacts')
+        if cache is None:
+            # values: decoded by kind; rows: (encoding, data) by kind, or
+            # None until loaded; dirty: kinds assigned since the last save
+            cache = {'values': {}, 'rows': None, 'dirty': set()}
+            self.__dict__['_artifacts'] = cache
+        return cache
+
+    def _get_artifact(self, kind):
+        cache = self._artifact_cache()
+        if kind not in cache['values']:
+            if cache['rows'] is None:
+                # One query loads every artifact; each is decompressed
+                # only when it is read
+                cache['rows'] = {}
+                if self.pk is not None:
+                    rows = self.artifacts.values_list(
+                        'kind', 'encoding', 'data'
+                    )
+                    cache['rows'] = {
+                        row_kind: (encoding, data)
+                        for row_kind, encoding, data in rows
+                    }
+            row = cache['rows'].get(kind)
+            cache['values'][kind] = decode_artifact(*row) if row else None
+        return cache['values'][kind]
+
+    def _set_artifact(self, kind, value):
+        cache = self._artifact_cache()
+        cache['values'][kind] = value
+        cache['dirty'].add(kind)
+        if kind == 'generated_code':
+            self.code_status = value.get('status', 'success') if value else ''
+
+    def load_artifacts(self, *kinds):
+        """
+        Loads artifacts (all by default) ahead of use, e.g. in a thread
+        before async code reads them, as reading one may query the database.
+        """
+        for kind in kinds or ARTIFACT_FIELDS:
+            self._get_artifact(kind)
+
+    def _save_artifacts(self, kinds):
+        cache = self._artifact_cache()
+        for kind in kinds:
+            value = cache['values'][kind]
+            if value is None:
+                self.artifacts.filter(kind=kind).delete()
+            else:
+                encoding, data = encode_artifact(value)
+                WireframeArtifact.objects.update_or_create(
+                    wireframe=self, kind=kind,
+                    defaults={'encoding': encoding, 'data': data},
+                )
+        cache['dirty'] -= set(kinds)
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the row and the artifacts assigned since the last save.
+        update_fields may name artifacts to save only those.
+        """
+        dirty = set(self._artifact_cache()['dirty'])
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            dirty &= set(update_fields)
+            kwargs['update_fields'] = [
+                name for name in update_fields if name not in ARTIFACT_FIELDS
+            ]
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            self._save_artifacts(dirty)
+
+    @classmethod
+    def bulk_save_artifacts(cls, wireframes):
+        """
+        Saves the assigned artifacts of many wireframes, e.g. after
+        bulk_update()
+        """
+        with transaction.atomic():
+            for wireframe in wireframes:
+                dirty = set(wireframe._artifact_cache()['dirty'])
+                wireframe._save_artifacts(dirty)
+
+    def refresh_from_db(self, using=None, fields=None):
+        """
+        Also drops the loaded artifacts that are refreshed (all when fields
+        is None)
+        """
+        if fields is None:
+            self.__dict__.pop('_artifacts', None)
+        elif set(fields) & set(ARTIFACT_FIELDS):
+            cache = self._artifact_cache()
+            cache['rows'] = None
+            for kind in set(fields) & set(ARTIFACT_FIELDS):
+                cache['values'].pop(kind, None)
+                cache['dirty'].discard(kind)
+        if fields is not None:
+            fields = [name for name in fields if name not in ARTIFACT_FIELDS]
+            if not fields:
+                return
+        super().refresh_from_db(using=using, fields=fields)
+
+    def needs_code(self):
+        """True if no code was generated yet, or the last attempt failed"""
+        return self.code_status in ('', 'error')
+
+    def set_generated_code(self, generated_code):
+        """Stores a Gemini result along with its formatted code"""
+        self.generated_code = generated_code
+        if generated_code and generated_code.get('status') != 'error':
+            self.formatted_code = format_generated_code(generated_code)
+            self.format_version = FORMAT_VERSION
+        else:
+            self.formatted_code = None
+            self.format_version = 0
+
+    def get_formatted_code(self):
+        """
+        Returns the formatted code, re-formatting (and saving) it first if it
+        is missing or was formatted by an older formatter.
+        """
+        if (self.format_version != FORMAT_VERSION
+                or self.formatted_code is None):
+            self.formatted_code = format_generated_code(self.generated_code)
+            self.format_version = FORMAT_VERSION
+            # Not touching updated_at: the code ETag already includes the
+            # format version
+            self.save(update_fields=['formatted_code', 'format_version'])
+        return self.formatted_code
+
     def __str__(self):
         return f"{self.title} - {self.user.username}"
+
+
+class WireframeArtifact(models.Model):
+    """
+    A large JSON result of a wireframe, compressed and kept off the
+    WireframeUpload row (see vision.artifacts)
+    """
+
+    KIND_CHOICES = (
+        ('detected_elements', 'Detected elements'),
+        ('generated_code', 'Generated code'),
+        ('formatted_code', 'Formatted code'),
+    )
+    ENCODING_CHOICES = (
+        ('gzip', 'gzip'),
+        ('zstd', 'zstd'),
+    )
+
+    wireframe = models.ForeignKey(WireframeUpload, on_delete=models.CASCADE,
+                                  related_name='artifacts')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    encoding = models.CharField(max_length=8, choices=ENCODING_CHOICES)
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wireframe', 'kind'],
+                                    name='vision_artifact_wireframe_kind'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} of wireframe {self.wireframe_id}"
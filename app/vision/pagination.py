@@ -0,0 +1,15 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class WireframeCursorPagination(CursorPagination):
+    """
+    Cursor pagination over upload_date, newest first.
+
+    Cursors stay stable while new sketches are uploaded and don't need a
+    COUNT(*) over the user's rows, unlike page-number pagination.
+    """
+    ordering = ('-upload_date', '-id')
+    page_size = settings.WIREFRAME_LIST_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.WIREFRAME_LIST_MAX_PAGE_SIZE
@@ -0,0 +1,371 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from vision.vision_api import (
+    detect_elements, detect_elements_async, detect_elements_batch,
+)
+from vision.gemini_api import (
+    generate_code_from_wireframe, generate_code_from_wireframe_async,
+)
+from .dedupe import find_reusable_upload
+from .models import WireframeUpload
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+def _reuse_results(wireframe):
+    """
+    Copies results from an earlier upload of the same image and theme.
+
+    Returns:
+        bool: True if results were reused and no upstream call is needed
+    """
+    source = find_reusable_upload(wireframe)
+    if source is None:
+        return False
+    logger.info(f"Reusing results of wireframe {source.pk} for {wireframe.pk}")
+    wireframe.detected_elements = source.detected_elements
+    wireframe.generated_code = source.generated_code
+    wireframe.formatted_code = source.formatted_code
+    wireframe.format_version = source.format_version
+    wireframe.status = 'completed'
+    return True
+
+
+def _generate(wireframe):
+    """Runs Gemini for a wireframe whose detected_elements are already set"""
+    detected_elements = wireframe.detected_elements
+    if detected_elements.get('error'):
+        # Nothing to generate from when Vision failed
+        wireframe.status = 'failed'
+        return wireframe
+
+    generated_code = generate_code_from_wireframe(
+        detected_elements, theme=wireframe.theme
+    )
+    wireframe.set_generated_code(generated_code)
+    failed = generated_code.get('status') == 'error'
+    wireframe.status = 'failed' if failed else 'completed'
+    return wireframe
+
+
+def process_wireframe(wireframe, engine=None):
+    """
+    Runs the full Vision + Gemini pipeline for a single wireframe upload.
+
+    The wireframe is moved to 'processing' before any upstream call is made
+    and ends in 'completed' or 'failed'. Used both inline by the upload view
+    and by the Celery worker.
+
+    Args:
+        wireframe (WireframeUpload): The upload to process
+        engine (str): Detection engine, see vision_api.DETECTION_ENGINES
+
+    Returns:
+        WireframeUpload: The same instance, saved with its final status
+    """
+    if wireframe.status != 'processing':
+        wireframe.status = 'processing'
+        wireframe.save(update_fields=['status', 'updated_at'])
+
+    # Same image and theme already processed: copy the results instead of
+    # paying for another Vision + Gemini round trip
+    if _reuse_results(wireframe):
+        wireframe.save()
+        return wireframe
+
+    try:
+        # Step 1: Detect elements with Vision API (or the local detector)
+        wireframe.detected_elements = detect_elements(
+            wireframe.image.path, engine=engine
+        )
+
+        # Step 2: Generate code with Gemini API
+        _generate(wireframe)
+    except Exception:
+        wireframe.status = 'failed'
+        logger.exception(f"Error processing wireframe {wireframe.pk}")
+
+    wireframe.save()
+    return wireframe
+
+
+async def _generate_async(wireframe):
+    """Async variant of _generate"""
+    detected_elements = wireframe.detected_elements
+    if detected_elements.get('error'):
+        wireframe.status = 'failed'
+        return wireframe
+
+    generated_code = await generate_code_from_wireframe_async(
+        detected_elements, theme=wireframe.theme
+    )
+    # Formatting is CPU bound, keep it off the event loop
+    await sync_to_async(
+        wireframe.set_generated_code, thread_sensitive=False
+    )(generated_code)
+    failed = generated_code.get('status') == 'error'
+    wireframe.status = 'failed' if failed else 'completed'
+    return wireframe
+
+
+async def process_wireframe_async(wireframe, engine=None):
+    """
+    Async variant of process_wireframe for the ASGI views.
+
+    Vision and Gemini are awaited on the event loop, so one process can
+    have many wireframes in flight; ORM access goes through sync_to_async.
+
+    Args:
+        wireframe (WireframeUpload): The upload to process
+        engine (str): Detection engine, see vision_api.DETECTION_ENGINES
+
+    Returns:
+        WireframeUpload: The same instance, saved with its final status
+    """
+    if wireframe.status != 'processing':
+        wireframe.status = 'processing'
+        await sync_to_async(wireframe.save)(
+            update_fields=['status', 'updated_at']
+        )
+
+    if await sync_to_async(_reuse_results)(wireframe):
+        await sync_to_async(wireframe.save)()
+        return wireframe
+
+    try:
+        wireframe.detected_elements = await detect_elements_async(
+            wireframe.image.path, engine=engine
+        )
+        await _generate_async(wireframe)
+    except Exception:
+        wireframe.status = 'failed'
+        logger.exception(f"Error processing wireframe {wireframe.pk}")
+
+    await sync_to_async(wireframe.save)()
+    return wireframe
+
+
+# Written when a request stores the code it generated
+CODE_FIELDS = [
+    'generated_code', 'formatted_code', 'format_version', 'code_status',
+    'updated_at',
+]
+
+
+class ClaimRenewer(threading.Thread):
+    """
+    Renews a generation claim every third of GEMINI_GENERATION_LEASE while
+    it is held. A Gemini call can wait OUTBOUND_MAX_WAIT seconds for quota,
+    retry and then take a while itself, so without renewals the lease could
+    expire mid-call and let a second request generate the same code.
+    """
+
+    def __init__(self, pk, claimed_at):
+        super().__init__(name=f'claim-renewer-{pk}', daemon=True)
+        self.pk = pk
+        self.claimed_at = claimed_at
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.GEMINI_GENERATION_LEASE / 3):
+                now = timezone.now()
+                renewed = WireframeUpload.objects.filter(
+                    pk=self.pk, generation_claimed_at=self.claimed_at
+                ).update(generation_claimed_at=now)
+                if not renewed:
+                    # Released, or lost after all (e.g. the process stalled)
+                    return
+                self.claimed_at = now
+        finally:
+            connection.close()
+
+    def stop(self):
+        """Stops renewing; returns the claim's current generation_claimed_at"""
+        self.stopped.set()
+        self.join()
+        return self.claimed_at
+
+
+def claim_generation(wireframe):
+    """
+    Claims the right to generate code for a wireframe.
+
+    The claim is a lease on generation_claimed_at taken with a conditional
+    UPDATE, so the database (which locks the row for the update) picks a
+    single winner among concurrent requests, whichever thread or worker
+    process they run in. A ClaimRenewer keeps the lease alive until
+    release_generation; a claim left behind by a killed worker expires
+    after GEMINI_GENERATION_LEASE seconds.
+
+    Returns:
+        bool: True if this caller holds the claim and must release it
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.GEMINI_GENERATION_LEASE)
+    claimed = WireframeUpload.objects.filter(pk=wireframe.pk).filter(
+        Q(generation_claimed_at__isnull=True)
+        | Q(generation_claimed_at__lt=expired)
+    ).update(generation_claimed_at=now)
+    if claimed:
+        wireframe.generation_claimed_at = now
+        renewer = ClaimRenewer(wireframe.pk, now)
+        wireframe.__dict__['_claim_renewer'] = renewer
+        renewer.start()
+    return bool(claimed)
+
+
+def release_generation(wireframe):
+    """
+    Releases a claim taken by claim_generation, unless it expired and was
+    taken over
+    """
+    renewer = wireframe.__dict__.pop('_claim_renewer', None)
+    if renewer is not None:
+        wireframe.generation_claimed_at = renewer.stop()
+    WireframeUpload.objects.filter(
+        pk=wireframe.pk, generation_claimed_at=wireframe.generation_claimed_at
+    ).update(generation_claimed_at=None)
+    wireframe.generation_claimed_at = None
+
+
+def claim_missing_code(wireframe):
+    """
+    Claims generation for a wireframe that needs code.
+
+    Another request may have stored code between loading the wireframe and
+    taking the claim, so the code is reloaded once the claim is held.
+
+    Returns:
+        str: 'claimed' if the caller must generate the code and release the
+        claim, 'pending' if another request is generating it, 'done' if
+        the code is now available
+    """
+    if not claim_generation(wireframe):
+        return 'pending'
+    wireframe.refresh_from_db(fields=[
+        'generated_code', 'formatted_code', 'format_version', 'code_status',
+    ])
+    if not wireframe.needs_code():
+        release_generation(wireframe)
+        return 'done'
+    return 'claimed'
+
+
+def generate_missing_code(wireframe):
+    """
+    Generates and stores code for a wireframe that has none, unless another
+    request for the same wireframe is already doing it.
+
+    Returns:
+        bool: False if another request holds the claim (the code is
+        pending), True once the wireframe has its code
+    """
+    claim = claim_missing_code(wireframe)
+    if claim == 'pending':
+        return False
+    if claim == 'claimed':
+        try:
+            wireframe.set_generated_code(generate_code_from_wireframe(
+                wireframe.detected_elements, theme=wireframe.theme
+            ))
+            wireframe.save(update_fields=CODE_FIELDS)
+        finally:
+            release_generation(wireframe)
+    return True
+
+
+async def generate_missing_code_async(wireframe):
+    """Async variant of generate_missing_code"""
+    claim = await sync_to_async(claim_missing_code)(wireframe)
+    if claim == 'pending':
+        return False
+    if claim == 'claimed':
+        try:
+            await sync_to_async(wireframe.load_artifacts)('detected_elements')
+            generated_code = await generate_code_from_wireframe_async(
+                wireframe.detected_elements, theme=wireframe.theme
+            )
+            await sync_to_async(
+                wireframe.set_generated_code, thread_sensitive=False
+            )(generated_code)
+            await sync_to_async(wireframe.save)(update_fields=CODE_FIELDS)
+        finally:
+            await sync_to_async(release_generation)(wireframe)
+    return True
+
+
+def process_wireframe_batch(wireframes, engine=None):
+    """
+    Runs the pipeline for many uploads at once.
+
+    Images are sent to Vision in batched requests and Gemini generation runs
+    on a thread pool bounded by GEMINI_MAX_CONCURRENCY. A failure on one
+    wireframe only marks that wireframe as 'failed'.
+
+    Args:
+        wireframes (list): WireframeUpload instances to process
+        engine (str): Detection engine, see vision_api.DETECTION_ENGINES
+
+    Returns:
+        list: The same instances, saved with their final status
+    """
+    wireframes = list(wireframes)
+    WireframeUpload.objects.filter(
+        pk__in=[w.pk for w in wireframes]
+    ).update(status='processing', updated_at=timezone.now())
+    for wireframe in wireframes:
+        wireframe.status = 'processing'
+
+    pending = [w for w in wireframes if not _reuse_results(w)]
+
+    if pending:
+        try:
+            # Step 1: Detect elements with batched Vision requests
+            detections = detect_elements_batch(
+                [w.image.path for w in pending], engine=engine
+            )
+            for wireframe, detected_elements in zip(pending, detections):
+                wireframe.detected_elements = detected_elements
+
+            # Step 2: Generate code with bounded Gemini concurrency
+            max_workers = getattr(settings, 'GEMINI_MAX_CONCURRENCY', 4)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    w.pk: executor.submit(_generate, w) for w in pending
+                }
+            for wireframe in pending:
+                try:
+                    futures[wireframe.pk].result()
+                except Exception:
+                    wireframe.status = 'failed'
+                    logger.exception(
+                        f"Error processing wireframe {wireframe.pk}"
+                    )
+        except Exception:
+            logger.exception("Error processing wireframe batch")
+            for wireframe in pending:
+                if wireframe.status == 'processing':
+                    wireframe.status = 'failed'
+
+    # bulk_update doesn't apply auto_now, so stamp updated_at ourselves
+    now = timezone.now()
+    for wireframe in wireframes:
+        wireframe.updated_at = now
+    with transaction.atomic():
+        WireframeUpload.objects.bulk_update(
+            wireframes,
+            ['status', 'format_version', 'code_status', 'updated_at'],
+        )
+        WireframeUpload.bulk_save_artifacts(wireframes)
+    return wireframes
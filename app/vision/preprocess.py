@@ -0,0 +1,92 @@
+import io
+import logging
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREPROCESS_SETTINGS = {
+    'ENABLED': True,
+    'MAX_DIMENSION': 2048,
+    'MODE': 'grayscale',
+    'BINARIZE_THRESHOLD': 160,
+    'FORMAT': 'JPEG',
+    'JPEG_QUALITY': 85,
+}
+
+# EXIF orientations that rotate the image by 90 or 270 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def get_preprocess_settings():
+    config = dict(DEFAULT_PREPROCESS_SETTINGS)
+    config.update(getattr(settings, 'VISION_PREPROCESS', {}))
+    return config
+
+
+def preprocess_image(image_path):
+    """
+    Prepares an image for OCR: EXIF-rotates it, downscales it to
+    MAX_DIMENSION, converts it to grayscale (or black and white) and
+    re-encodes it compactly, as configured by the VISION_PREPROCESS setting.
+
+    Args:
+        image_path (str): Path of the uploaded image
+
+    Returns:
+        tuple: (content, scale) where content is the encoded image bytes to
+        send to Vision and scale is the (x, y) factor that maps pixel
+        coordinates in the processed image back to the original upright image
+    """
+    config = get_preprocess_settings()
+    if not config['ENABLED']:
+        with open(image_path, 'rb') as image_file:
+            return image_file.read(), (1.0, 1.0)
+
+    max_dimension = config['MAX_DIMENSION']
+    mode = config['MODE']
+
+    with Image.open(image_path) as original:
+        width, height = original.size
+        orientation = original.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+
+        if original.format == 'JPEG':
+            # Let the JPEG decoder scale down while decoding instead of
+            # decoding the full-size image first
+            original.draft('RGB' if mode == 'color' else 'L',
+                           (max_dimension, max_dimension))
+
+        image = ImageOps.exif_transpose(original)
+        if max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        if mode == 'binarize':
+            threshold = config['BINARIZE_THRESHOLD']
+            image = image.convert('L').point(
+                lambda value: 255 if value > threshold else 0
+            )
+        elif mode == 'grayscale':
+            image = image.convert('L')
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        buffer = io.BytesIO()
+        if config['FORMAT'].upper() == 'PNG':
+            if mode == 'binarize':
+                image = image.convert('1')
+            image.save(buffer, format='PNG', optimize=True)
+        else:
+            image.save(buffer, format='JPEG',
+                       quality=config['JPEG_QUALITY'], optimize=True)
+
+    scale = (width / image.width, height / image.height)
+    logger.debug(
+        f"Preprocessed {image_path}: {width}x{height} -> "
+        f"{image.width}x{image.height}, {buffer.tell()} bytes"
+    )
+    return buffer.getvalue(), scale
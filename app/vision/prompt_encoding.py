@@ -0,0 +1,199 @@
+"""
+Compact encoding of detected elements for the Gemini prompt.
+
+Elements are written as one pipe-separated row each, with coordinates
+rounded and duplicate rows removed. Rows carry a priority so the element
+section can be trimmed to fit a token budget, dropping low-value elements
+first.
+"""
+from collections import Counter
+
+# Pixel coordinates are rounded to this step
+COORD_STEP = 5
+# Rough token estimate used before (or instead of) asking Gemini
+CHARS_PER_TOKEN = 4
+
+# Higher values are kept longer when trimming to the token budget
+TYPE_PRIORITY = {
+    'navbar': 4,
+    'button': 4,
+    'input_field': 4,
+    'heading': 3,
+    'menu': 3,
+    'paragraph': 2,
+    'container': 2,
+    'divider': 1,
+    'text': 1,
+}
+# Objects below this confidence are the first to go
+OBJECT_MIN_CONFIDENCE = 0.5
+
+ELEMENTS_HEADER = (
+    "Here are the UI elements detected, one per line as "
+    "type|text|x,y,width,height (pixels){layout_columns}, in reading order:"
+)
+OBJECTS_HEADER = (
+    "Here are the objects detected, one per line as "
+    "name|confidence|x,y,width,height (% of the image):"
+)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _round(value):
+    return int(round((value or 0) / COORD_STEP) * COORD_STEP)
+
+
+def _clean(text):
+    parts = (part.strip() for part in (text or '').splitlines())
+    return ' / '.join(part for part in parts if part).replace('|', '/')
+
+
+class EncodedElements:
+    """The element and object rows of one detection result"""
+
+    def __init__(self, detected_elements):
+        self.full_text = detected_elements.get('full_text', '') or ''
+        self.has_layout = False
+        self.has_text = False
+        self.rows = []      # (priority, order, table, row, type)
+        seen = set()
+
+        elements = detected_elements.get('elements', [])
+        for order, element in enumerate(self._reading_order(elements)):
+            if element.get('type') == 'object':
+                row = self._object_row(element)
+                table = 'objects'
+                confidence = element.get('confidence') or 0
+                priority = 2 if confidence >= OBJECT_MIN_CONFIDENCE else 0
+            else:
+                row = self._element_row(element)
+                table = 'elements'
+                priority = TYPE_PRIORITY.get(element.get('type'), 1)
+                if _clean(element.get('text')):
+                    self.has_text = True
+            if (table, row) in seen:
+                continue
+            seen.add((table, row))
+            self.rows.append(
+                (priority, order, table, row, element.get('type'))
+            )
+
+    def _reading_order(self, elements):
+        if any('row' in e for e in elements):
+            self.has_layout = True
+
+        def key(element):
+            if 'row' in element:
+                return (0, element['row'], element['column'], 0)
+            position = (
+                element.get('position') or element.get('bounding_box') or {}
+            )
+            return (1, position.get('y', 0), position.get('x', 0), 0)
+        return sorted(elements, key=key)
+
+    def _element_row(self, element):
+        position = element.get('position') or {}
+        row = (
+            f"{element.get('type')}|{_clean(element.get('text'))}|"
+            f"{_round(position.get('x'))},{_round(position.get('y'))},"
+            f"{_round(element.get('width'))},{_round(element.get('height'))}"
+        )
+        if 'row' in element:
+            row += f"|{element['row'] + 1},{element['column'] + 1}"
+        return row
+
+    def _object_row(self, element):
+        box = element.get('bounding_box') or {}
+        percent = [
+            int(round((box.get(k) or 0) * 100))
+            for k in ('x', 'y', 'width', 'height')
+        ]
+        confidence = element.get('confidence') or 0
+        return (
+            f"{_clean(element.get('name'))}|{confidence:.2f}|"
+            + ','.join(str(p) for p in percent)
+        )
+
+    def render(self, max_chars=None):
+        """
+        Renders the element section of the prompt.
+
+        Args:
+            max_chars (int): Optional size limit. Rows are dropped lowest
+                priority first (later rows first within a priority) and a
+                one-line summary of what was dropped is appended.
+
+        Returns:
+            tuple: (section text, number of rows included)
+        """
+        rows = self.rows
+        omitted = []
+        if max_chars is not None and self._size(rows) > max_chars:
+            # Reserve room for the summary line
+            budget = max_chars - 120
+            kept = []
+            # Size of the headers and fences, with one row per table
+            firsts = list(
+                {entry[2]: entry for entry in reversed(rows)}.values()
+            )
+            used = self._size(firsts) - sum(
+                len(entry[3]) + 1 for entry in firsts
+            )
+            for entry in sorted(rows, key=lambda r: (-r[0], r[1])):
+                cost = len(entry[3]) + 1
+                if used + cost <= budget:
+                    kept.append(entry)
+                    used += cost
+                else:
+                    omitted.append(entry)
+            rows = sorted(kept, key=lambda r: r[1])
+
+        section = self._format(rows, omitted)
+        return section, len(rows)
+
+    def _size(self, rows):
+        return len(self._format(rows, []))
+
+    def _format(self, rows, omitted):
+        parts = []
+        # full_text only repeats the words already in the rows, so it is
+        # only sent when no element carries text
+        if self.full_text.strip() and not self.has_text:
+            parts.append(
+                "Here's the full text detected in the wireframe:\n"
+                "```\n%s\n```" % self.full_text.strip()
+            )
+
+        element_rows = [r[3] for r in rows if r[2] == 'elements']
+        if element_rows:
+            header = ELEMENTS_HEADER.format(
+                layout_columns='|row,column' if self.has_layout else ''
+            )
+            parts.append(
+                "%s\n```\n%s\n```" % (header, '\n'.join(element_rows))
+            )
+
+        object_rows = [r[3] for r in rows if r[2] == 'objects']
+        if object_rows:
+            parts.append(
+                "%s\n```\n%s\n```" % (OBJECTS_HEADER, '\n'.join(object_rows))
+            )
+
+        if omitted:
+            counts = Counter(r[4] for r in omitted)
+            summary = ', '.join(
+                f"{count} {kind}" for kind, count in counts.most_common()
+            )
+            parts.append(
+                f"({len(omitted)} lower-priority elements omitted to save "
+                f"space: {summary})"
+            )
+
+        if not parts:
+            parts.append(
+                "No UI elements were detected; design a sensible page layout."
+            )
+        return '\n\n'.join(parts)
@@ -0,0 +1,89 @@
+"""
+Prompt templates and the theme registry.
+
+Templates and theme palettes are read from vision/prompts once, at import.
+For every registered theme the static part of the prompt (instructions and
+palette) is rendered once, so per call only the element section is added.
+The element section comes last, leaving a stable prefix that the provider
+can cache.
+
+Themes are picked up from vision/prompts/themes/<name>.css; more can be
+added in code with register_theme().
+"""
+from pathlib import Path
+from string import Template
+
+PROMPTS_DIR = Path(__file__).parent / 'prompts'
+THEMES_DIR = PROMPTS_DIR / 'themes'
+ELEMENTS_PLACEHOLDER = '$elements'
+
+
+class UnknownThemeError(ValueError):
+    """Raised when a prompt is requested for a theme that isn't registered"""
+
+
+def load_template(name):
+    """Reads vision/prompts/<name>.txt"""
+    return Template((PROMPTS_DIR / f'{name}.txt').read_text(encoding='utf-8'))
+
+
+CODEGEN_TEMPLATE = load_template('codegen')
+
+
+class PromptTemplate:
+    """A template with everything but the element section already rendered"""
+
+    def __init__(self, template, **values):
+        rendered = template.safe_substitute(**values)
+        self.prefix, found, self.suffix = rendered.partition(
+            ELEMENTS_PLACEHOLDER
+        )
+        if not found:
+            raise ValueError(
+                f"Prompt template has no {ELEMENTS_PLACEHOLDER} placeholder"
+            )
+
+    def render(self, elements_section):
+        return self.prefix + elements_section + self.suffix
+
+
+# name -> PromptTemplate
+_THEMES = {}
+
+
+def register_theme(name, css, template=CODEGEN_TEMPLATE):
+    """
+    Registers a theme and prebuilds its prompt.
+
+    Args:
+        name (str): Theme name as stored on WireframeUpload.theme
+        css (str): The palette given to Gemini as a starting point
+        template (Template): The prompt template, codegen.txt by default
+    """
+    _THEMES[name] = PromptTemplate(
+        template, theme_name=name, theme_css=css.strip()
+    )
+
+
+def get_prompt_template(theme):
+    """
+    Returns the prebuilt prompt for a theme.
+
+    Raises:
+        UnknownThemeError: If the theme isn't registered
+    """
+    try:
+        return _THEMES[theme]
+    except KeyError:
+        raise UnknownThemeError(
+            f"Unknown theme '{theme}', "
+            f"expected one of: {', '.join(theme_names())}"
+        ) from None
+
+
+def theme_names():
+    return sorted(_THEMES)
+
+
+for _path in sorted(THEMES_DIR.glob('*.css')):
+    register_theme(_path.stem, _path.read_text(encoding='utf-8'))
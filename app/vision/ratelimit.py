@@ -0,0 +1,565 @@
+"""
+Outbound rate limiting and circuit breaking for the Gemini and Vision APIs.
+
+Every call to Google goes through the OutboundLimiter of its service,
+which combines:
+
+- a circuit breaker, shared between processes like the buckets below: once
+  CIRCUIT_BREAKER['FAILURE_THRESHOLD'] calls in a row fail (5xx or
+  timeouts, after their retries; 429s don't count), calls fail fast with
+  CircuitOpenError until a trial call succeeds;
+- a token bucket per minute of requests (and, for Gemini, prompt/response
+  tokens), kept in a small state file under OUTBOUND_RATE_LIMIT_DIR and
+  updated under an exclusive flock, so every uWSGI worker and Celery child
+  on the host draws from the same budget;
+- an AIMD concurrency limit per process: it grows by one slot per window
+  of successful calls and halves on a 429 or a latency spike;
+- retries with exponential backoff and full jitter, or the delay the API
+  asked for when the error carries one. That delay is also written to the
+  shared state so the other processes hold off too.
+
+Callers wait for capacity (up to OUTBOUND_MAX_WAIT seconds) instead of
+failing.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+try:
+    import fcntl
+except ImportError:  # Windows: the buckets are only shared between threads
+    fcntl = None
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    'REQUESTS_PER_MINUTE': 60,
+    # 0 = no token limit
+    'TOKENS_PER_MINUTE': 0,
+    'MAX_CONCURRENCY': 8,
+}
+
+DEFAULT_CIRCUIT_BREAKER = {
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+}
+
+# Errors worth retrying; the first two mean we're being throttled
+THROTTLED_ERRORS = (
+    google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+)
+RETRYABLE_ERRORS = THROTTLED_ERRORS + (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+)
+
+# "Please retry in 41.36s." in Gemini quota errors
+RETRY_IN_PATTERN = re.compile(r'retry in (\d+(?:\.\d+)?)\s*s', re.IGNORECASE)
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+class RateLimitTimeout(Exception):
+    """Raised when no capacity frees up within OUTBOUND_MAX_WAIT seconds"""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit breaker is open"""
+
+
+def retry_hint(exc):
+    """
+    Returns the delay in seconds the API asked for in an error, if any.
+
+    Looks at google.rpc.RetryInfo details, a Retry-After header and the
+    "retry in Ns" wording of Gemini quota errors.
+    """
+    for detail in getattr(exc, 'details', None) or ():
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        pass
+    match = RETRY_IN_PATTERN.search(str(exc))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def backoff_delay(exc, attempt):
+    """
+    Seconds to wait before retry number attempt (0-based).
+
+    The API's own hint wins, with a little jitter so that waiting workers
+    don't all retry at the same instant; otherwise exponential backoff with
+    full jitter.
+    """
+    hint = retry_hint(exc)
+    if hint is not None:
+        return hint + random.uniform(0, min(BACKOFF_BASE, hint / 2))
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class SharedState:
+    """
+    A small JSON document shared by every process on the host.
+
+    Each update opens the file and holds an exclusive flock while the
+    document is read and written back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Only used when flock isn't available
+        self._lock = threading.Lock()
+        self._memory_state = {}
+
+    @contextmanager
+    def locked(self):
+        """Yields the document as a dict; changes are saved on exit"""
+        if fcntl is None:
+            with self._lock:
+                yield self._memory_state
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(fd), 'r+') as f:
+                try:
+                    state = json.load(f)
+                except ValueError:
+                    # New (empty) or damaged file: start over
+                    state = {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+        finally:
+            # Closing the last descriptor also releases the lock
+            os.close(fd)
+
+    def read(self):
+        """Returns a copy of the document"""
+        with self.locked() as state:
+            return dict(state)
+
+
+class SharedTokenBucket:
+    """
+    Request and token buckets of one service, shared between processes
+    through a SharedState file.
+
+    Buckets start full, refill continuously at their per-minute rate and
+    hold at most one minute's worth.
+    """
+
+    def __init__(self, path, requests_per_minute, tokens_per_minute=0):
+        self.state = SharedState(path)
+        self.rates = {
+            'requests': requests_per_minute,
+            'tokens': tokens_per_minute,
+        }
+
+    def _refill(self, state, now):
+        for name, per_minute in self.rates.items():
+            if not per_minute:
+                continue
+            level, updated = state.get(name, (per_minute, now))
+            level = min(per_minute, level + (now - updated) * per_minute / 60)
+            state[name] = (level, now)
+
+    def take(self, requests=1, tokens=0):
+        """
+        Takes capacity from both buckets if there is enough for the call.
+
+        Returns:
+            float: 0 if the capacity was taken, otherwise the number of
+            seconds until it should be available
+        """
+        now = time.time()
+        amounts = {'requests': requests, 'tokens': tokens}
+        with self.state.locked() as state:
+            blocked_until = state.get('blocked_until', 0)
+            if blocked_until > now:
+                return blocked_until - now
+            self._refill(state, now)
+            wait = 0.0
+            for name, per_minute in self.rates.items():
+                if not per_minute:
+                    continue
+                # A call bigger than a whole minute's worth runs once the
+                # bucket is full rather than never
+                needed = min(amounts[name], per_minute)
+                level = state[name][0]
+                if level < needed:
+                    wait = max(wait, (needed - level) * 60 / per_minute)
+            if wait:
+                return wait
+            for name, per_minute in self.rates.items():
+                if per_minute:
+                    state[name] = (state[name][0] - amounts[name], now)
+            return 0.0
+
+    def charge(self, tokens):
+        """
+        Takes tokens only known after the call (e.g. the response's),
+        possibly going into debt
+        """
+        if not self.rates['tokens'] or not tokens:
+            return
+        now = time.time()
+        with self.state.locked() as state:
+            self._refill(state, now)
+            state['tokens'] = (state['tokens'][0] - tokens, now)
+
+    def block(self, seconds):
+        """Makes every process wait seconds before the next call"""
+        until = time.time() + seconds
+        with self.state.locked() as state:
+            state['blocked_until'] = max(state.get('blocked_until', 0), until)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a service that keeps failing, for every process at once.
+
+    After failure_threshold consecutive failures the circuit opens and
+    calls fail fast with CircuitOpenError. After reset_timeout seconds one
+    trial call is let through (half-open): its success closes the circuit,
+    its failure opens it again. A trial that never reports back is
+    replaced after another reset_timeout.
+    """
+
+    def __init__(self, name, path, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.state = SharedState(path)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def check(self):
+        """
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with a
+                trial call already in progress
+        """
+        now = time.time()
+        with self.state.locked() as state:
+            circuit = state.get('state', 'closed')
+            if circuit == 'closed':
+                return
+            if circuit == 'half_open':
+                since = state['trial_started_at']
+            else:
+                since = state['opened_at']
+            retry_in = since + self.reset_timeout - now
+            if retry_in > 0:
+                raise CircuitOpenError(
+                    f"{self.name} circuit open after {state['failures']} "
+                    f"failures, next attempt in {retry_in:.0f}s "
+                    f"(last error: {state.get('last_error')})"
+                )
+            # This call is the trial
+            state['state'] = 'half_open'
+            state['trial_started_at'] = now
+
+    def record_success(self):
+        with self.state.locked() as state:
+            if state.get('state', 'closed') != 'closed':
+                logger.info(f"{self.name} circuit closed")
+            state.update(state='closed', failures=0,
+                         last_success_at=time.time())
+
+    def record_failure(self, exc):
+        now = time.time()
+        with self.state.locked() as state:
+            failures = state.get('failures', 0) + 1
+            state.update(failures=failures, last_failure_at=now,
+                         last_error=str(exc)[:200])
+            if (state.get('state') == 'half_open'
+                    or failures >= self.failure_threshold):
+                if state.get('state') != 'open':
+                    logger.warning(
+                        f"{self.name} circuit opened after {failures} "
+                        f"failures: {exc}"
+                    )
+                state.update(state='open', opened_at=now)
+
+    def snapshot(self):
+        """Breaker state for the health endpoint"""
+        state = self.state.read()
+        return {
+            'state': state.get('state', 'closed'),
+            'failures': state.get('failures', 0),
+            'last_error': state.get('last_error'),
+            'last_success_at': state.get('last_success_at'),
+            'last_failure_at': state.get('last_failure_at'),
+        }
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    AIMD limit on the calls in flight in this process.
+
+    Each successful call raises the limit by 1/limit (about one slot per
+    limit calls); a throttled call, or one slower than spike_factor times
+    the running average latency, halves it.
+    """
+
+    def __init__(self, max_limit, min_limit=1, backoff=0.5, spike_factor=2.0):
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+        self.backoff = backoff
+        self.spike_factor = spike_factor
+        self.limit = float(max(min_limit, self.max_limit // 2))
+        self.in_flight = 0
+        self._latency = None
+        self._samples = 0
+        self._condition = threading.Condition()
+
+    def try_enter(self):
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def enter(self, timeout):
+        """Waits up to timeout seconds for a slot; returns False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(self.try_enter,
+                                            timeout=max(timeout, 0))
+
+    def leave(self, latency, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            spike = (
+                self._samples >= 5
+                and latency > self.spike_factor * self._latency
+            )
+            if throttled or spike:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if not throttled:
+                # Exponentially weighted average of successful calls
+                if self._latency is None:
+                    self._latency = latency
+                else:
+                    self._latency = 0.8 * self._latency + 0.2 * latency
+                self._samples += 1
+            self._condition.notify_all()
+
+
+class OutboundLimiter:
+    """Rate, concurrency and retry policy for the calls to one service"""
+
+    def __init__(self, name, bucket, concurrency, breaker=None, max_wait=120,
+                 max_retries=4):
+        self.name = name
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.breaker = breaker
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+
+    def _timeout(self):
+        return RateLimitTimeout(
+            f"No {self.name} capacity within {self.max_wait}s, try again later"
+        )
+
+    def call(self, func, units=1, tokens=0):
+        """
+        Calls func() once capacity is available, retrying retryable errors.
+
+        Args:
+            func (callable): Makes the API call, takes no arguments
+            units (int): Request quota units used (e.g. images for Vision)
+            tokens (int): Tokens charged up front
+
+        Raises:
+            RateLimitTimeout: If no capacity frees up in max_wait seconds
+            CircuitOpenError: If the service's circuit breaker is open
+        """
+        # Once per call: retries belong to it (and may be its trial call)
+        if self.breaker is not None:
+            self.breaker.check()
+        deadline = time.monotonic() + self.max_wait
+        attempt = 0
+        while True:
+            if not self.concurrency.enter(deadline - time.monotonic()):
+                raise self._timeout()
+            try:
+                while True:
+                    wait = self.bucket.take(units, tokens)
+                    if not wait:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        raise self._timeout()
+                    time.sleep(wait)
+            except BaseException:
+                self.concurrency.leave(0)
+                raise
+
+            started = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._failed(e, attempt, time.monotonic() - started,
+                                     deadline)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.concurrency.leave(time.monotonic() - started)
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+    async def call_async(self, func, units=1, tokens=0):
+        """
+        Async variant of call: func() returns an awaitable. The shared state
+        files are locked and updated in worker threads, off the event loop.
+        """
+        if self.breaker is not None:
+            await sync_to_async(self.breaker.check, thread_sensitive=False)()
+        deadline = time.monotonic() + self.max_wait
+        attempt = 0
+        while True:
+            while not self.concurrency.try_enter():
+                if time.monotonic() > deadline:
+                    raise self._timeout()
+                await asyncio.sleep(0.05)
+            try:
+                while True:
+                    wait = await sync_to_async(
+                        self.bucket.take, thread_sensitive=False
+                    )(units, tokens)
+                    if not wait:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        raise self._timeout()
+                    await asyncio.sleep(wait)
+            except BaseException:
+                self.concurrency.leave(0)
+                raise
+
+            started = time.monotonic()
+            try:
+                result = await func()
+            except Exception as e:
+                delay = await sync_to_async(
+                    self._failed, thread_sensitive=False
+                )(e, attempt, time.monotonic() - started, deadline)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.concurrency.leave(time.monotonic() - started)
+            if self.breaker is not None:
+                await sync_to_async(
+                    self.breaker.record_success, thread_sensitive=False
+                )()
+            return result
+
+    def _failed(self, exc, attempt, latency, deadline):
+        """
+        Handles a failed attempt; returns the delay before retrying or
+        re-raises exc once the call has failed for good.
+        """
+        throttled = isinstance(exc, THROTTLED_ERRORS)
+        self.concurrency.leave(latency, throttled=throttled)
+        retryable = isinstance(exc, RETRYABLE_ERRORS)
+        if retryable and attempt < self.max_retries:
+            delay = backoff_delay(exc, attempt)
+            if time.monotonic() + delay <= deadline:
+                if throttled:
+                    self.bucket.block(delay)
+                logger.warning(
+                    f"{self.name} call failed ({exc}), "
+                    f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+                )
+                return delay
+        # One failure per call, once its retries are spent. Throttling is
+        # left to the buckets: the service is up, just busy
+        if retryable and not throttled and self.breaker is not None:
+            self.breaker.record_failure(exc)
+        raise exc
+
+    def charge(self, tokens):
+        """Charges tokens that were only known after the call"""
+        self.bucket.charge(tokens)
+
+    async def charge_async(self, tokens):
+        """Async variant of charge"""
+        await sync_to_async(self.bucket.charge, thread_sensitive=False)(tokens)
+
+
+def state_dir():
+    """Directory of the files shared between processes"""
+    return getattr(settings, 'OUTBOUND_RATE_LIMIT_DIR', None) or os.path.join(
+        settings.BASE_DIR, 'cache', 'ratelimit'
+    )
+
+
+_limiters = {}
+_limiters_pid = None
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """
+    Returns the process-wide OutboundLimiter for 'gemini' or 'vision',
+    configured by OUTBOUND_RATE_LIMITS and CIRCUIT_BREAKER.
+    """
+    global _limiters, _limiters_pid
+    limiter = _limiters.get(name)
+    if limiter is None or _limiters_pid != os.getpid():
+        with _limiters_lock:
+            if _limiters_pid != os.getpid():
+                # Forked: the in-flight counts belong to the parent
+                _limiters = {}
+                _limiters_pid = os.getpid()
+            limiter = _limiters.get(name)
+            if limiter is None:
+                config = dict(DEFAULT_LIMITS)
+                limits = getattr(settings, 'OUTBOUND_RATE_LIMITS', {})
+                config.update(limits.get(name, {}))
+                breaker_config = dict(DEFAULT_CIRCUIT_BREAKER)
+                breaker_config.update(getattr(settings, 'CIRCUIT_BREAKER', {}))
+                location = state_dir()
+                limiter = _limiters[name] = OutboundLimiter(
+                    name,
+                    SharedTokenBucket(
+                        os.path.join(location, f'{name}.json'),
+                        requests_per_minute=config['REQUESTS_PER_MINUTE'],
+                        tokens_per_minute=config['TOKENS_PER_MINUTE'],
+                    ),
+                    AdaptiveConcurrencyLimit(config['MAX_CONCURRENCY']),
+                    CircuitBreaker(
+                        name,
+                        os.path.join(location, f'{name}-breaker.json'),
+                        failure_threshold=breaker_config['FAILURE_THRESHOLD'],
+                        reset_timeout=breaker_config['RESET_TIMEOUT'],
+                    ),
+                    max_wait=getattr(settings, 'OUTBOUND_MAX_WAIT', 120),
+                    max_retries=getattr(settings, 'OUTBOUND_MAX_RETRIES', 4),
+                )
+    return limiter
@@ -0,0 +1,192 @@
+"""
+Single-pass parser for the fenced code blocks in a Gemini response.
+
+The response is processed line by line, so it can be fed in chunks as they
+stream in and only the current incomplete line is ever buffered.
+"""
+
+# Fence info strings (lower-cased) mapped to the section they fill
+LANGUAGE_ALIASES = {
+    'html': 'html',
+    'htm': 'html',
+    'html5': 'html',
+    'xhtml': 'html',
+    'css': 'css',
+    'css3': 'css',
+    'javascript': 'javascript',
+    'js': 'javascript',
+    'es6': 'javascript',
+    'ecmascript': 'javascript',
+    'mjs': 'javascript',
+}
+
+SECTIONS = ('html', 'css', 'javascript')
+
+# Shortest runs that open a fence
+FENCE_MARKERS = ('```', '~~~')
+
+
+class FenceParser:
+    """
+    Incremental tokenizer for ```html / ```css / ```javascript blocks.
+
+    Follows the CommonMark fence rules that matter for model output: the
+    language is matched case-insensitively through LANGUAGE_ALIASES, a fence
+    is only closed by a line of at least as many of the same fence characters
+    (so a ```` block can contain ``` lines), and blocks in other languages
+    are skipped whole. A block left open when the response ends (truncated
+    output) is still returned.
+
+    Two departures from CommonMark match what models write: a fence may
+    open after prose on the same line ("Here you go: ```html"), and a
+    whole block may sit on one line ("```html <p>x</p>```"). A run of
+    backticks closed on its own line without a known language, such as
+    ```x```, is an inline code span and is ignored, as is a bare fence
+    after prose.
+
+    Usage:
+        parser = FenceParser()
+        for chunk in chunks:
+            for section, code in parser.feed(chunk):
+                ...  # section is complete
+        result = parser.close()  # {'html': ..., 'css': ..., 'javascript': ...}
+    """
+
+    def __init__(self):
+        self.sections = {}
+        self._partial = []
+        self._fence = None      # marker that closes the open fence, e.g. '```'
+        self._section = None    # section the open fence fills, None to skip it
+        self._lines = []
+        self._closed = False
+
+    def feed(self, chunk):
+        """
+        Args:
+            chunk (str): The next piece of the response text
+
+        Returns:
+            list: (section, code) tuples for sections closed by this chunk
+        """
+        completed = []
+        start = 0
+        while True:
+            newline = chunk.find('\n', start)
+            if newline == -1:
+                if start < len(chunk):
+                    self._partial.append(chunk[start:])
+                return completed
+            line = chunk[start:newline]
+            if self._partial:
+                self._partial.append(line)
+                line = ''.join(self._partial)
+                self._partial = []
+            section = self._process_line(line)
+            if section is not None:
+                completed.append(section)
+            start = newline + 1
+
+    def close(self):
+        """
+        Flushes the last line and any unclosed block.
+
+        Returns:
+            dict: Contains separated HTML, CSS, and JavaScript code
+        """
+        if not self._closed:
+            self._closed = True
+            if self._partial:
+                self._process_line(''.join(self._partial))
+                self._partial = []
+            if self._fence is not None:
+                # Truncated response: keep what we got of the open block
+                self._finish_block()
+        return self.result()
+
+    def result(self):
+        """Returns the sections found so far, with '' for missing ones"""
+        return {
+            section: self.sections.get(section, '') for section in SECTIONS
+        }
+
+    def _process_line(self, line):
+        if line.endswith('\r'):
+            line = line[:-1]
+        stripped = line.strip()
+
+        if self._fence is None:
+            starts = [
+                stripped.find(marker) for marker in FENCE_MARKERS
+                if marker in stripped
+            ]
+            if starts:
+                start = min(starts)
+                return self._open_block(
+                    stripped[start:], after_prose=start > 0
+                )
+            return None
+
+        fence = self._fence
+        if stripped.startswith(fence) and not stripped.strip(fence[0]):
+            return self._finish_block()
+
+        if self._section is not None:
+            self._lines.append(line)
+        return None
+
+    def _open_block(self, text, after_prose=False):
+        char = text[0]
+        info = text.lstrip(char)
+        length = len(text) - len(info)
+        fence = char * length
+        words = info.strip().split(None, 1)
+        language = words[0].lower() if words else ''
+        section = LANGUAGE_ALIASES.get(language)
+        # The first block of each language wins
+        if section in self.sections:
+            section = None
+
+        if after_prose and not words:
+            # A bare ``` in a sentence, rather than a fence
+            return None
+
+        if char == '`' and '`' in info:
+            code = words[1] if len(words) == 2 else ''
+            if language not in LANGUAGE_ALIASES or not code.endswith(fence):
+                # Inline code span such as ```x```, not a fence
+                return None
+            # The whole block on one line
+            self._section = section
+            self._lines = [code[:-length]]
+            return self._finish_block()
+
+        self._fence = fence
+        self._section = section
+        self._lines = []
+        return None
+
+    def _finish_block(self):
+        section = self._section
+        code = '\n'.join(self._lines).strip()
+        self._fence = None
+        self._section = None
+        self._lines = []
+        if section is None:
+            return None
+        self.sections[section] = code
+        return section, code
+
+
+def parse_response_text(response_text):
+    """
+    Parses a complete Gemini response in one pass.
+
+    Args:
+        response_text (str): The text response from Gemini
+
+    Returns:
+        dict: Contains separated HTML, CSS, and JavaScript code
+    """
+    parser = FenceParser()
+    parser.feed(response_text)
+    return parser.close()
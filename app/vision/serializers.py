@@ -1,23 +1,65 @@
 # app/app/serializers.py
 # (Update this path if your serializers are in a different location)
 
+from django.conf import settings
 from rest_framework import serializers
 from .models import WireframeUpload
+from .dedupe import hash_image_file
+from .prompt_templates import theme_names
+from .uploads import VISION_IMAGE_FORMATS
+from .vision_api import DETECTION_ENGINES
+
+
+def validate_theme_name(value):
+    """Accept only themes registered in prompt_templates"""
+    if value not in theme_names():
+        raise serializers.ValidationError(
+            f"Unknown theme '{value}'. "
+            f"Available themes: {', '.join(theme_names())}"
+        )
+    return value
 
 class WireframeUploadSerializer(serializers.ModelSerializer):
     """Serializer for wireframe uploads"""
     
     username = serializers.ReadOnlyField(source='user.username')
     image_url = serializers.SerializerMethodField()
+    theme = serializers.CharField(
+        max_length=20, default='dark', validators=[validate_theme_name]
+    )
+    # Detection engine for this upload only, not stored on the model
+    engine = serializers.ChoiceField(
+        choices=DETECTION_ENGINES, required=False, write_only=True
+    )
     
     class Meta:
         model = WireframeUpload
         fields = [
             'id', 'title', 'description', 'image', 'image_url',
-            'upload_date', 'status', 'username', 'detected_elements',
-            'generated_code'
+            'upload_date', 'status', 'theme', 'username', 'detected_elements',
+            'generated_code', 'engine'
         ]
         read_only_fields = ['user', 'upload_date', 'status', 'detected_elements', 'generated_code']
+
+    def validate_image(self, value):
+        """Reject images HashingUploadHandler found Vision can't read"""
+        if getattr(value, 'supported_format', True) is False:
+            raise serializers.ValidationError(
+                "Unsupported image format. Supported formats: "
+                f"{', '.join(VISION_IMAGE_FORMATS)}"
+            )
+        return value
+
+    def validate(self, attrs):
+        """Hash the uploaded image so repeated uploads can reuse results"""
+        image = attrs.get('image')
+        if image is not None:
+            # Hashed while it was received when it went through
+            # HashingUploadHandler
+            attrs['image_sha256'] = (
+                getattr(image, 'sha256', None) or hash_image_file(image)
+            )
+        return attrs
     
     def get_image_url(self, obj):
         """Get the URL for the image"""
@@ -26,4 +68,66 @@ class WireframeUploadSerializer(serializers.ModelSerializer):
             if request:
                 return request.build_absolute_uri(obj.image.url)
             return obj.image.url
-        return None
\ No newline at end of file
+        return None
+
+
+class WireframeListSerializer(serializers.ModelSerializer):
+    """
+    Slim serializer for listing wireframes, without the detection and
+    generated code JSON (use the detail endpoint for those).
+
+    Accepts a `fields` argument (an iterable of field names) to return only
+    those fields.
+    """
+
+    username = serializers.ReadOnlyField(source='user.username')
+    image_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = WireframeUpload
+        fields = [
+            'id', 'title', 'description', 'image', 'image_url',
+            'upload_date', 'status', 'theme', 'username'
+        ]
+        read_only_fields = fields
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError({
+                    'fields': (
+                        f"Unknown field(s): {', '.join(sorted(unknown))}. "
+                        f"Available: {', '.join(self.fields)}"
+                    )
+                })
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def get_queryset(cls, queryset, fields=None):
+        """
+        Restricts a queryset to what the serializer will read: the user is
+        joined in only when username is requested. The JSON results are
+        artifacts and never loaded for lists.
+        """
+        if not fields or 'username' in fields:
+            queryset = queryset.select_related('user')
+        return queryset
+
+    get_image_url = WireframeUploadSerializer.get_image_url
+
+
+class WireframeBatchUploadSerializer(serializers.Serializer):
+    """Serializer for uploading many wireframes in one request"""
+
+    images = serializers.ListField(
+        child=serializers.FileField(),
+        allow_empty=False,
+        max_length=settings.WIREFRAME_BATCH_MAX_IMAGES,
+    )
+    theme = serializers.CharField(
+        max_length=20, default='dark', validators=[validate_theme_name]
+    )
+    engine = serializers.ChoiceField(choices=DETECTION_ENGINES, required=False)
@@ -0,0 +1,34 @@
+import logging
+
+from celery import shared_task
+
+from .models import WireframeUpload
+from .pipeline import process_wireframe, process_wireframe_batch
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+@shared_task(acks_late=True, ignore_result=True)
+def process_wireframe_task(wireframe_id, engine=None):
+    """Background job that runs the wireframe pipeline for one upload"""
+    try:
+        wireframe = WireframeUpload.objects.get(pk=wireframe_id)
+    except WireframeUpload.DoesNotExist:
+        logger.warning(f"Wireframe {wireframe_id} no longer exists, skipping")
+        return
+
+    if wireframe.status == 'completed':
+        # Redelivered message for work that already finished
+        return
+
+    process_wireframe(wireframe, engine=engine)
+
+
+@shared_task(acks_late=True, ignore_result=True)
+def process_wireframe_batch_task(wireframe_ids, engine=None):
+    """Background job that runs the batched wireframe pipeline"""
+    wireframes = WireframeUpload.objects.filter(
+        pk__in=wireframe_ids
+    ).exclude(status='completed')
+    process_wireframe_batch(wireframes, engine=engine)
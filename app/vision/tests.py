@@ -1,3 +1,1657 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+from google.api_core import exceptions as google_exceptions
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .artifacts import decode_artifact, encode_artifact
+from .asgi import AsyncStreamingHttpResponse, StreamingASGIHandler
+from .cache import (
+    DjangoResponseCache, FileResponseCache, LRUResponseCache, make_cache_key,
+)
+from .classification import (
+    DEFAULT_CLASSIFICATION_RULES, ElementClassifier, classify_ui_elements,
+)
+from .dedupe import find_reusable_upload, hash_image_file
+from .formatter import format_code, format_generated_code
+from .gemini_api import (
+    build_gemini_prompt, generate_code_from_wireframe, prepare_prompt,
+)
+from .health import _health_state
+from .layout import group_words
+from .models import WireframeUpload
+from .pagination import WireframeCursorPagination
+from .pipeline import (
+    claim_generation, claim_missing_code, generate_missing_code,
+    release_generation,
+)
+from .ratelimit import (
+    AdaptiveConcurrencyLimit, CircuitBreaker, CircuitOpenError,
+    OutboundLimiter, RateLimitTimeout, SharedTokenBucket, backoff_delay,
+    retry_hint,
+)
+from .response_parser import FenceParser, parse_response_text
+from .vision_api import (
+    classify_ui_element, detect_wireframe_elements_batch,
+)
+
+backfill_migration = import_module(
+    'vision.migrations.0010_backfill_wireframe_artifacts'
+)
+
+
+class StateDirMixin:
+    """Gives each test its own directory for the shared state files"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_dir = directory.name
+
+    def state_path(self, name):
+        return os.path.join(self.state_dir, name)
+
+
+class SharedTokenBucketTests(StateDirMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        patcher = mock.patch('vision.ratelimit.time.time',
+                             side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bucket(self, **rates):
+        return SharedTokenBucket(self.state_path('b.json'), **rates)
+
+    def test_starts_full_then_waits_for_refill(self):
+        bucket = self.bucket(requests_per_minute=60)
+        for _ in range(60):
+            self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.take(), 1.0)
+
+        self.now += 30
+        for _ in range(30):
+            self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+
+    def test_never_holds_more_than_a_minute(self):
+        bucket = self.bucket(requests_per_minute=60)
+        bucket.take()
+        self.now += 3600
+        for _ in range(60):
+            self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+
+    def test_waits_for_the_scarcer_bucket(self):
+        bucket = self.bucket(requests_per_minute=60, tokens_per_minute=600)
+        self.assertEqual(bucket.take(tokens=600), 0)
+        # 300 tokens refill in 30s, while a request is available now
+        self.assertAlmostEqual(bucket.take(tokens=300), 30.0)
+
+    def test_oversized_call_runs_once_the_bucket_is_full(self):
+        bucket = self.bucket(requests_per_minute=60, tokens_per_minute=600)
+        self.assertEqual(bucket.take(tokens=5000), 0)
+        # The next call waits for the 4400 tokens of debt, then a full bucket
+        self.assertAlmostEqual(bucket.take(tokens=5000), 500.0)
+
+    def test_charge_goes_into_debt(self):
+        bucket = self.bucket(requests_per_minute=60, tokens_per_minute=600)
+        bucket.charge(900)
+        # 300 tokens in debt, 10 needed: 310 tokens to refill
+        self.assertAlmostEqual(bucket.take(tokens=10), 31.0)
+
+    def test_block_holds_off_every_call(self):
+        bucket = self.bucket(requests_per_minute=60)
+        bucket.block(5)
+        self.assertAlmostEqual(bucket.take(), 5.0)
+        self.now += 5
+        self.assertEqual(bucket.take(), 0)
+
+    def test_state_is_shared_through_the_file(self):
+        first = self.bucket(requests_per_minute=2)
+        second = self.bucket(requests_per_minute=2)
+        self.assertEqual(first.take(), 0)
+        self.assertEqual(second.take(), 0)
+        self.assertGreater(first.take(), 0)
+
+
+class AdaptiveConcurrencyLimitTests(SimpleTestCase):
+
+    def test_starts_at_half_the_maximum(self):
+        limit = AdaptiveConcurrencyLimit(8)
+        self.assertEqual([limit.try_enter() for _ in range(5)],
+                         [True] * 4 + [False])
+
+    def test_grows_additively_and_halves_on_throttling(self):
+        limit = AdaptiveConcurrencyLimit(8)
+        for _ in range(4):
+            limit.try_enter()
+            limit.leave(0.1)
+        self.assertAlmostEqual(limit.limit, 5.0, places=0)
+
+        limit.try_enter()
+        limit.leave(0.1, throttled=True)
+        self.assertAlmostEqual(limit.limit, 2.5, places=0)
+
+    def test_stays_within_bounds(self):
+        limit = AdaptiveConcurrencyLimit(4, min_limit=1)
+        for _ in range(10):
+            limit.try_enter()
+            limit.leave(0.1, throttled=True)
+        self.assertEqual(limit.limit, 1)
+        for _ in range(100):
+            limit.try_enter()
+            limit.leave(0.1)
+        self.assertEqual(limit.limit, 4)
+
+    def test_latency_spike_halves_the_limit(self):
+        limit = AdaptiveConcurrencyLimit(8)
+        for _ in range(5):
+            limit.try_enter()
+            limit.leave(0.1)
+        before = limit.limit
+        limit.try_enter()
+        limit.leave(1.0)
+        self.assertAlmostEqual(limit.limit, before / 2)
+
+    def test_enter_times_out_when_full(self):
+        limit = AdaptiveConcurrencyLimit(2)
+        self.assertTrue(limit.enter(0.1))
+        self.assertFalse(limit.enter(0.05))
+
+
+class RetryHintTests(SimpleTestCase):
+
+    def test_retry_info_detail(self):
+        delay = SimpleNamespace(seconds=3, nanos=500000000)
+        exc = google_exceptions.TooManyRequests(
+            'slow down', details=[SimpleNamespace(retry_delay=delay)]
+        )
+        self.assertEqual(retry_hint(exc), 3.5)
+
+    def test_retry_after_header(self):
+        response = SimpleNamespace(headers={'Retry-After': '7'})
+        exc = google_exceptions.ServiceUnavailable('down', response=response)
+        self.assertEqual(retry_hint(exc), 7.0)
+
+    def test_gemini_quota_message(self):
+        exc = google_exceptions.ResourceExhausted(
+            'Quota exceeded. Please retry in 41.36s.'
+        )
+        self.assertEqual(retry_hint(exc), 41.36)
+
+    def test_no_hint(self):
+        exc = google_exceptions.ServiceUnavailable('down')
+        self.assertIsNone(retry_hint(exc))
+
+    def test_backoff_uses_the_hint_with_some_jitter(self):
+        exc = google_exceptions.ResourceExhausted('Please retry in 4s.')
+        for _ in range(20):
+            self.assertTrue(4 <= backoff_delay(exc, attempt=0) <= 5)
+
+    def test_backoff_grows_exponentially_without_hint(self):
+        exc = google_exceptions.ServiceUnavailable('down')
+        for _ in range(20):
+            self.assertLessEqual(backoff_delay(exc, attempt=0), 1)
+            self.assertLessEqual(backoff_delay(exc, attempt=3), 8)
+            self.assertLessEqual(backoff_delay(exc, attempt=20), 60)
+
+
+class OutboundLimiterTests(StateDirMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch('vision.ratelimit.backoff_delay', return_value=0),
+            mock.patch('vision.ratelimit.logger'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.limiter = OutboundLimiter(
+            'test',
+            SharedTokenBucket(self.state_path('bucket.json'),
+                              requests_per_minute=6000),
+            AdaptiveConcurrencyLimit(4),
+            CircuitBreaker('test', self.state_path('breaker.json'),
+                           failure_threshold=2),
+            max_wait=5,
+            max_retries=3,
+        )
+
+    def failing(self, *errors, result='ok'):
+        """A call raising errors in turn, then returning result"""
+        errors = list(errors)
+        calls = []
+
+        def call():
+            calls.append(1)
+            if errors:
+                raise errors.pop(0)
+            return result
+        call.calls = calls
+        return call
+
+    def always(self, error):
+        """A call raising error more times than the limiter retries"""
+        return self.failing(*[error] * 10)
+
+    def test_retries_retryable_errors(self):
+        call = self.failing(google_exceptions.ServiceUnavailable('down'),
+                            google_exceptions.TooManyRequests('busy'))
+        self.assertEqual(self.limiter.call(call), 'ok')
+        self.assertEqual(len(call.calls), 3)
+        self.assertEqual(self.limiter.concurrency.in_flight, 0)
+
+    def test_does_not_retry_other_errors(self):
+        call = self.failing(google_exceptions.InvalidArgument('bad'))
+        with self.assertRaises(google_exceptions.InvalidArgument):
+            self.limiter.call(call)
+        self.assertEqual(len(call.calls), 1)
+        self.assertEqual(self.limiter.breaker.snapshot()['failures'], 0)
+
+    def test_gives_up_after_max_retries(self):
+        call = self.always(google_exceptions.ServiceUnavailable('down'))
+        with self.assertRaises(google_exceptions.ServiceUnavailable):
+            self.limiter.call(call)
+        self.assertEqual(len(call.calls), 4)
+
+    def test_breaker_counts_one_failure_per_call(self):
+        down = google_exceptions.ServiceUnavailable('down')
+        call = self.always(down)
+        with self.assertRaises(google_exceptions.ServiceUnavailable):
+            self.limiter.call(call)
+        self.assertEqual(self.limiter.breaker.snapshot()['failures'], 1)
+        self.assertEqual(self.limiter.breaker.snapshot()['state'], 'closed')
+
+        with self.assertRaises(google_exceptions.ServiceUnavailable):
+            self.limiter.call(self.always(down))
+        with self.assertRaises(CircuitOpenError):
+            self.limiter.call(self.failing())
+
+    def test_throttling_does_not_open_the_breaker(self):
+        busy = google_exceptions.TooManyRequests('busy')
+        for _ in range(3):
+            with self.assertRaises(google_exceptions.TooManyRequests):
+                self.limiter.call(self.always(busy))
+        self.assertEqual(self.limiter.breaker.snapshot()['state'], 'closed')
+        self.assertEqual(self.limiter.call(self.failing()), 'ok')
+
+    def test_success_resets_the_breaker(self):
+        down = google_exceptions.ServiceUnavailable('down')
+        with self.assertRaises(google_exceptions.ServiceUnavailable):
+            self.limiter.call(self.always(down))
+        self.limiter.call(self.failing())
+        self.assertEqual(self.limiter.breaker.snapshot()['failures'], 0)
+
+    def test_times_out_without_capacity(self):
+        self.limiter.bucket.block(60)
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.call(self.failing())
+        self.assertEqual(self.limiter.concurrency.in_flight, 0)
+
+    def test_call_async(self):
+        errors = [google_exceptions.ServiceUnavailable('down')]
+
+        async def call():
+            if errors:
+                raise errors.pop()
+            return 'ok'
+        self.assertEqual(asyncio.run(self.limiter.call_async(call)), 'ok')
+        self.assertEqual(self.limiter.concurrency.in_flight, 0)
+
+
+GENERATED_CODE = {
+    'status': 'success', 'html': '<p>hi</p>', 'css': '', 'javascript': '',
+}
+
+
+def create_wireframe(username='tester', **fields):
+    user, _ = get_user_model().objects.get_or_create(username=username)
+    fields.setdefault('detected_elements', {'elements': [], 'full_text': ''})
+    fields.setdefault('status', 'completed')
+    return WireframeUpload.objects.create(
+        user=user, image='wireframes/test.png', **fields
+    )
+
+
+class GenerationClaimTests(TestCase):
+
+    def setUp(self):
+        self.wireframe = create_wireframe()
+
+    def fresh(self):
+        return WireframeUpload.objects.get(pk=self.wireframe.pk)
+
+    def claim(self, wireframe):
+        claimed = claim_generation(wireframe)
+        if claimed:
+            self.addCleanup(release_generation, wireframe)
+        return claimed
+
+    def test_single_winner(self):
+        first, second = self.fresh(), self.fresh()
+        self.assertTrue(self.claim(first))
+        self.assertFalse(self.claim(second))
+
+    def test_release_lets_the_next_request_claim(self):
+        first = self.fresh()
+        self.assertTrue(claim_generation(first))
+        release_generation(first)
+        self.assertIsNone(self.fresh().generation_claimed_at)
+        self.assertTrue(self.claim(self.fresh()))
+
+    @override_settings(GEMINI_GENERATION_LEASE=60)
+    def test_expired_claim_is_taken_over(self):
+        stale = self.fresh()
+        self.assertTrue(self.claim(stale))
+        WireframeUpload.objects.filter(pk=stale.pk).update(
+            generation_claimed_at=timezone.now() - timedelta(seconds=61)
+        )
+        # The stale holder's claim now carries the old timestamp
+        stale.generation_claimed_at = self.fresh().generation_claimed_at
+        renewer = stale.__dict__['_claim_renewer']
+        renewer.claimed_at = stale.generation_claimed_at
+
+        taker = self.fresh()
+        self.assertTrue(self.claim(taker))
+        # Releasing the expired claim leaves the new holder's alone
+        release_generation(stale)
+        self.assertEqual(self.fresh().generation_claimed_at,
+                         taker.generation_claimed_at)
+
+    def test_claim_missing_code_when_code_arrived_meanwhile(self):
+        loaded = self.fresh()
+        stored = self.fresh()
+        stored.set_generated_code(GENERATED_CODE)
+        stored.save()
+
+        self.assertTrue(loaded.needs_code())
+        self.assertEqual(claim_missing_code(loaded), 'done')
+        self.assertEqual(loaded.generated_code['html'], '<p>hi</p>')
+        self.assertIsNone(self.fresh().generation_claimed_at)
+
+    def test_claim_missing_code_states(self):
+        holder = self.fresh()
+        self.assertEqual(claim_missing_code(holder), 'claimed')
+        self.addCleanup(release_generation, holder)
+        self.assertEqual(claim_missing_code(self.fresh()), 'pending')
+
+    @mock.patch('vision.pipeline.generate_code_from_wireframe',
+                return_value=GENERATED_CODE)
+    def test_generate_missing_code(self, generate):
+        self.assertTrue(generate_missing_code(self.fresh()))
+        self.assertTrue(generate_missing_code(self.fresh()))
+        generate.assert_called_once()
+
+        wireframe = self.fresh()
+        self.assertEqual(wireframe.code_status, 'success')
+        self.assertIsNone(wireframe.generation_claimed_at)
+
+    @mock.patch('vision.pipeline.generate_code_from_wireframe')
+    def test_generate_missing_code_while_claimed(self, generate):
+        self.assertTrue(self.claim(self.fresh()))
+        self.assertFalse(generate_missing_code(self.fresh()))
+        generate.assert_not_called()
+
+    @mock.patch('vision.pipeline.generate_code_from_wireframe',
+                side_effect=RuntimeError('boom'))
+    def test_claim_released_when_generation_fails(self, generate):
+        with self.assertRaises(RuntimeError):
+            generate_missing_code(self.fresh())
+        self.assertIsNone(self.fresh().generation_claimed_at)
+
+
+class ClaimRenewalTests(TransactionTestCase):
+    """The renewer updates the claim from its own thread and connection"""
+
+    @override_settings(GEMINI_GENERATION_LEASE=0.3)
+    def test_claim_outlives_the_lease_while_held(self):
+        wireframe = create_wireframe()
+
+        def fresh():
+            return WireframeUpload.objects.get(pk=wireframe.pk)
+
+        holder = fresh()
+        self.assertTrue(claim_generation(holder))
+        try:
+            time.sleep(0.7)
+            self.assertFalse(claim_generation(fresh()))
+        finally:
+            release_generation(holder)
+        self.assertIsNone(fresh().generation_claimed_at)
+
+
+class CodeStreamClaimTests(TestCase):
+
+    def setUp(self):
+        self.wireframe = create_wireframe()
+        self.api = APIClient()
+        self.api.force_authenticate(self.wireframe.user)
+        patcher = mock.patch(
+            'vision.views.stream_code_from_wireframe',
+            return_value=iter([('done', GENERATED_CODE)]),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self):
+        return self.api.get(
+            reverse('wireframe-code-stream', args=[self.wireframe.pk])
+        )
+
+    def claimed_at(self):
+        return WireframeUpload.objects.get(
+            pk=self.wireframe.pk
+        ).generation_claimed_at
+
+    def test_unconsumed_response_releases_the_claim(self):
+        response = self.stream()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(self.claimed_at())
+
+        response.close()
+        self.assertIsNone(self.claimed_at())
+
+    def test_consumed_response_saves_the_code(self):
+        response = self.stream()
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('event: done', body)
+        self.assertIsNone(self.claimed_at())
+
+        wireframe = WireframeUpload.objects.get(pk=self.wireframe.pk)
+        self.assertEqual(wireframe.generated_code, GENERATED_CODE)
+
+
+class AsyncStreamingTests(SimpleTestCase):
+
+    def test_parts_are_sent_as_they_are_produced(self):
+        log = []
+        closed = []
+
+        def produce():
+            for part in ('one', 'two'):
+                log.append(f'produced {part}')
+                yield part
+
+        class Events:
+            def __init__(self):
+                self.parts = produce()
+
+            def __iter__(self):
+                return self
+
+            def __next__(self):
+                return next(self.parts)
+
+            def close(self):
+                closed.append(True)
+
+        async def send(message):
+            log.append((message['type'], message.get('body')))
+
+        response = AsyncStreamingHttpResponse(
+            Events(), content_type='text/event-stream'
+        )
+        asyncio.run(StreamingASGIHandler().send_response(response, send))
+
+        self.assertEqual(log, [
+            ('http.response.start', None),
+            'produced one',
+            ('http.response.body', b'one'),
+            'produced two',
+            ('http.response.body', b'two'),
+            ('http.response.body', None),
+        ])
+        self.assertEqual(closed, [True])
+
+    def test_parts_are_produced_off_the_event_loop(self):
+        threads = []
+
+        def produce():
+            threads.append(threading.get_ident())
+            yield 'part'
+
+        async def read():
+            response = AsyncStreamingHttpResponse(produce())
+            return [part async for part in response.streaming_content]
+
+        self.assertEqual(asyncio.run(read()), [b'part'])
+        self.assertNotEqual(threads, [threading.get_ident()])
+
+
+class ArtifactStorageTests(TestCase):
+
+    def test_results_round_trip_through_artifacts(self):
+        wireframe = create_wireframe()
+        wireframe.set_generated_code(GENERATED_CODE)
+        wireframe.save()
+
+        reloaded = WireframeUpload.objects.get(pk=wireframe.pk)
+        self.assertEqual(reloaded.code_status, 'success')
+        self.assertEqual(reloaded.generated_code, GENERATED_CODE)
+        self.assertEqual(reloaded.detected_elements,
+                         {'elements': [], 'full_text': ''})
+        self.assertEqual(
+            set(reloaded.artifacts.values_list('kind', flat=True)),
+            {'detected_elements', 'generated_code', 'formatted_code'},
+        )
+
+    def test_clearing_a_result_deletes_its_artifact(self):
+        wireframe = create_wireframe(generated_code=GENERATED_CODE)
+        wireframe.generated_code = None
+        wireframe.save()
+        self.assertEqual(wireframe.code_status, '')
+        self.assertFalse(
+            wireframe.artifacts.filter(kind='generated_code').exists()
+        )
+
+    @override_settings(ARTIFACT_COMPRESSION='gzip')
+    def test_rows_keep_their_encoding(self):
+        value = {'elements': [{'text': 'x' * 1000}]}
+        encoding, data = encode_artifact(value)
+        self.assertEqual(encoding, 'gzip')
+        self.assertLess(len(data), 100)
+        self.assertEqual(decode_artifact(encoding, data), value)
+
+
+class BackfillArtifactsMigrationTests(TransactionTestCase):
+    """0010 moves the JSON columns into artifacts, and back when reversed"""
+
+    before = [('vision', '0009_wireframeartifact')]
+    after = [('vision', '0010_backfill_wireframe_artifacts')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_forward_and_backward(self):
+        apps = self.migrate(self.before)
+        User = apps.get_model('users', 'User')
+        Upload = apps.get_model('vision', 'WireframeUpload')
+        user = User.objects.create(username='migrator')
+        detected = {
+            'elements': [{'type': 'button', 'text': 'Go'}], 'full_text': 'Go',
+        }
+        formatted = {'html': '<p>hi</p>'}
+        rows = {
+            'done': Upload.objects.create(
+                user=user, image='wireframes/a.png',
+                detected_elements=detected, generated_code=GENERATED_CODE,
+                formatted_code=formatted,
+            ),
+            'failed': Upload.objects.create(
+                user=user, image='wireframes/b.png',
+                detected_elements=detected,
+                generated_code={'status': 'error', 'message': 'boom'},
+            ),
+            'empty': Upload.objects.create(
+                user=user, image='wireframes/c.png'
+            ),
+        }
+
+        # Several batches
+        with mock.patch.object(backfill_migration, 'BATCH_SIZE', 2):
+            apps = self.migrate(self.after)
+        Upload = apps.get_model('vision', 'WireframeUpload')
+        Artifact = apps.get_model('vision', 'WireframeArtifact')
+
+        statuses = dict(Upload.objects.values_list('pk', 'code_status'))
+        self.assertEqual(statuses[rows['done'].pk], 'success')
+        self.assertEqual(statuses[rows['failed'].pk], 'error')
+        self.assertEqual(statuses[rows['empty'].pk], '')
+
+        stored = Artifact.objects.values_list(
+            'wireframe_id', 'kind', 'encoding', 'data'
+        )
+        artifacts = {
+            (wireframe_id, kind): decode_artifact(encoding, data)
+            for wireframe_id, kind, encoding, data in stored
+        }
+        done = rows['done'].pk
+        self.assertEqual(artifacts[done, 'detected_elements'], detected)
+        self.assertEqual(artifacts[done, 'generated_code'], GENERATED_CODE)
+        self.assertEqual(artifacts[done, 'formatted_code'], formatted)
+        self.assertNotIn((rows['failed'].pk, 'formatted_code'), artifacts)
+        self.assertFalse(
+            Artifact.objects.filter(wireframe_id=rows['empty'].pk).exists()
+        )
+
+        # Can be run again after an interruption
+        backfill_migration.backfill_artifacts(apps, None)
+        self.assertEqual(Artifact.objects.count(), len(artifacts))
+
+        # Reversing restores the columns from the artifacts
+        Upload.objects.update(detected_elements=None, generated_code=None,
+                              formatted_code=None)
+        apps = self.migrate(self.before)
+        Upload = apps.get_model('vision', 'WireframeUpload')
+        restored = Upload.objects.get(pk=rows['done'].pk)
+        self.assertEqual(restored.detected_elements, detected)
+        self.assertEqual(restored.generated_code, GENERATED_CODE)
+        self.assertEqual(restored.formatted_code, formatted)
+        empty = Upload.objects.get(pk=rows['empty'].pk)
+        self.assertIsNone(empty.generated_code)
+
+
+def png_bytes(size=(40, 30)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class PassThroughLimiter:
+
+    def call(self, func, **amounts):
+        return func()
+
+    def charge(self, tokens):
+        pass
+
+
+class VisionBatchTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.paths = []
+        for name in ('a.png', 'broken.png', 'c.png', 'd.png'):
+            path = os.path.join(directory.name, name)
+            with open(path, 'wb') as image_file:
+                if name == 'broken.png':
+                    image_file.write(b'not an image')
+                else:
+                    image_file.write(png_bytes())
+            self.paths.append(path)
+
+        self.client = mock.Mock()
+        self.client.batch_annotate_images.side_effect = (
+            lambda requests: SimpleNamespace(responses=[
+                SimpleNamespace(error=SimpleNamespace(message=''))
+                for _ in requests
+            ])
+        )
+        for target, value in (
+            ('get_vision_client', self.client),
+            ('get_limiter', PassThroughLimiter()),
+        ):
+            patcher = mock.patch(
+                f'vision.vision_api.{target}', return_value=value
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def detect(self, parse_results):
+        with mock.patch(
+            'vision.vision_api.parse_annotation_response',
+            side_effect=parse_results,
+        ):
+            return detect_wireframe_elements_batch(self.paths)
+
+    def test_bad_image_only_fails_its_own_result(self):
+        results = self.detect([
+            {'elements': [], 'full_text': name} for name in 'acd'
+        ])
+
+        requests = self.client.batch_annotate_images.call_args.kwargs[
+            'requests'
+        ]
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(
+            [result.get('full_text') for result in results],
+            ['a', '', 'c', 'd'],
+        )
+        self.assertIn('error', results[1])
+        self.assertNotIn('error', results[0])
+
+    def test_parse_failure_only_fails_its_own_result(self):
+        results = self.detect([
+            {'elements': [], 'full_text': 'a'},
+            ValueError('unexpected response'),
+            {'elements': [], 'full_text': 'd'},
+        ])
+
+        self.assertEqual(results[0]['full_text'], 'a')
+        self.assertIn('error', results[1])
+        self.assertEqual(results[2]['error'], 'unexpected response')
+        self.assertEqual(results[3]['full_text'], 'd')
+
+    def test_failed_request_fails_the_images_it_carried(self):
+        self.client.batch_annotate_images.side_effect = RuntimeError('down')
+        results = self.detect([])
+        for index in (0, 2, 3):
+            self.assertEqual(results[index]['error'], 'down')
+        self.assertIn('cannot identify image', results[1]['error'])
+
+
+@override_settings(VISION_PIPELINE_MODE='sync')
+class BatchUploadTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = get_user_model().objects.create(username='uploader')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def upload(self, files):
+        return self.api.post(
+            reverse('wireframe-batch-upload'),
+            {'images': files, 'theme': 'dark'},
+            format='multipart',
+        )
+
+    @mock.patch('vision.pipeline.generate_code_from_wireframe')
+    @mock.patch('vision.pipeline.detect_elements_batch')
+    def test_partial_failure(self, detect, generate):
+        detect.side_effect = lambda paths, engine=None: [
+            {'elements': [], 'full_text': 'ok'},
+            {'elements': [], 'full_text': '', 'error': 'Vision failed'},
+        ]
+        generate.return_value = GENERATED_CODE
+
+        response = self.upload([
+            SimpleUploadedFile('first.png', png_bytes((40, 30))),
+            SimpleUploadedFile('notes.txt', b'not an image'),
+            SimpleUploadedFile('second.png', png_bytes((30, 40))),
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        items = response.json()['items']
+        self.assertEqual(
+            [item['status'] for item in items],
+            ['completed', 'invalid', 'failed'],
+        )
+        self.assertIn('image', items[1]['errors'])
+        statuses = dict(
+            WireframeUpload.objects.values_list('title', 'status')
+        )
+        self.assertEqual(statuses, {'first': 'completed', 'second': 'failed'})
+        generate.assert_called_once()
+
+    def test_all_invalid(self):
+        response = self.upload([
+            SimpleUploadedFile('notes.txt', b'not an image'),
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WireframeUpload.objects.exists())
+
+
+RESPONSE = """Here is the page:
+
+```HTML
+<main>
+  <p>Hi</p>
+</main>
+```
+
+```css
+main { color: red; }
+```
+
+```Js
+document.title = 'x';
+```
+"""
+
+
+class FenceParserTests(SimpleTestCase):
+
+    def test_sections(self):
+        self.assertEqual(parse_response_text(RESPONSE), {
+            'html': '<main>\n  <p>Hi</p>\n</main>',
+            'css': 'main { color: red; }',
+            'javascript': "document.title = 'x';",
+        })
+
+    def test_aliases(self):
+        for fence, section in (
+            ('htm', 'html'), ('XHTML', 'html'), ('css3', 'css'),
+            ('javascript', 'javascript'), ('mjs', 'javascript'),
+            ('~~~es6', 'javascript'),
+        ):
+            if not fence.startswith('~'):
+                fence = '```' + fence
+            closing = fence[:3]
+            result = parse_response_text(f'{fence}\ncode\n{closing}\n')
+            self.assertEqual(result[section], 'code', fence)
+
+    def test_other_languages_are_skipped(self):
+        result = parse_response_text(
+            '```python\nprint(1)\n```\n```html\n<p>x</p>\n```\n'
+        )
+        self.assertEqual(result['html'], '<p>x</p>')
+        self.assertEqual(result['javascript'], '')
+
+    def test_first_block_of_a_language_wins(self):
+        result = parse_response_text(
+            '```css\na {}\n```\n```css\nb {}\n```\n'
+        )
+        self.assertEqual(result['css'], 'a {}')
+
+    def test_longer_fence_holds_shorter_ones(self):
+        result = parse_response_text(
+            '````html\n<pre>\n```\n</pre>\n````\n'
+        )
+        self.assertEqual(result['html'], '<pre>\n```\n</pre>')
+
+    def test_truncated_output_keeps_the_open_block(self):
+        result = parse_response_text('```html\n<p>x</p>\n<p>y')
+        self.assertEqual(result['html'], '<p>x</p>\n<p>y')
+
+    def test_chunks_split_anywhere(self):
+        expected = parse_response_text(RESPONSE)
+        for size in (1, 2, 3, 5, 7):
+            parser = FenceParser()
+            completed = []
+            for start in range(0, len(RESPONSE), size):
+                completed += parser.feed(RESPONSE[start:start + size])
+            self.assertEqual(parser.close(), expected, size)
+            self.assertEqual(
+                [section for section, _ in completed],
+                ['html', 'css', 'javascript'],
+            )
+
+    def test_section_completes_when_its_fence_closes(self):
+        parser = FenceParser()
+        self.assertEqual(parser.feed('```css\na {}\n``'), [])
+        self.assertEqual(parser.feed('`\n'), [('css', 'a {}')])
+
+    def test_fence_after_prose(self):
+        result = parse_response_text('Here you go: ```html\n<p>x</p>\n```')
+        self.assertEqual(result['html'], '<p>x</p>')
+
+    def test_block_on_one_line(self):
+        result = parse_response_text(
+            '```html <p>x</p>```\n```css a {} ```\n'
+        )
+        self.assertEqual(result['html'], '<p>x</p>')
+        self.assertEqual(result['css'], 'a {}')
+
+    def test_inline_spans_and_bare_fences_in_prose_are_ignored(self):
+        result = parse_response_text(
+            'Wrap ```x``` in the ``` marker.\n```html\n<p>x</p>\n```\n'
+        )
+        self.assertEqual(result['html'], '<p>x</p>')
+
+
+class DedupeTests(TestCase):
+
+    def setUp(self):
+        self.digest = 'a' * 64
+        self.source = self.create(code_status='success')
+
+    def create(self, username='tester', **fields):
+        fields.setdefault('image_sha256', self.digest)
+        if fields.pop('code_status', None) == 'success':
+            fields['generated_code'] = GENERATED_CODE
+        return create_wireframe(username, **fields)
+
+    def upload(self, username='tester', **fields):
+        fields.setdefault('status', 'uploaded')
+        return self.create(username, **fields)
+
+    def test_reuses_the_users_own_upload(self):
+        self.assertEqual(find_reusable_upload(self.upload()), self.source)
+
+    def test_latest_upload_wins(self):
+        WireframeUpload.objects.filter(pk=self.source.pk).update(
+            upload_date=timezone.now() - timedelta(days=1)
+        )
+        latest = self.create(code_status='success')
+        self.assertEqual(find_reusable_upload(self.upload()), latest)
+
+    def test_needs_the_same_image_and_theme(self):
+        self.assertIsNone(find_reusable_upload(self.upload(theme='light')))
+        self.assertIsNone(
+            find_reusable_upload(self.upload(image_sha256='b' * 64))
+        )
+        self.assertIsNone(find_reusable_upload(self.upload(image_sha256='')))
+
+    def test_needs_a_completed_upload_with_code(self):
+        WireframeUpload.objects.filter(pk=self.source.pk).update(
+            status='failed'
+        )
+        self.assertIsNone(find_reusable_upload(self.upload()))
+
+        WireframeUpload.objects.filter(pk=self.source.pk).update(
+            status='completed', code_status='error'
+        )
+        self.assertIsNone(find_reusable_upload(self.upload()))
+
+    def test_never_reuses_itself(self):
+        self.assertIsNone(find_reusable_upload(self.source))
+
+    def test_scope(self):
+        other = self.upload('other')
+        self.assertIsNone(find_reusable_upload(other))
+        with override_settings(WIREFRAME_DEDUPE_SCOPE='global'):
+            self.assertEqual(find_reusable_upload(other), self.source)
+        with override_settings(WIREFRAME_DEDUPE_SCOPE='off'):
+            self.assertIsNone(find_reusable_upload(self.upload()))
+
+    def test_hash_image_file(self):
+        data = b'x' * 100000
+        image = SimpleUploadedFile('a.png', data)
+        self.assertEqual(
+            hash_image_file(image), hashlib.sha256(data).hexdigest()
+        )
+        self.assertEqual(image.tell(), 0)
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        for clock in ('time', 'monotonic'):
+            patcher = mock.patch(
+                f'vision.cache.time.{clock}', side_effect=lambda: self.now
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_key_depends_on_model_theme_and_prompt(self):
+        key = make_cache_key('model', 'prompt', 'dark')
+        self.assertEqual(key, make_cache_key('model', 'prompt', 'dark'))
+        self.assertNotEqual(key, make_cache_key('other', 'prompt', 'dark'))
+        self.assertNotEqual(key, make_cache_key('model', 'prompt', 'light'))
+        self.assertNotEqual(key, make_cache_key('model', 'prompt2', 'dark'))
+        # Parts are separated, so they can't run into each other
+        self.assertNotEqual(
+            make_cache_key('ab', 'c', 'x'), make_cache_key('a', 'bc', 'x')
+        )
+
+    def check_ttl(self, cache):
+        cache.set('key', {'html': 'x'})
+        self.now += 59
+        self.assertEqual(cache.get('key'), {'html': 'x'})
+        self.now += 2
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(
+            cache.stats(),
+            {'hits': 1, 'misses': 1, 'sets': 1, 'evictions': 0},
+        )
+
+    def test_lru_ttl(self):
+        self.check_ttl(LRUResponseCache(ttl=60))
+
+    def test_lru_evicts_the_least_recently_used(self):
+        cache = LRUResponseCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_file_ttl(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = FileResponseCache(ttl=60, location=directory.name)
+        cache.set('key', {'html': 'x'})
+        os.utime(cache._path('key'), (self.now, self.now))
+        self.now += 59
+        self.assertEqual(cache.get('key'), {'html': 'x'})
+        # The hit touched the file with the real clock
+        os.utime(cache._path('key'), (self.now - 59, self.now - 59))
+        self.now += 2
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(os.path.exists(cache._path('key')))
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'response-cache-tests',
+    }})
+    def test_django_clear_keeps_other_entries(self):
+        from django.core.cache import cache as site_cache
+        self.addCleanup(site_cache.clear)
+        site_cache.set('session', 'kept')
+        cache = DjangoResponseCache(ttl=60)
+        cache.set('key', {'html': 'x'})
+        self.assertEqual(cache.get('key'), {'html': 'x'})
+
+        cache.clear()
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(site_cache.get('session'), 'kept')
+
+
+class GeminiResponseCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = LRUResponseCache(ttl=60)
+        self.model = mock.Mock()
+        self.model.generate_content.return_value = SimpleNamespace(
+            text='```html\n<p>x</p>\n```', usage_metadata=None
+        )
+        stats = {'elements': 0, 'elements_sent': 0, 'prompt_tokens': 10}
+        for target, kwargs in (
+            ('get_response_cache', {'return_value': self.cache}),
+            ('get_configured_model', {'return_value': self.model}),
+            ('get_limiter', {'return_value': PassThroughLimiter()}),
+            ('prepare_prompt', {'return_value': ('prompt', stats)}),
+        ):
+            patcher = mock.patch(f'vision.gemini_api.{target}', **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def generate(self, theme='dark', **kwargs):
+        return generate_code_from_wireframe({}, theme=theme, **kwargs)
+
+    def test_identical_prompt_is_answered_from_the_cache(self):
+        first = self.generate()
+        second = self.generate()
+        self.assertEqual(self.model.generate_content.call_count, 1)
+        self.assertIn('usage', first)
+        self.assertNotIn('usage', second)
+        self.assertEqual(second['html'], first['html'])
+
+    def test_theme_and_model_are_part_of_the_key(self):
+        self.generate()
+        self.generate(theme='light')
+        with mock.patch('vision.gemini_api.GEMINI_MODEL_NAME', 'other'):
+            self.generate()
+        self.assertEqual(self.model.generate_content.call_count, 3)
+
+    def test_responses_without_markup_are_not_cached(self):
+        self.model.generate_content.return_value = SimpleNamespace(
+            text='Sorry, no code.', usage_metadata=None
+        )
+        self.generate()
+        self.generate()
+        self.assertEqual(self.model.generate_content.call_count, 2)
+
+    def test_use_cache_false_skips_the_cache(self):
+        self.generate()
+        self.generate(use_cache=False)
+        self.assertEqual(self.model.generate_content.call_count, 2)
+
+
+def legacy_classify(text, width, height):
+    """classify_ui_element as it was before the rules became data"""
+    text_lower = text.lower()
+    if any(k in text_lower for k in ['nav', 'menu', 'home', 'about',
+                                     'contact']):
+        if width > height * 3:
+            return 'navbar'
+        return 'menu'
+    if any(k in text_lower for k in ['submit', 'send', 'login', 'sign',
+                                     'create', 'delete', 'update']):
+        return 'button'
+    if any(k in text_lower for k in ['name', 'email', 'password',
+                                     'username', 'address']):
+        return 'input_field'
+    if len(text) < 50 and height < 40:
+        return 'heading'
+    if len(text) > 50:
+        return 'paragraph'
+    return 'text'
+
+
+class ClassificationTests(SimpleTestCase):
+
+    CASES = [
+        ('Home', 200, 20),
+        ('HOME', 20, 20),
+        ('Sign up', 80, 30),
+        ('Email address', 120, 30),
+        ('Contact us about the menu', 300, 20),
+        # 'username' also contains 'name' but rules are checked in order
+        ('Username', 100, 50),
+        ('Welcome', 100, 39),
+        ('Welcome', 100, 40),
+        ('x' * 49, 400, 60),
+        ('x' * 50, 400, 60),
+        ('x' * 51, 400, 60),
+        ('', 0, 0),
+        # Lower-casing changes the length of 'İ'
+        ('İnav', 100, 10),
+        ('STRASSE ß', 100, 50),
+        ('sub\nmit', 100, 50),
+    ]
+
+    def test_matches_the_legacy_classifier(self):
+        texts, widths, heights = zip(*self.CASES)
+        self.assertEqual(
+            classify_ui_elements(texts, widths, heights),
+            [legacy_classify(*case) for case in self.CASES],
+        )
+
+    def test_matches_the_legacy_classifier_on_random_annotations(self):
+        rng = random.Random(10)
+        words = [
+            'nav', 'Menu', 'submit', 'LOGIN', 'name', 'password', 'İ',
+            'ß', 'the', 'lorem', 'ipsum', 'x', '', 'sig', 'n',
+        ]
+        cases = [
+            (
+                ' '.join(rng.choices(words, k=rng.randint(0, 12))),
+                rng.uniform(0, 500),
+                rng.uniform(0, 80),
+            )
+            for _ in range(2000)
+        ]
+        texts, widths, heights = zip(*cases)
+        self.assertEqual(
+            classify_ui_elements(texts, widths, heights),
+            [legacy_classify(*case) for case in cases],
+        )
+
+    def test_single_annotation_wrapper(self):
+        for case in self.CASES:
+            self.assertEqual(classify_ui_element(*case),
+                             legacy_classify(*case))
+
+    def test_empty_batch(self):
+        self.assertEqual(classify_ui_elements([], [], []), [])
+
+    def test_custom_rules(self):
+        rules = dict(DEFAULT_CLASSIFICATION_RULES, keywords=[
+            {'label': 'link', 'keywords': ['http']},
+            {'label': 'empty', 'keywords': []},
+        ], default='other')
+        classifier = ElementClassifier(rules)
+        self.assertEqual(
+            classifier.classify(
+                ['see https://x', 'Home', 'y' * 60], [10] * 3, [50] * 3
+            ),
+            ['link', 'other', 'paragraph'],
+        )
+
+
+def word(text, x, y, width=40, height=20):
+    return {
+        'text': text, 'position': {'x': x, 'y': y},
+        'width': width, 'height': height,
+    }
+
+
+class LayoutTests(SimpleTestCase):
+
+    def test_words_join_a_line(self):
+        words = [
+            word('Sign', 10, 100), word('up', 60, 102), word('now', 110, 99),
+        ]
+        self.assertEqual(group_words(words), [{
+            'type': None,
+            'text': 'Sign up now',
+            'position': {'x': 10, 'y': 99},
+            'width': 140,
+            'height': 23,
+            'row': 0,
+            'column': 0,
+            'words': 3,
+        }])
+
+    def test_wide_gap_splits_a_line_into_columns(self):
+        words = [word('Logo', 10, 10), word('Login', 400, 12)]
+        elements = group_words(words)
+        self.assertEqual(
+            [(e['text'], e['row'], e['column']) for e in elements],
+            [('Logo', 0, 0), ('Login', 0, 1)],
+        )
+
+    def test_words_without_vertical_overlap_form_separate_lines(self):
+        [block] = group_words([word('a', 10, 10), word('b', 30, 25)])
+        self.assertEqual(block['text'], 'a\nb')
+        self.assertEqual(len(block['lines']), 2)
+
+    def test_close_lines_form_a_block(self):
+        words = [
+            word('Dear', 10, 10), word('reader', 60, 10),
+            word('welcome', 10, 40), word('back', 60, 40),
+        ]
+        [block] = group_words(words)
+        self.assertEqual(block['text'], 'Dear reader\nwelcome back')
+        self.assertEqual(block['words'], 4)
+        self.assertEqual(
+            [(line['text'], line['position']) for line in block['lines']],
+            [
+                ('Dear reader', {'x': 10, 'y': 10}),
+                ('welcome back', {'x': 10, 'y': 40}),
+            ],
+        )
+
+    def test_distant_lines_form_rows(self):
+        elements = group_words([word('Title', 10, 10), word('Body', 10, 80)])
+        self.assertEqual(
+            [(e['text'], e['row'], e['column']) for e in elements],
+            [('Title', 0, 0), ('Body', 1, 0)],
+        )
+
+    def test_reading_order_does_not_depend_on_input_order(self):
+        words = [
+            word('Home', 10, 10), word('About', 60, 10),
+            word('Contact', 500, 10),
+            word('Hello', 10, 200), word('world', 60, 200),
+        ]
+        expected = group_words(words)
+        self.assertEqual(
+            [e['text'] for e in expected],
+            ['Home About', 'Contact', 'Hello world'],
+        )
+        rng = random.Random(11)
+        for _ in range(5):
+            rng.shuffle(words)
+            self.assertEqual(group_words(words), expected)
+
+    def test_no_words(self):
+        self.assertEqual(group_words([]), [])
+
+
+class PromptBudgetTests(SimpleTestCase):
+
+    def detected(self, paragraphs=200):
+        elements = [
+            {
+                'type': 'button', 'text': f'Button {index}',
+                'position': {'x': 10, 'y': index * 40},
+                'width': 80, 'height': 30,
+            }
+            for index in range(5)
+        ]
+        elements += [
+            {
+                'type': 'paragraph', 'text': f'Paragraph {index} ' + 'x' * 60,
+                'position': {'x': 10, 'y': 1000 + index * 40},
+                'width': 500, 'height': 30,
+            }
+            for index in range(paragraphs)
+        ]
+        return {'elements': elements, 'full_text': ''}
+
+    def test_prompt_within_budget_is_sent_whole(self):
+        prompt, stats = build_gemini_prompt(
+            self.detected(paragraphs=3), token_budget=6000
+        )
+        self.assertEqual(stats['elements'], 8)
+        self.assertEqual(stats['elements_sent'], 8)
+        self.assertNotIn('omitted', prompt)
+
+    def test_no_budget(self):
+        _, stats = build_gemini_prompt(self.detected(), token_budget=None)
+        self.assertEqual(stats['elements_sent'], stats['elements'])
+
+    def test_trims_lowest_priority_elements_to_the_budget(self):
+        _, full_stats = build_gemini_prompt(self.detected())
+        budget = full_stats['prompt_tokens'] // 2
+        prompt, stats = build_gemini_prompt(
+            self.detected(), token_budget=budget
+        )
+
+        self.assertLessEqual(stats['prompt_tokens'], budget)
+        self.assertLessEqual(len(prompt) // 4 + 1, budget)
+        self.assertLess(stats['elements_sent'], stats['elements'])
+        for index in range(5):
+            self.assertIn(f'button|Button {index}|', prompt)
+        omitted = stats['elements'] - stats['elements_sent']
+        self.assertIn(f'({omitted} lower-priority elements omitted', prompt)
+        # Earlier paragraphs are kept before later ones
+        self.assertIn('Paragraph 0 ', prompt)
+        self.assertNotIn('Paragraph 199 ', prompt)
+
+    @override_settings(GEMINI_PROMPT_TOKEN_BUDGET=1500)
+    def test_prepare_prompt_makes_no_gemini_call(self):
+        with mock.patch(
+            'vision.gemini_api.get_configured_model',
+            side_effect=AssertionError('Gemini called'),
+        ):
+            _, stats = prepare_prompt(self.detected())
+        self.assertLessEqual(stats['prompt_tokens'], 1500)
+
+
+class WireframeListTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.wireframes = [
+            create_wireframe(
+                title=f'Sketch {index}',
+                upload_date=now - timedelta(minutes=index),
+                status='failed' if index == 2 else 'completed',
+            )
+            for index in range(5)
+        ]
+        create_wireframe('other', title='Not mine')
+        self.api = APIClient()
+        self.api.force_authenticate(self.wireframes[0].user)
+
+    def get_page(self, url=None, **params):
+        response = self.api.get(url or reverse('user-wireframes'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def walk(self, **params):
+        ids = []
+        page = self.get_page(**params)
+        self.assertIsNone(page['previous'])
+        while True:
+            ids += [item['id'] for item in page['results']]
+            if not page['next']:
+                return ids
+            page = self.get_page(page['next'])
+
+    def test_pages_follow_the_cursor_newest_first(self):
+        self.assertEqual(
+            self.walk(page_size=2), [w.pk for w in self.wireframes]
+        )
+
+    def test_new_uploads_do_not_shift_later_pages(self):
+        page = self.get_page(page_size=2)
+        create_wireframe(title='Newest')
+        ids = [item['id'] for item in page['results']]
+        while page['next']:
+            page = self.get_page(page['next'])
+            ids += [item['id'] for item in page['results']]
+        self.assertEqual(ids, [w.pk for w in self.wireframes])
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(WireframeCursorPagination, 'max_page_size', 3):
+            self.assertEqual(len(self.get_page(page_size=100)['results']), 3)
+
+    def test_status_filter(self):
+        ids = self.walk(status='failed,processing')
+        self.assertEqual(ids, [self.wireframes[2].pk])
+
+        response = self.api.get(reverse('user-wireframes'), {'status': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_fields(self):
+        results = self.get_page(fields='id, status')['results']
+        self.assertEqual(results[0], {
+            'id': self.wireframes[0].pk, 'status': 'completed',
+        })
+
+        response = self.api.get(
+            reverse('user-wireframes'), {'fields': 'id,generated_code'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('generated_code', response.json()['fields'])
+
+    def test_username_is_joined_in_one_query(self):
+        with self.assertNumQueries(1):
+            results = self.get_page(fields='id,username')['results']
+        self.assertEqual(
+            {item['username'] for item in results}, {'tester'}
+        )
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.wireframe = create_wireframe(generated_code=GENERATED_CODE)
+        self.api = APIClient()
+        self.api.force_authenticate(self.wireframe.user)
+
+    def get(self, name='wireframe-detail', **headers):
+        return self.api.get(
+            reverse(name, args=[self.wireframe.pk]), **headers
+        )
+
+    def test_if_none_match(self):
+        for name in ('wireframe-detail', 'wireframe-code'):
+            response = self.get(name)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            self.assertEqual(
+                self.get(name, HTTP_IF_NONE_MATCH=etag).status_code, 304
+            )
+
+    def test_detail_and_code_have_their_own_etags(self):
+        self.assertNotEqual(
+            self.get()['ETag'], self.get('wireframe-code')['ETag']
+        )
+
+    def test_if_modified_since(self):
+        last_modified = self.get()['Last-Modified']
+        response = self.get(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_change_invalidates_the_validators(self):
+        etag = self.get()['ETag']
+        self.wireframe.updated_at -= timedelta(seconds=5)
+        WireframeUpload.objects.filter(pk=self.wireframe.pk).update(
+            updated_at=self.wireframe.updated_at
+        )
+        last_modified = self.get()['Last-Modified']
+
+        self.wireframe.title = 'Renamed'
+        self.wireframe.save()
+        response = self.get(
+            HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_running_job_has_no_last_modified(self):
+        WireframeUpload.objects.filter(pk=self.wireframe.pk).update(
+            status='processing'
+        )
+        response = self.get()
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_code_being_generated_has_no_validators(self):
+        self.wireframe.set_generated_code(None)
+        self.wireframe.save()
+        with mock.patch(
+            'vision.views.generate_missing_code', return_value=False
+        ):
+            response = self.get('wireframe-code')
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_other_users_wireframe(self):
+        self.api.force_authenticate(
+            get_user_model().objects.create(username='other')
+        )
+        response = self.get(HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+
+class FormatterTests(SimpleTestCase):
+
+    def check(self, language, code, expected):
+        formatted = format_code(language, code)
+        self.assertEqual(formatted, expected)
+        # Formatting is stable
+        self.assertEqual(format_code(language, formatted), expected)
+
+    def test_css(self):
+        self.check(
+            'css',
+            'a{color:red;background:url("x;y")}'
+            '@media (max-width:10px){b{margin:0}}/* c */',
+            'a {\n'
+            '  color: red;\n'
+            '  background: url("x;y");\n'
+            '}\n'
+            '\n'
+            '@media (max-width:10px) {\n'
+            '  b {\n'
+            '    margin: 0;\n'
+            '  }\n'
+            '}\n'
+            '\n'
+            '/* c */',
+        )
+
+    def test_javascript(self):
+        self.check(
+            'javascript',
+            'function f(a) {\n'
+            'if (a) {\n'
+            '        const s = `line one\n'
+            '   line two ${a}`;\n'
+            'return s.replace(/[{]/g, "}");\n'
+            '}\n'
+            '  /* keep\n'
+            '     me */\n'
+            'foo(function () {\n'
+            'bar([\n'
+            '1,\n'
+            '2]);\n'
+            '});\n'
+            '}',
+            'function f(a) {\n'
+            '  if (a) {\n'
+            '    const s = `line one\n'
+            '   line two ${a}`;\n'
+            '    return s.replace(/[{]/g, "}");\n'
+            '  }\n'
+            '  /* keep\n'
+            '     me */\n'
+            '  foo(function () {\n'
+            '    bar([\n'
+            '      1,\n'
+            '      2]);\n'
+            '  });\n'
+            '}',
+        )
+
+    def test_html(self):
+        self.check(
+            'html',
+            '<!DOCTYPE html><html><head><title>T</title>'
+            '<style>a{color:red}</style></head><body><div class="a">'
+            '<p>Hi <b>there</b></p><br><pre>  keep\n   this</pre>'
+            '<script>if(x){y()}</script></div></body></html>',
+            '<!DOCTYPE html>\n'
+            '<html>\n'
+            '  <head>\n'
+            '    <title>T</title>\n'
+            '    <style>\n'
+            '      a {\n'
+            '        color: red;\n'
+            '      }\n'
+            '    </style>\n'
+            '  </head>\n'
+            '  <body>\n'
+            '    <div class="a">\n'
+            '      <p>Hi <b>there</b></p>\n'
+            '      <br>\n'
+            '      <pre>  keep\n'
+            '   this</pre>\n'
+            '      <script>\n'
+            '        if(x){y()}\n'
+            '      </script>\n'
+            '    </div>\n'
+            '  </body>\n'
+            '</html>',
+        )
+
+    def test_code_over_the_size_limit_is_returned_unchanged(self):
+        self.assertEqual(format_code('css', 'a{b:c}', max_chars=5), 'a{b:c}')
+
+    def test_slow_formatting_is_returned_unchanged(self):
+        css = 'a{b:c}' * 1000
+        clock = iter(range(0, 10 ** 6, 10))
+        with mock.patch(
+            'vision.formatter.time.monotonic', side_effect=lambda: next(clock)
+        ):
+            self.assertEqual(format_code('css', css, timeout=1), css)
+
+    def test_format_generated_code(self):
+        self.assertEqual(
+            format_generated_code(None),
+            {'html': '', 'css': '', 'javascript': ''},
+        )
+        formatted = format_generated_code({'css': 'a{b:c}'})
+        self.assertEqual(formatted['css'], 'a {\n  b: c;\n}')
+
+
+class HealthTests(StateDirMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        state = override_settings(OUTBOUND_RATE_LIMIT_DIR=self.state_dir)
+        state.enable()
+        self.addCleanup(state.disable)
+
+        breaker = CircuitBreaker(
+            'gemini', self.state_path('breaker.json'), failure_threshold=1
+        )
+        breaker.record_failure(ValueError('key AIza... rejected'))
+        limiter = SimpleNamespace(breaker=breaker)
+        for target, kwargs in (
+            ('get_limiter', {'return_value': limiter}),
+            # Leave the probe results as written by the test
+            ('_refresh_if_stale', {}),
+        ):
+            patcher = mock.patch(f'vision.health.{target}', **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with _health_state().locked() as state:
+            state.update(checked_at=time.time(), probes={'gemini': {
+                'status': 'error', 'message': 'API key not valid',
+                'latency_ms': 3,
+            }})
+        self.api = APIClient()
+
+    def get(self, user=None):
+        if user is not None:
+            self.api.force_authenticate(user)
+        response = self.api.get(reverse('health'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_public_health_has_no_error_messages(self):
+        health = self.get()
+        self.assertEqual(health['status'], 'degraded')
+        gemini = health['services']['gemini']
+        self.assertEqual(gemini['breaker']['state'], 'open')
+        self.assertEqual(gemini['breaker']['failures'], 1)
+        self.assertNotIn('last_error', gemini['breaker'])
+        self.assertEqual(
+            gemini['probe'], {'status': 'error', 'latency_ms': 3}
+        )
+
+    def test_users_get_the_public_view(self):
+        user = get_user_model().objects.create(username='user')
+        gemini = self.get(user)['services']['gemini']
+        self.assertNotIn('last_error', gemini['breaker'])
+        self.assertNotIn('message', gemini['probe'])
+
+    def test_staff_get_the_error_messages(self):
+        staff = get_user_model().objects.create(
+            username='staff', is_staff=True
+        )
+        gemini = self.get(staff)['services']['gemini']
+        self.assertIn('rejected', gemini['breaker']['last_error'])
+        self.assertEqual(gemini['probe']['message'], 'API key not valid')
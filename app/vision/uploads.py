@@ -0,0 +1,80 @@
+"""
+Upload handler that streams uploaded images to disk.
+
+Django keeps uploads under FILE_UPLOAD_MAX_MEMORY_SIZE in memory and the
+serializer then read every file once more to hash it. HashingUploadHandler
+writes each file to a temporary file chunk by chunk, whatever its size,
+and in the same pass computes its SHA-256 and notes whether its header is
+that of an image format Vision reads. Memory used per upload stays at one
+chunk, and image validation, the storage backend and the pipeline all
+read from the file on disk.
+
+The wireframe upload views install it on their requests; other uploads
+keep Django's default handlers.
+"""
+import hashlib
+import logging
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Pillow names of the image formats Google Vision accepts
+VISION_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'BMP', 'WEBP', 'ICO', 'TIFF')
+# Bytes Pillow reads to identify a file
+HEADER_SIZE = 16
+
+
+def is_image_header(header):
+    """
+    Checks the start of a file against the VISION_IMAGE_FORMATS, using
+    Pillow's own format detection.
+
+    Args:
+        header (bytes): The first HEADER_SIZE bytes of the file (fewer for
+            shorter files)
+
+    Returns:
+        bool: Whether the file looks like an image Vision can read
+    """
+    Image.init()
+    for name in VISION_IMAGE_FORMATS:
+        accept = Image.OPEN.get(name, (None, None))[1]
+        result = accept(header) if accept is not None else False
+        # Pillow returns an error message for formats it can't decode
+        if result and not isinstance(result, str):
+            return True
+    return False
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams every uploaded file to a temporary file, computing its SHA-256
+    as it goes. The uploaded file gets two extra attributes: `sha256` and
+    `supported_format`, False when its header isn't one of
+    VISION_IMAGE_FORMATS (WireframeUploadSerializer rejects those).
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.header = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        if len(self.header) < HEADER_SIZE:
+            self.header += raw_data[:HEADER_SIZE - len(self.header)]
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        file.supported_format = is_image_header(self.header)
+        if not file.supported_format:
+            logger.info(
+                f"Upload {self.file_name!r} isn't in a format Vision reads"
+            )
+        return file
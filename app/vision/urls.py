@@ -1,13 +1,35 @@
 # app/app/urls.py
 # (Update this path if your URLs are in a different location)
 
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Served over ASGI, the endpoints that wait on Vision/Gemini use async views
+if settings.SERVER_MODE == 'asgi':
+    from . import async_views
+    upload_view = async_views.wireframe_upload_api
+    code_view = async_views.generate_code_api
+    code_stream_view = async_views.generate_code_stream_api
+    test_gemini_view = async_views.test_gemini_connection_api
+else:
+    upload_view = views.WireframeUploadAPIView.as_view()
+    code_view = views.generate_code_api
+    code_stream_view = views.generate_code_stream_api
+    test_gemini_view = views.test_gemini_connection_api
+
 urlpatterns = [
-    path('api/wireframes/', views.WireframeUploadAPIView.as_view(), name='wireframe-upload'),
+    path('api/wireframes/', upload_view, name='wireframe-upload'),
+    path(
+        'api/wireframes/batch/',
+        views.WireframeBatchUploadAPIView.as_view(),
+        name='wireframe-batch-upload',
+    ),
     path('api/wireframes/user/', views.user_wireframes_api, name='user-wireframes'),
     path('api/wireframes/<int:pk>/', views.wireframe_detail_api, name='wireframe-detail'),
-    path('api/wireframes/<int:pk>/code/', views.generate_code_api, name='wireframe-code'),
-    path('api/test-gemini/', views.test_gemini_connection_api, name='test-gemini'),
-]
\ No newline at end of file
+    path('api/wireframes/<int:pk>/code/', code_view, name='wireframe-code'),
+    path('api/wireframes/<int:pk>/code/stream/', code_stream_view,
+         name='wireframe-code-stream'),
+    path('api/test-gemini/', test_gemini_view, name='test-gemini'),
+    path('api/health/', views.health_api, name='health'),
+]
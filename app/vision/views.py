@@ -1,56 +1,228 @@
 import os
 import json
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.http import StreamingHttpResponse
+from django.views.decorators.http import condition
 from rest_framework import generics, status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.decorators import (
+    api_view, permission_classes, renderer_classes
+)
+from rest_framework.renderers import JSONRenderer
 from .models import WireframeUpload
-from .serializers import WireframeUploadSerializer
-from vision.vision_api import detect_wireframe_elements
-from vision.gemini_api import generate_code_from_wireframe
-from .formatter import beautify_code
+from .pagination import WireframeCursorPagination
+from .serializers import (
+    WireframeUploadSerializer, WireframeBatchUploadSerializer,
+    WireframeListSerializer,
+)
+from vision.gemini_api import stream_code_from_wireframe
+from .pipeline import (
+    CODE_FIELDS, process_wireframe, process_wireframe_batch,
+    claim_missing_code, generate_missing_code, release_generation,
+)
+from .tasks import process_wireframe_task, process_wireframe_batch_task
+from .formatter import FORMAT_VERSION
+from .uploads import HashingUploadHandler
+from .renderers import EventStreamRenderer, format_sse
 
-class WireframeUploadAPIView(generics.CreateAPIView):
+# Seconds a client is asked to wait before asking again for code that is
+# being generated by another request
+GENERATION_RETRY_AFTER = 2
+
+
+def _wireframe_version(request, pk):
+    """
+    (updated_at, status, code status) of a wireframe, or None if the user
+    doesn't own it. Fetched with one light query per request so conditional
+    GETs can answer 304 without loading the JSON columns.
+    """
+    cache = request.__dict__.setdefault('_wireframe_versions', {})
+    if pk not in cache:
+        cache[pk] = WireframeUpload.objects.filter(
+            pk=pk, user=request.user
+        ).values_list('updated_at', 'status', 'code_status').first()
+    return cache[pk]
+
+
+def generation_pending_response():
+    """202 for a request whose code another request is generating"""
+    return Response(
+        {"status": "pending",
+         "message": "Code is being generated for this wireframe"},
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Retry-After': str(GENERATION_RETRY_AFTER)}
+    )
+
+
+def _make_etag(variant):
+    def etag(request, pk):
+        version = _wireframe_version(request, pk)
+        if version is None:
+            return None
+        if variant == 'code' and version[2] in ('', 'error'):
+            # The code endpoint generates code on this request; no validator
+            return None
+        etag = f"wf-{pk}-{int(version[0].timestamp() * 1000000)}-{variant}"
+        if variant == 'code':
+            # Formatted code is re-formatted lazily when the formatter changes
+            etag += f"-f{FORMAT_VERSION}"
+        return etag
+    return etag
+
+
+def _make_last_modified(variant):
+    def last_modified(request, pk):
+        version = _wireframe_version(request, pk)
+        # Last-Modified has one second resolution and a running job updates
+        # the row several times a second, so only ETags are used until the
+        # wireframe is done
+        if version is None or version[1] in ('uploaded', 'processing'):
+            return None
+        if variant == 'code' and version[2] in ('', 'error'):
+            return None
+        return version[0]
+    return last_modified
+
+
+class HashingUploadMixin:
+    """Streams the view's uploads through HashingUploadHandler"""
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Before DRF wraps the request, so before anything parses the body
+        request.upload_handlers = [HashingUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+
+class WireframeUploadAPIView(HashingUploadMixin, generics.CreateAPIView):
     """API endpoint for wireframe uploads using DRF generic views"""
     serializer_class = WireframeUploadSerializer
     permission_classes = [IsAuthenticated]
-    
+
     def perform_create(self, serializer):
-        # Save the wireframe with user from request
+        engine = serializer.validated_data.pop('engine', None)
+
+        if settings.VISION_PIPELINE_MODE == 'job':
+            # Hand the wireframe to a worker once the row is committed
+            wireframe = serializer.save(
+                user=self.request.user, status='uploaded'
+            )
+            transaction.on_commit(
+                lambda: process_wireframe_task.delay(
+                    wireframe.pk, engine=engine
+                )
+            )
+            return
+
+        # Save the wireframe with user from request and process it inline
         wireframe = serializer.save(user=self.request.user, status='processing')
-        
-        # Process image with Vision API
-        try:
-            # Step 1: Detect elements with Vision API
-            detected_elements = detect_wireframe_elements(wireframe.image.path)
-            wireframe.detected_elements = detected_elements
-            
-            # Step 2: Generate code with Gemini API
-            generated_code = generate_code_from_wireframe(detected_elements)
-            wireframe.generated_code = generated_code
-            
-            wireframe.status = 'completed'
-        except Exception as e:
-            wireframe.status = 'failed'
-            print(f"Error processing wireframe: {e}")
-        
-        wireframe.save()
-    
+        process_wireframe(wireframe, engine=engine)
+
     def create(self, request, *args, **kwargs):
         # Override create to return updated data after processing
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
-        
+
         # Get the updated instance and serialize it
         instance = WireframeUpload.objects.get(pk=serializer.instance.pk)
         return Response(
             self.get_serializer(instance).data,
-            status=status.HTTP_201_CREATED
+            status=(
+                status.HTTP_202_ACCEPTED
+                if settings.VISION_PIPELINE_MODE == 'job'
+                else status.HTTP_201_CREATED
+            )
+        )
+
+
+class WireframeBatchUploadAPIView(HashingUploadMixin, generics.GenericAPIView):
+    """API endpoint for uploading and processing many wireframes at once"""
+    serializer_class = WireframeBatchUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        theme = serializer.validated_data['theme']
+        engine = serializer.validated_data.get('engine')
+        job_mode = settings.VISION_PIPELINE_MODE == 'job'
+
+        # Validate every image on its own so one bad file doesn't reject
+        # the batch
+        items = []
+        wireframes = []
+        for index, image in enumerate(serializer.validated_data['images']):
+            item = {'index': index, 'filename': image.name}
+            image_serializer = WireframeUploadSerializer(data={
+                'image': image,
+                'title': Path(image.name).stem[:255] or 'Untitled Wireframe',
+                'theme': theme,
+            })
+            if not image_serializer.is_valid():
+                item.update(status='invalid', errors=image_serializer.errors)
+            else:
+                wireframes.append(WireframeUpload(
+                    user=request.user,
+                    status='uploaded' if job_mode else 'processing',
+                    **image_serializer.validated_data
+                ))
+                item['wireframe'] = wireframes[-1]
+            items.append(item)
+
+        if not wireframes:
+            return Response(
+                {'items': items}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            last_pk = WireframeUpload.objects.aggregate(
+                last_pk=Max('pk')
+            )['last_pk'] or 0
+            WireframeUpload.objects.bulk_create(wireframes)
+            if any(w.pk is None for w in wireframes):
+                # MySQL doesn't return primary keys from a bulk insert, so look
+                # them up through the stored file names, among the new rows
+                # only: an older row may hold a name that storage handed out
+                # again after its file was deleted
+                pks = dict(
+                    WireframeUpload.objects.filter(
+                        user=request.user,
+                        pk__gt=last_pk,
+                        image__in=[w.image.name for w in wireframes],
+                    ).values_list('image', 'pk')
+                )
+                for wireframe in wireframes:
+                    wireframe.pk = pks[wireframe.image.name]
+
+        if job_mode:
+            ids = [w.pk for w in wireframes]
+            transaction.on_commit(
+                lambda: process_wireframe_batch_task.delay(ids, engine=engine)
+            )
+        else:
+            process_wireframe_batch(wireframes, engine=engine)
+
+        for item in items:
+            wireframe = item.pop('wireframe', None)
+            if wireframe is not None:
+                item.update(id=wireframe.pk, status=wireframe.status)
+
+        return Response(
+            {'items': items},
+            status=(
+                status.HTTP_202_ACCEPTED if job_mode
+                else status.HTTP_201_CREATED
+            )
         )
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=_make_etag('detail'),
+           last_modified_func=_make_last_modified('detail'))
 def wireframe_detail_api(request, pk):
     """API endpoint for retrieving a specific wireframe's details"""
     try:
@@ -63,44 +235,78 @@ def wireframe_detail_api(request, pk):
             status=status.HTTP_404_NOT_FOUND
         )
 
+
+def user_wireframes_queryset(user, statuses=None, fields=None):
+    """
+    The user's wireframes for the list endpoint, optionally filtered by
+    status
+    """
+    wireframes = WireframeUpload.objects.filter(user=user)
+    if statuses:
+        wireframes = wireframes.filter(status__in=statuses)
+    return WireframeListSerializer.get_queryset(wireframes, fields)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_wireframes_api(request):
-    """API endpoint for retrieving all wireframes belonging to the current user"""
-    wireframes = WireframeUpload.objects.filter(user=request.user)
-    serializer = WireframeUploadSerializer(wireframes, many=True)
-    return Response(serializer.data)
+    """
+    API endpoint for listing the current user's wireframes, a page at a time
+    """
+    # ?fields=id,title,status returns only those fields
+    fields = [
+        f.strip() for f in request.query_params.get('fields', '').split(',')
+        if f.strip()
+    ]
+    # ?status=completed or ?status=uploaded,processing
+    statuses = [
+        s.strip() for s in request.query_params.get('status', '').split(',')
+        if s.strip()
+    ]
+    valid_statuses = [choice for choice, _ in WireframeUpload.STATUS_CHOICES]
+    if set(statuses) - set(valid_statuses):
+        return Response(
+            {"error": "Invalid status, expected one of: "
+                      f"{', '.join(valid_statuses)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    wireframes = user_wireframes_queryset(request.user, statuses, fields)
+    paginator = WireframeCursorPagination()
+    page = paginator.paginate_queryset(wireframes, request)
+    serializer = WireframeListSerializer(page, many=True, fields=fields)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=_make_etag('code'),
+           last_modified_func=_make_last_modified('code'))
 def generate_code_api(request, pk):
     """API endpoint for generating/retrieving code for a specific wireframe"""
     try:
         wireframe = WireframeUpload.objects.get(pk=pk, user=request.user)
         
         # Check if code has already been generated
-        if not wireframe.generated_code or 'status' in wireframe.generated_code and wireframe.generated_code['status'] == 'error':
+        if wireframe.needs_code():
             # Generate code if not already available
-            if wireframe.detected_elements:
-                wireframe.generated_code = generate_code_from_wireframe(wireframe.detected_elements)
-                wireframe.save()
-            else:
+            if not wireframe.detected_elements:
                 return Response(
                     {"error": "No detected elements available for this wireframe"}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            # Only one request per wireframe calls Gemini, the others
+            # are told to come back
+            if not generate_missing_code(wireframe):
+                return generation_pending_response()
 
-        # Pretty print response, split html/css for better readability
-        generated = wireframe.generated_code or {}
-        html_code = generated.get("html", "")
-        css_code = generated.get("css", "")
-
-        formatted = beautify_code(html_code, css_code)
+        # Pretty printed when the code was generated, split html/css for
+        # better readability
+        formatted = wireframe.get_formatted_code()
         return Response({
-        "status": "success",
-        "html": formatted["html"],
-        "css": formatted["css"]
+            "status": "success",
+            "html": formatted["html"],
+            "css": formatted["css"],
+            "javascript": formatted["javascript"]
         }, status=status.HTTP_200_OK)
 
     except WireframeUpload.DoesNotExist:
@@ -109,10 +315,120 @@ def generate_code_api(request, pk):
             status=status.HTTP_404_NOT_FOUND
         )
 
+
+def generated_code_events(wireframe):
+    """
+    SSE events of a code generation the caller has claimed. Saves the
+    result and releases the claim.
+    """
+    try:
+        for event, data in stream_code_from_wireframe(
+            wireframe.detected_elements, theme=wireframe.theme
+        ):
+            if event in ('done', 'error'):
+                # Persist the final result before the client sees it
+                wireframe.set_generated_code(data)
+                wireframe.save(update_fields=CODE_FIELDS)
+            yield format_sse(event, data)
+    finally:
+        # Also runs when the client disconnects mid-stream
+        release_generation(wireframe)
+
+
+class ClaimedCodeEvents:
+    """
+    Iterator over generated_code_events that also releases the claim when
+    the response is closed. Closing a generator that never started skips
+    its finally, so without this a response dropped before its first chunk
+    would hold the claim (and its renewer) forever.
+    """
+
+    def __init__(self, wireframe):
+        self.wireframe = wireframe
+        self.events = generated_code_events(wireframe)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.events)
+
+    def close(self):
+        self.events.close()
+        if self.wireframe.generation_claimed_at is not None:
+            release_generation(self.wireframe)
+
+
+def stored_code_events(wireframe):
+    """SSE events for code that was already generated, sent straight away"""
+    generated = wireframe.generated_code
+    for section in ('html', 'css', 'javascript'):
+        if generated.get(section):
+            yield format_sse('section', {
+                'section': section, 'code': generated[section]
+            })
+    yield format_sse('done', generated)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([EventStreamRenderer, JSONRenderer])
+def generate_code_stream_api(request, pk):
+    """
+    API endpoint streaming code generation for a wireframe as Server-Sent
+    Events
+    """
+    try:
+        wireframe = WireframeUpload.objects.get(pk=pk, user=request.user)
+    except WireframeUpload.DoesNotExist:
+        return Response(
+            {"error": "Wireframe not found"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    claimed = False
+    if wireframe.needs_code():
+        if not wireframe.detected_elements:
+            return Response(
+                {"error": "No detected elements available for this wireframe"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        claim = claim_missing_code(wireframe)
+        if claim == 'pending':
+            return generation_pending_response()
+        claimed = claim == 'claimed'
+
+    events = ClaimedCodeEvents if claimed else stored_code_events
+    # StreamingHttpResponse.close() calls ClaimedCodeEvents.close()
+    response = StreamingHttpResponse(events(wireframe),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
         
 @api_view(['GET'])
+@permission_classes([IsAdminUser])
 def test_gemini_connection_api(request):
-    """API endpoint for testing Gemini API connection"""
+    """
+    API endpoint for testing Gemini API connection. Staff only, as it makes
+    a real generation call; monitoring should use health_api.
+    """
     from vision.gemini_api import test_gemini_connection
     result = test_gemini_connection()
-    return Response(result)
\ No newline at end of file
+    return Response(result)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def health_api(request):
+    """
+    API endpoint for load balancer and monitoring checks. Reports the
+    circuit breakers and a cached upstream probe, so it is cheap to call
+    often; the app itself is up whenever this answers. Anyone gets the
+    states and counts, staff also get the upstream error messages.
+    """
+    from vision.health import get_health
+    details = IsAdminUser().has_permission(request, None)
+    return Response(get_health(details=details))
@@ -1,91 +1,213 @@
+import asyncio
 import os
-import io
+import threading
+import weakref
+from asgiref.sync import sync_to_async
 from google.cloud import vision
 from google.cloud.vision_v1 import types
+import logging
+from django.conf import settings
+from .preprocess import preprocess_image
+from .local_detector import detect_wireframe_elements_local
+from .classification import classify_ui_elements
+from .layout import group_words
+from .ratelimit import get_limiter
 from dotenv import load_dotenv
 import json
 
 # Load environment variables
 load_dotenv()
 
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# 'vision' - Google Vision only
+# 'local'  - offline Pillow/NumPy detector only (no network)
+# 'auto'   - Google Vision, falling back to the local detector when it fails
+DETECTION_ENGINES = ('vision', 'local', 'auto')
+
+# Features requested for every image, sent together in a single RPC
+ANNOTATION_FEATURES = [
+    # Text annotations (for labels, buttons, text fields)
+    {'type_': vision.Feature.Type.TEXT_DETECTION},
+    # Object localization (for UI components like buttons, input fields)
+    {'type_': vision.Feature.Type.OBJECT_LOCALIZATION},
+]
+
+# Maximum number of images Vision accepts in one batch_annotate_images call
+VISION_BATCH_SIZE = 16
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+# event loop -> ImageAnnotatorAsyncClient
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _set_credentials_path():
+    # Set the credentials file path explicitly
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    credentials_path = os.path.join(app_dir, 'google_credentials.json')
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
+
+
+def get_vision_client():
+    """
+    Returns the process-wide Vision client.
+
+    The client (and its gRPC channel) is created once per process and reused
+    by every call. It is rebuilt after a fork, since gRPC channels can't be
+    shared between a parent and child process.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _set_credentials_path()
+                _client = vision.ImageAnnotatorClient()
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_vision_async_client():
+    """
+    Returns the Vision async client for the running event loop.
+
+    grpc.aio channels belong to the loop that created them, so one client
+    is kept per loop; an ASGI worker runs a single loop, so in practice
+    this is one client per process.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        _set_credentials_path()
+        client = vision.ImageAnnotatorAsyncClient()
+        _async_clients[loop] = client
+    return client
+
+
+def detect_elements(image_path, engine=None):
+    """
+    Detects UI elements with the requested engine.
+
+    Args:
+        image_path (str): Path of the wireframe image
+        engine (str): One of DETECTION_ENGINES, defaults to the
+            VISION_DETECTION_ENGINE setting
+
+    Returns:
+        dict: Structured data about the detected elements
+    """
+    engine = engine or settings.VISION_DETECTION_ENGINE
+    if engine == 'local':
+        return detect_wireframe_elements_local(image_path)
+
+    result = detect_wireframe_elements(image_path)
+    if engine == 'auto' and result.get('error'):
+        logger.warning(
+            f"Vision failed ({result['error']}), using the local detector"
+        )
+        result = dict(detect_wireframe_elements_local(image_path),
+                      fallback_reason=result['error'])
+    return result
+
+
+async def detect_elements_async(image_path, engine=None):
+    """
+    Async variant of detect_elements for the ASGI views. The local detector
+    and image preprocessing are CPU bound and run in worker threads.
+    """
+    engine = engine or settings.VISION_DETECTION_ENGINE
+    detect_local = sync_to_async(detect_wireframe_elements_local,
+                                 thread_sensitive=False)
+    if engine == 'local':
+        return await detect_local(image_path)
+
+    result = await detect_wireframe_elements_async(image_path)
+    if engine == 'auto' and result.get('error'):
+        logger.warning(
+            f"Vision failed ({result['error']}), using the local detector"
+        )
+        result = dict(await detect_local(image_path),
+                      fallback_reason=result['error'])
+    return result
+
+
+def detect_elements_batch(image_paths, engine=None):
+    """
+    Batch variant of detect_elements, see detect_wireframe_elements_batch.
+    """
+    engine = engine or settings.VISION_DETECTION_ENGINE
+    if engine == 'local':
+        return [detect_wireframe_elements_local(path) for path in image_paths]
+
+    results = detect_wireframe_elements_batch(image_paths)
+    if engine == 'auto':
+        for index, (path, result) in enumerate(zip(image_paths, results)):
+            if result.get('error'):
+                logger.warning(
+                    f"Vision failed ({result['error']}), "
+                    "using the local detector"
+                )
+                results[index] = dict(detect_wireframe_elements_local(path),
+                                      fallback_reason=result['error'])
+    return results
+
 def detect_wireframe_elements(image_path):
     """
     Detects UI elements from a wireframe using Google Vision API.
     Returns structured data about the detected elements.
     """
-    # Set the credentials file path explicitly
-    credentials_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'google_credentials.json')
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
-    
     try:
-        # Initialize the client
-        client = vision.ImageAnnotatorClient()
+        client = get_vision_client()
         
-        # Read image file
-        with io.open(image_path, 'rb') as image_file:
-            content = image_file.read()
+        # Shrink and simplify the image before uploading it
+        content, scale = preprocess_image(image_path)
 
         image = vision.Image(content=content)
         
-        # Get text annotations (for labels, buttons, text fields)
-        text_response = client.text_detection(image=image)
-        
-        # Get object localization (for UI components like buttons, input fields)
-        object_response = client.object_localization(image=image)
-        
-        # Process text detections
-        texts = text_response.text_annotations
-        
-        # Extract UI elements based on text and location
-        ui_elements = []
+        # Text detection and object localization in one round trip
+        response = get_limiter('vision').call(lambda: client.annotate_image({
+            'image': image,
+            'features': ANNOTATION_FEATURES,
+        }))
+        if response.error.message:
+            raise RuntimeError(response.error.message)
         
-        # Process the first text annotation which contains all text
-        full_text = ""
-        if texts:
-            full_text = texts[0].description
-            
-            # Process individual text blocks (after the first full-text item)
-            for text in texts[1:]:
-                # Get the bounding polygon
-                vertices = [(vertex.x, vertex.y) for vertex in text.bounding_poly.vertices]
-                
-                # Calculate width and height
-                width = max(vertices[1][0], vertices[2][0]) - min(vertices[0][0], vertices[3][0])
-                height = max(vertices[2][1], vertices[3][1]) - min(vertices[0][1], vertices[1][1])
-                
-                # Determine the type of UI element based on text and dimensions
-                element_type = classify_ui_element(text.description, width, height)
-                
-                ui_elements.append({
-                    'type': element_type,
-                    'text': text.description,
-                    'position': {
-                        'x': vertices[0][0],
-                        'y': vertices[0][1]
-                    },
-                    'width': width,
-                    'height': height
-                })
-        
-        # Process object localizations
-        for obj in object_response.localized_object_annotations:
-            ui_elements.append({
-                'type': 'object',
-                'name': obj.name,
-                'confidence': obj.score,
-                'bounding_box': {
-                    'x': obj.bounding_poly.normalized_vertices[0].x,
-                    'y': obj.bounding_poly.normalized_vertices[0].y,
-                    'width': (obj.bounding_poly.normalized_vertices[1].x - obj.bounding_poly.normalized_vertices[0].x),
-                    'height': (obj.bounding_poly.normalized_vertices[2].y - obj.bounding_poly.normalized_vertices[0].y)
-                }
-            })
-        
-        # Return detected UI elements and full text
+        return parse_annotation_response(response, scale)
+    except Exception as e:
+        print(f"Error in Vision API processing: {str(e)}")
         return {
-            'elements': ui_elements,
-            'full_text': full_text
+            'elements': [],
+            'full_text': '',
+            'error': str(e)
         }
+
+
+async def detect_wireframe_elements_async(image_path):
+    """
+    Async variant of detect_wireframe_elements, using the Vision async
+    client. The async client has no annotate_image helper, so the image is
+    sent as a batch of one.
+    """
+    try:
+        client = get_vision_async_client()
+
+        content, scale = await sync_to_async(
+            preprocess_image, thread_sensitive=False
+        )(image_path)
+
+        batch_response = await get_limiter('vision').call_async(
+            lambda: client.batch_annotate_images(requests=[{
+                'image': vision.Image(content=content),
+                'features': ANNOTATION_FEATURES,
+            }])
+        )
+        response = batch_response.responses[0]
+        if response.error.message:
+            raise RuntimeError(response.error.message)
+
+        return parse_annotation_response(response, scale)
     except Exception as e:
         print(f"Error in Vision API processing: {str(e)}")
         return {
@@ -94,33 +216,172 @@ def detect_wireframe_elements(image_path):
             'error': str(e)
         }
 
+
+def _error_result(message):
+    return {'elements': [], 'full_text': '', 'error': message}
+
+
+def detect_wireframe_elements_batch(image_paths):
+    """
+    Detects UI elements for many wireframes, packing up to VISION_BATCH_SIZE
+    images into each batch_annotate_images request.
+
+    An image that can't be read or whose response can't be parsed only
+    fails its own result; the rest of its batch goes ahead.
+
+    Args:
+        image_paths (list): Paths of the images to annotate
+
+    Returns:
+        list: One result per path, in the same order and with the same
+        structure as detect_wireframe_elements (including 'error' on failure)
+    """
+    results = [None] * len(image_paths)
+    for start in range(0, len(image_paths), VISION_BATCH_SIZE):
+        indexes = []
+        requests = []
+        scales = []
+        end = min(start + VISION_BATCH_SIZE, len(image_paths))
+        for index in range(start, end):
+            try:
+                content, scale = preprocess_image(image_paths[index])
+            except Exception as e:
+                logger.warning(
+                    f"Could not prepare {image_paths[index]} for Vision: {e}"
+                )
+                results[index] = _error_result(str(e))
+                continue
+            indexes.append(index)
+            scales.append(scale)
+            requests.append({
+                'image': vision.Image(content=content),
+                'features': ANNOTATION_FEATURES,
+            })
+        if not requests:
+            continue
+
+        try:
+            client = get_vision_client()
+            # Vision's quota counts every image of the batch
+            batch_response = get_limiter('vision').call(
+                lambda: client.batch_annotate_images(requests=requests),
+                units=len(requests),
+            )
+        except Exception as e:
+            print(f"Error in Vision API batch processing: {str(e)}")
+            for index in indexes:
+                results[index] = _error_result(str(e))
+            continue
+
+        responses = batch_response.responses
+        for index, response, scale in zip(indexes, responses, scales):
+            if response.error.message:
+                results[index] = _error_result(response.error.message)
+                continue
+            try:
+                results[index] = parse_annotation_response(response, scale)
+            except Exception as e:
+                logger.exception(
+                    "Could not parse the Vision response for "
+                    f"{image_paths[index]}"
+                )
+                results[index] = _error_result(str(e))
+    return results
+
+
+def parse_annotation_response(response, scale=(1.0, 1.0)):
+    """
+    Converts a Vision AnnotateImageResponse into the structure used by the
+    rest of the pipeline: {'elements': [...], 'full_text': str}.
+
+    scale is the (x, y) factor returned by preprocess_image; pixel
+    coordinates are mapped back to the original image with it before the
+    elements are classified. Object bounding boxes are normalized (0-1) and
+    need no mapping.
+
+    With VISION_LAYOUT_ANALYSIS on, words are grouped into blocks (see
+    layout.group_words) and each block becomes one element.
+    """
+    scale_x, scale_y = scale
+    # Process text detections
+    texts = response.text_annotations
+
+    # Extract UI elements based on text and location
+    ui_elements = []
+
+    # Process the first text annotation which contains all text
+    full_text = ""
+    if texts:
+        full_text = texts[0].description
+
+        # Process individual text blocks (after the first full-text item)
+        for text in texts[1:]:
+            # Get the bounding polygon
+            vertices = [
+                (round(vertex.x * scale_x), round(vertex.y * scale_y))
+                for vertex in text.bounding_poly.vertices
+            ]
+
+            # Calculate width and height
+            width = (
+                max(vertices[1][0], vertices[2][0])
+                - min(vertices[0][0], vertices[3][0])
+            )
+            height = (
+                max(vertices[2][1], vertices[3][1])
+                - min(vertices[0][1], vertices[1][1])
+            )
+
+            ui_elements.append({
+                'type': None,
+                'text': text.description,
+                'position': {
+                    'x': vertices[0][0],
+                    'y': vertices[0][1]
+                },
+                'width': width,
+                'height': height
+            })
+
+        # Merge words into lines and blocks with layout positions
+        if settings.VISION_LAYOUT_ANALYSIS:
+            ui_elements = group_words(ui_elements)
+
+        # Determine the type of every UI element based on text and dimensions
+        element_types = classify_ui_elements(
+            [element['text'] for element in ui_elements],
+            [element['width'] for element in ui_elements],
+            [element['height'] for element in ui_elements],
+        )
+        for element, element_type in zip(ui_elements, element_types):
+            element['type'] = element_type
+
+    # Process object localizations
+    for obj in response.localized_object_annotations:
+        corners = obj.bounding_poly.normalized_vertices
+        ui_elements.append({
+            'type': 'object',
+            'name': obj.name,
+            'confidence': obj.score,
+            'bounding_box': {
+                'x': corners[0].x,
+                'y': corners[0].y,
+                'width': corners[1].x - corners[0].x,
+                'height': corners[2].y - corners[0].y
+            }
+        })
+
+    # Return detected UI elements and full text
+    return {
+        'elements': ui_elements,
+        'full_text': full_text
+    }
+
 def classify_ui_element(text, width, height):
     """
     Attempt to classify a UI element based on its text and dimensions.
-    """
-    text_lower = text.lower()
-    
-    # Check for navigation elements
-    if any(nav in text_lower for nav in ['nav', 'menu', 'home', 'about', 'contact']):
-        if width > height * 3:  # Horizontal nav
-            return 'navbar'
-        return 'menu'
     
-    # Check for buttons
-    if any(btn in text_lower for btn in ['submit', 'send', 'login', 'sign', 'create', 'delete', 'update']):
-        return 'button'
-    
-    # Check for form fields
-    if any(field in text_lower for field in ['name', 'email', 'password', 'username', 'address']):
-        return 'input_field'
-    
-    # Check for headers
-    if len(text) < 50 and height < 40:
-        return 'heading'
-    
-    # Default to paragraph for longer text
-    if len(text) > 50:
-        return 'paragraph'
-    
-    # Default
-    return 'text'
\ No newline at end of file
+    Single-annotation form of classification.classify_ui_elements; prefer
+    the batch call when classifying many annotations.
+    """
+    return classify_ui_elements([text], [width], [height])[0]
@@ -0,0 +1,35 @@
+server {
+    listen ${LISTEN_PORT};
+    listen 443 ssl;
+    server_name api.testproject.live;
+
+    ssl_certificate /etc/nginx/ssl/fullchain.pem;
+    ssl_certificate_key /etc/nginx/ssl/privkey.pem;
+    ssl_protocols TLSv1.2 TLSv1.3;
+    ssl_prefer_server_ciphers on;
+
+    location /static {
+        alias /vol/web/static;
+    }
+
+    location /media {
+        alias /vol/media;
+    }
+
+    location / {
+        proxy_pass              http://${APP_HOST}:${APP_PORT};
+        proxy_http_version      1.1;
+        proxy_set_header        Host $host;
+        proxy_set_header        X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header        X-Forwarded-Proto $scheme;
+        # Let the code stream (server-sent events) through as it's generated
+        proxy_buffering         off;
+        client_max_body_size    10M;
+    }
+}
+
+server {
+    listen 80;
+    server_name api.testproject.live;
+    return 301 https://$host$request_uri;
+}
\ No newline at end of file
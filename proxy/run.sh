@@ -1,7 +1,13 @@
 #!/bin/sh
 set -e
 
+# uWSGI speaks the uwsgi protocol, uvicorn plain HTTP
+TEMPLATE=/etc/nginx/default.conf.tpl
+if [ "$SERVER_MODE" = "asgi" ]; then
+  TEMPLATE=/etc/nginx/default-asgi.conf.tpl
+fi
+
 # Replace only required variables to avoid empty ones staying as-is
-envsubst '${LISTEN_PORT} ${APP_HOST} ${APP_PORT}' < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
+envsubst '${LISTEN_PORT} ${APP_HOST} ${APP_PORT}' < $TEMPLATE > /etc/nginx/conf.d/default.conf
 
 exec nginx -g "daemon off;"
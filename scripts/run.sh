@@ -15,5 +15,10 @@ echo 'Checking static directories...'
 python manage.py migrate
 python manage.py collectstatic --noinput
 
-echo 'Starting uWSGI server...'
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
\ No newline at end of file
+if [ "$SERVER_MODE" = "asgi" ]; then
+  echo 'Starting uvicorn server...'
+  uvicorn app.asgi:application --host 0.0.0.0 --port 9000 --workers ${ASGI_WORKERS:-2}
+else
+  echo 'Starting uWSGI server...'
+  uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
+fi
\ No newline at end of file